@@ -0,0 +1,1200 @@
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytz
+import sqlalchemy
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+import chunked
+import crud
+import database
+import ingest
+import localtime
+import migrations
+import models
+import observations
+import profiling
+import pushdown
+import reference
+import rollups
+import schema
+import shards
+import snapshot
+import status_buffer
+import store_lookup
+import synthetic
+import uptime
+import utils
+
+
+def legacy_uptime_downtime(data, current_time_only):
+    """Per-store, per-interval loop the report used before the vectorized engine."""
+    data["current_status"] = data.groupby("store_id")["status"].transform("last")
+    active_data = data[data["current_status"] == "active"]
+    business_hours = pd.date_range("00:00", "23:59", freq="15min").time
+
+    rows = []
+    for store in active_data["store_id"].unique():
+        store_data = active_data[active_data["store_id"] == store]
+        store_uptime = pd.DataFrame(index=business_hours)
+        store_downtime = pd.DataFrame(index=business_hours)
+
+        for interval in business_hours:
+            start_time = pd.Timestamp.combine(current_time_only, interval).tz_localize(
+                "UTC"
+            )
+            end_time = start_time + pd.Timedelta("15min")
+            interval_data = store_data[
+                (store_data["timestamp_utc"] >= start_time)
+                & (store_data["timestamp_utc"] < end_time)
+            ]
+            store_uptime[interval] = (interval_data["status"] == "active").sum()
+            store_downtime[interval] = (interval_data["status"] == "inactive").sum()
+
+        rows.append(
+            {
+                "store_id": store,
+                "uptime_last_hour": store_uptime.iloc[-4:].sum().sum(),
+                "uptime_last_day": store_uptime.iloc[-96:].sum().sum(),
+                "uptime_last_week": store_uptime.iloc[-672:].sum().sum(),
+                "downtime_last_hour": store_downtime.iloc[-4:].sum().sum(),
+                "downtime_last_day": store_downtime.iloc[-96:].sum().sum(),
+                "downtime_last_week": store_downtime.iloc[-672:].sum().sum(),
+            }
+        )
+    return pd.DataFrame(rows, columns=["store_id"] + uptime.METRIC_COLUMNS)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_uptime_engine():
+    data, current_time_only = crud.load_report_data()
+
+    expected, legacy_seconds = timed(
+        legacy_uptime_downtime, data.copy(), current_time_only
+    )
+    actual, engine_seconds = timed(
+        uptime.compute_uptime_downtime, data, current_time_only
+    )
+
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True),
+        expected.reset_index(drop=True),
+        check_dtype=False,
+    )
+    print(f"stores:  {len(actual)} active, {len(data)} observations")
+    print(f"legacy:  {legacy_seconds:.3f}s")
+    print(f"engine:  {engine_seconds:.4f}s")
+    print(f"speedup: {legacy_seconds / engine_seconds:.0f}x")
+
+
+class RoundTrips:
+    """Counts the statements an engine sends to the database."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def bench_batched_queries(url, stores=1000):
+    """Compares the per-store crud helpers with their batched variants."""
+    engine = create_engine(url)
+    ingest.load_table(engine, "test__stores", "timezones.csv")
+    ingest.load_table(engine, "test__business_hours", "menu_hours.csv")
+    ingest.load_table(engine, "test__store_status", "store_status.csv")
+
+    store_ids = pd.read_csv("store_status.csv")["store_id"].unique()[:stores]
+    store_ids = [int(store_id) for store_id in store_ids]
+    at = datetime(2023, 1, 25, 12, tzinfo=timezone.utc)
+    since = datetime(2023, 1, 24, 12, tzinfo=timezone.utc)
+    trips = RoundTrips(engine)
+
+    cases = [
+        (
+            "business hours",
+            lambda s, i: crud.get_business_hours(s, i),
+            lambda s: crud.get_business_hours_batch(s, store_ids),
+        ),
+        (
+            "timezone",
+            lambda s, i: crud.get_store_timezone(s, i),
+            lambda s: crud.get_store_timezones(s, store_ids),
+        ),
+        (
+            "latest status",
+            lambda s, i: crud.get_latest_status(s, i, at),
+            lambda s: crud.get_latest_statuses(s, store_ids, at),
+        ),
+        (
+            "statuses between",
+            lambda s, i: crud.get_statuses_between(s, i, since, at),
+            lambda s: crud.get_statuses_between_batch(s, store_ids, since, at),
+        ),
+    ]
+    print(f"{len(store_ids)} stores on {engine.dialect.name}")
+    for name, per_store, batched in cases:
+        with Session(engine) as session:
+            trips.count = 0
+            _, per_store_seconds = timed(
+                lambda: [per_store(session, i) for i in store_ids]
+            )
+            per_store_trips = trips.count
+        with Session(engine) as session:
+            trips.count = 0
+            _, batched_seconds = timed(batched, session)
+            batched_trips = trips.count
+        print(
+            f"{name:17} per-store: {per_store_trips:5} trips {per_store_seconds:.3f}s"
+            f"   batched: {batched_trips:2} trips {batched_seconds:.4f}s"
+        )
+
+
+def synthetic_status_csv(path, weeks):
+    """Writes store_status.csv repeated over `weeks` consecutive weeks."""
+    df = pd.read_csv("store_status.csv")
+    timestamps = pd.to_datetime(df["timestamp_utc"])
+    frames = []
+    for week in range(weeks):
+        frame = df.copy()
+        frame["timestamp_utc"] = (timestamps - pd.Timedelta(weeks=week)).dt.strftime(
+            "%Y-%m-%d %H:%M:%S.%f UTC"
+        )
+        frames.append(frame)
+    pd.concat(frames).to_csv(path, index=False)
+
+
+def bench_query_plans(url, weeks=52):
+    """Prints the query plans of the crud lookups against keyed, indexed tables."""
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    ingest.load_table(engine, "test__stores", "timezones.csv")
+    ingest.load_table(engine, "test__business_hours", "menu_hours.csv")
+    synthetic_status_csv("bench_status.csv", weeks)
+    ingest.load_table(engine, "test__store_status", "bench_status.csv")
+    os.remove("bench_status.csv")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+    store_id = int(pd.read_csv("store_status.csv")["store_id"].iloc[0])
+    at = datetime(2023, 1, 25, 12, tzinfo=timezone.utc)
+    since = datetime(2023, 1, 24, 12, tzinfo=timezone.utc)
+    lookups = {
+        "get_business_hours": lambda s: crud.get_business_hours(s, store_id),
+        "get_latest_status": lambda s: crud.get_latest_status(s, store_id, at),
+        "get_previous_status": lambda s: crud.get_previous_status(s, store_id, at),
+        "get_statuses_between": lambda s: crud.get_statuses_between(
+            s, store_id, since, at
+        ),
+        "get_latest_statuses": lambda s: crud.get_latest_statuses(s, [store_id], at),
+    }
+
+    explain = "EXPLAIN" if engine.dialect.name == "postgresql" else "EXPLAIN QUERY PLAN"
+    for name, lookup in lookups.items():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", capture)
+        with Session(engine) as session:
+            lookup(session)
+        event.remove(engine, "before_cursor_execute", capture)
+
+        print(f"== {name}")
+        with engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = connection.exec_driver_sql(f"{explain} {statement}", parameters)
+                for row in plan:
+                    print("   ", row[-1])
+
+
+def bench_report_pipeline(weeks=52):
+    """Wall time and peak traced memory of the report's load/filter stage."""
+    synthetic_status_csv("bench_status.csv", weeks)
+    try:
+        crud.load_report_data("bench_status.csv")  # warm the business hours cache
+        tracemalloc.start()
+        (data, _), seconds = timed(crud.load_report_data, "bench_status.csv")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        os.remove("bench_status.csv")
+    print(f"{weeks} weeks of status, {len(data)} rows in business hours")
+    print(f"load/filter: {seconds:.3f}s, peak {peak / 2**20:.1f} MiB")
+
+
+def bench_snapshot(weeks=52):
+    """Parsing store status text vs building and memory-mapping its snapshot."""
+    synthetic_status_csv("bench_status.csv", weeks)
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+
+        def parse():
+            df = pd.read_csv("bench_status.csv")
+            df["timestamp_utc"] = pd.to_datetime(df["timestamp_utc"])
+            return df
+
+        df, parse_seconds = timed(parse)
+        _, build_seconds = timed(snapshot.load_status, "bench_status.csv", snapshot_dir)
+        _, load_seconds = timed(snapshot.load_status, "bench_status.csv", snapshot_dir)
+    finally:
+        os.remove("bench_status.csv")
+        shutil.rmtree(snapshot_dir)
+    print(f"{weeks} weeks of status, {len(df)} rows")
+    print(f"csv parse:      {parse_seconds:.3f}s")
+    print(f"snapshot build: {build_seconds:.3f}s")
+    print(f"snapshot load:  {load_seconds * 1000:.1f}ms")
+
+
+def bench_observations(weeks=52, lookups=10_000):
+    """Memory and point-lookup latency of the ObservationIndex vs a pandas frame."""
+    synthetic_status_csv("bench_status.csv", weeks)
+    try:
+        df = pd.read_csv("bench_status.csv")
+    finally:
+        os.remove("bench_status.csv")
+    df["timestamp_utc"] = pd.to_datetime(df["timestamp_utc"])
+    # the wide frame the report used to keep per observation
+    df["time"] = df["timestamp_utc"].dt.time
+    df["day"] = df["timestamp_utc"].dt.dayofweek
+    df["hour"] = df["timestamp_utc"].dt.hour
+    df["week"] = df["timestamp_utc"].dt.isocalendar().week
+    df["current_status"] = df.groupby("store_id")["status"].transform("last")
+    index, build_seconds = timed(observations.ObservationIndex.from_frame, df)
+
+    rng = np.random.default_rng(0)
+    store_ids = rng.choice(index.store_ids, lookups)
+    at = pd.to_datetime(
+        rng.integers(index.timestamps_ns.min(), index.timestamps_ns.max(), lookups),
+        utc=True,
+    )
+    by_store = {store_id: group for store_id, group in df.groupby("store_id")}
+
+    def frame_lookups():
+        results = []
+        for store_id, timestamp in zip(store_ids, at):
+            rows = by_store[store_id]
+            rows = rows[rows["timestamp_utc"] <= timestamp]
+            if len(rows) == 0:
+                results.append((None, None))
+            else:
+                row = rows.loc[rows["timestamp_utc"].idxmax()]
+                results.append((row["status"], row["timestamp_utc"]))
+        return results
+
+    def index_lookups():
+        return [
+            index.latest_status(store_id, timestamp)
+            for store_id, timestamp in zip(store_ids, at)
+        ]
+
+    expected, frame_seconds = timed(frame_lookups)
+    actual, index_seconds = timed(index_lookups)
+    assert actual == expected
+
+    window = pd.Timedelta(hours=6)
+    for store_id, timestamp in zip(store_ids[:200], at[:200]):
+        rows = by_store[store_id]
+        rows = rows[
+            (rows["timestamp_utc"] >= timestamp - window)
+            & (rows["timestamp_utc"] < timestamp)
+        ].sort_values("timestamp_utc", kind="stable")
+        assert sorted(
+            index.statuses_between(store_id, timestamp - window, timestamp)
+        ) == sorted(zip(rows["status"], rows["timestamp_utc"]))
+
+    frame_bytes = df.memory_usage(deep=True).sum()
+    print(
+        f"{weeks} weeks of status, {len(index)} observations, {len(index.store_ids)} stores"
+    )
+    print(f"frame:  {frame_bytes / 2**20:8.1f} MiB")
+    print(f"index:  {index.nbytes / 2**20:8.1f} MiB (built in {build_seconds:.3f}s)")
+    print(
+        f"latest_status x{lookups}: frame {frame_seconds:.3f}s,"
+        f" index {index_seconds:.3f}s ({index_seconds / lookups * 1e6:.1f}us each)"
+    )
+
+
+def bench_shards(stores=20_000, workers=(1, 2, 4, 8)):
+    """Report wall time at several worker counts on a synthetic fleet."""
+    directory = tempfile.mkdtemp()
+    try:
+        timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+            directory, stores
+        )
+        paths = (status_path, menu_hours_path, timezones_path)
+        # build the snapshot and business hours cache outside the timings
+        data, reference_data, now = crud.load_report_inputs(
+            status_path, menu_hours_path, timezones_path
+        )
+        expected, serial_seconds = timed(
+            uptime.time_weighted_uptime_downtime,
+            data,
+            reference_data.intervals,
+            now,
+            "previous",
+            reference_data.zones,
+        )
+        _, load_seconds = timed(
+            crud.load_report_inputs, status_path, menu_hours_path, timezones_path
+        )
+        serial_seconds += load_seconds
+
+        print(f"{stores} stores, {len(data)} observations")
+        print(f"serial:    {serial_seconds:.3f}s")
+        for count in workers:
+            (actual, _), seconds = timed(shards.compute_report, count, *paths)
+            pd.testing.assert_frame_equal(actual, expected)
+            print(
+                f"{count} workers: {seconds:.3f}s"
+                f"  speedup {serial_seconds / seconds:.2f}x"
+            )
+    finally:
+        for name in os.listdir(directory):
+            snapshot.discard(os.path.join(directory, name))
+        shutil.rmtree(directory)
+    print(f"cpus: {os.cpu_count()}")
+
+
+def bench_rollups(history=(1, 4, 12)):
+    """Report time from the rollups vs recomputing it, as status history grows."""
+    for weeks in history:
+        directory = tempfile.mkdtemp()
+        status_path = os.path.join(directory, "store_status.csv")
+        try:
+            engine = create_engine(f"sqlite:///{directory}/bench.db")
+            migrations.upgrade(engine)
+            synthetic_status_csv(status_path, weeks)
+            df = pd.read_csv(status_path)
+            timestamps = pd.to_datetime(df["timestamp_utc"])
+            last_hour = timestamps >= timestamps.max() - pd.Timedelta(hours=1)
+            df[~last_hour].to_csv(status_path, index=False)
+            ingest.ingest_status_delta(engine, status_path)
+            _, delta_seconds = timed(
+                ingest.ingest_status_delta,
+                engine,
+                "bench",
+                io.StringIO(df[last_hour].to_csv(index=False)),
+            )
+            df.to_csv(status_path, index=False)
+
+            with engine.connect() as connection:
+                actual, rollup_seconds = timed(
+                    rollups.compute_uptime_downtime, connection
+                )
+
+            def recompute():
+                data, reference_data, now = crud.load_report_inputs(status_path)
+                return uptime.time_weighted_uptime_downtime(
+                    data, reference_data.intervals, now, zones=reference_data.zones
+                )
+
+            expected, recompute_seconds = timed(recompute)
+            pd.testing.assert_frame_equal(
+                actual,
+                expected.sort_values("store_id", ignore_index=True),
+                check_dtype=False,
+            )
+            engine.dispose()
+        finally:
+            snapshot.discard(status_path)
+            shutil.rmtree(directory)
+        print(
+            f"{weeks:3} weeks, {len(df):7} rows: last-hour ingest {delta_seconds:.3f}s"
+            f"   report from rollups {rollup_seconds:.4f}s"
+            f"   recomputed {recompute_seconds:.3f}s   {len(actual)} rows match"
+        )
+
+
+def bench_pushdown(url=None, stores=10_000):
+    """Report computed in the database vs fetching its status rows to compute it."""
+    directory = tempfile.mkdtemp()
+    try:
+        timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+            directory, stores
+        )
+        engine = database.make_engine(url or f"sqlite:///{directory}/bench.db")
+        models.Base.metadata.drop_all(engine)
+        # loaded as the app loads them
+        ingest.warm_up(
+            engine,
+            {
+                "test__stores": timezones_path,
+                "test__business_hours": menu_hours_path,
+                "test__store_status": status_path,
+            },
+        )
+
+        with engine.connect() as connection:
+            actual, sql_seconds = timed(pushdown.compute_uptime_downtime, connection)
+            fetched, fetch_seconds = timed(
+                lambda: connection.execute(pushdown.status_table.select()).all()
+            )
+        data, reference_data, now = crud.load_report_inputs(
+            status_path, menu_hours_path, timezones_path
+        )
+        expected = uptime.time_weighted_uptime_downtime(
+            data, reference_data.intervals, now, zones=reference_data.zones
+        )
+        pd.testing.assert_frame_equal(
+            actual, expected.sort_values("store_id", ignore_index=True)
+        )
+        print(f"{engine.dialect.name}, {stores} stores")
+        print(f"in the database: {sql_seconds:.3f}s, {len(actual)} rows returned")
+        print(f"fetching status: {fetch_seconds:.3f}s, {len(fetched)} rows returned")
+        engine.dispose()
+    finally:
+        for name in os.listdir(directory):
+            snapshot.discard(os.path.join(directory, name))
+        shutil.rmtree(directory)
+
+
+def bench_chunked(
+    url=None, stores=10_000, days=28, budgets=(16 << 20, 64 << 20, 256 << 20)
+):
+    """
+    Times the chunked report and traces its peak memory at several budgets,
+    next to the in-memory report. test_uptime.py checks that they match.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+            directory, stores, days
+        )
+        engine = database.make_engine(url or f"sqlite:///{directory}/bench.db")
+        models.Base.metadata.drop_all(engine)
+        migrations.upgrade(engine)
+        ingest.load_all(
+            engine,
+            sources={
+                "test__stores": timezones_path,
+                "test__business_hours": menu_hours_path,
+                "test__store_status": status_path,
+            },
+        )
+
+        data, reference_data, now = crud.load_report_inputs(
+            status_path, menu_hours_path, timezones_path
+        )
+        tracemalloc.start()
+        expected, memory_seconds = timed(
+            uptime.time_weighted_uptime_downtime,
+            data,
+            reference_data.intervals,
+            now,
+            "previous",
+            reference_data.zones,
+        )
+        _, memory_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{engine.dialect.name}, {stores} stores, {days} days,"
+            f" {len(data)} observations"
+        )
+        print(
+            f"in memory: {memory_seconds:.3f}s, peak {memory_peak / 2**20:.1f} MiB"
+            " (observations already loaded)"
+        )
+        del data
+
+        for budget in budgets:
+            with engine.connect() as connection:
+
+                def report():
+                    return list(
+                        chunked.stream_report(
+                            connection, budget, menu_hours_path, timezones_path
+                        )
+                    )
+
+                parts, seconds = timed(report)
+                # traced separately, as tracing slows the fetch loop down
+                tracemalloc.start()
+                report()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            print(
+                f"budget {budget / 2**20:.0f} MiB: {seconds:.3f}s,"
+                f" {len(parts)} parts from chunks of {chunked.chunk_rows_for(budget)} rows,"
+                f" peak {peak / 2**20:.1f} MiB, {sum(map(len, parts))} rows"
+                f" ({len(expected)} in memory)"
+            )
+        engine.dispose()
+    finally:
+        for name in os.listdir(directory):
+            snapshot.discard(os.path.join(directory, name))
+        shutil.rmtree(directory)
+
+
+def bench_store_lookup(url=None, stores=10_000, lookups=2_000, batch=100):
+    """Latency of per-store uptime lookups from the rollups, cold and cached."""
+    directory = tempfile.mkdtemp()
+    try:
+        timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+            directory, stores
+        )
+        engine = database.make_engine(url or f"sqlite:///{directory}/bench.db")
+        models.Base.metadata.drop_all(engine)
+        migrations.upgrade(engine)
+        ingest.load_all(
+            engine,
+            sources={
+                "test__stores": timezones_path,
+                "test__business_hours": menu_hours_path,
+                "test__store_status": status_path,
+            },
+        )
+
+        with engine.connect() as connection:
+            report = rollups.compute_uptime_downtime(
+                connection,
+                menu_hours_path=menu_hours_path,
+                timezones_path=timezones_path,
+            )
+            store_ids = connection.execute(select(rollups.latest.c.store_id)).scalars()
+            store_ids = np.array(list(store_ids))
+            rng = np.random.default_rng(0)
+
+            # the endpoints' work: a connection, the version check and the lookup
+            def latencies(ids, size):
+                seconds = []
+                for first in range(0, len(ids), size):
+                    started = time.perf_counter()
+                    with engine.connect() as lookup_connection:
+                        rows = store_lookup.lookup(
+                            lookup_connection,
+                            ids[first : first + size],
+                            menu_hours_path,
+                            timezones_path,
+                        )
+                    seconds.append(time.perf_counter() - started)
+                return np.array(seconds) * 1000, rows
+
+            sample = rng.permutation(store_ids)[:lookups]
+            store_lookup.clear()
+            cold, _ = latencies(sample, 1)
+            warm, _ = latencies(rng.permutation(sample), 1)
+            store_lookup.clear()
+            batch_cold, _ = latencies(sample, batch)
+            batch_warm, rows = latencies(rng.permutation(sample), batch)
+
+        # the looked-up rows of currently active stores are the rows of the
+        # time-weighted report recomputed from the status CSV
+        data, reference_data, now = crud.load_report_inputs(
+            status_path, menu_hours_path, timezones_path
+        )
+        expected = uptime.time_weighted_uptime_downtime(
+            data, reference_data.intervals, now, zones=reference_data.zones
+        ).set_index("store_id")
+        assert report["store_id"].isin(expected.index).all()
+        for row in rows.values():
+            assert (row["status"] == "active") == (row["store_id"] in expected.index)
+            if row["status"] == "active":
+                for column in uptime.METRIC_COLUMNS:
+                    assert row[column] == expected.at[row["store_id"], column]
+
+        print(f"{engine.dialect.name}, {stores} stores, latency in ms (p50 / p99)")
+        for name, seconds in (
+            ("single, cold", cold),
+            ("single, cached", warm),
+            (f"batch of {batch}, cold", batch_cold),
+            (f"batch of {batch}, cached", batch_warm),
+        ):
+            print(
+                f"{name:22} {np.percentile(seconds, 50):7.3f}"
+                f" / {np.percentile(seconds, 99):7.3f}"
+            )
+        print(store_lookup.cache_info())
+        engine.dispose()
+    finally:
+        for name in os.listdir(directory):
+            snapshot.discard(os.path.join(directory, name))
+        shutil.rmtree(directory)
+
+
+def bench_status_ingest(url=None, observations=200_000, batch=1000, per_row=2000):
+    """
+    Observations per second through POST /status's parsing and write buffer,
+    against validating each one as a schema.Status and inserting it alone.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        engine = database.make_engine(url or f"sqlite:///{directory}/bench.db")
+        models.Base.metadata.drop_all(engine)
+        migrations.upgrade(engine)
+        rng = np.random.default_rng(0)
+        start = pd.Timestamp("2023-01-25", tz="UTC")
+        timestamps = start + pd.to_timedelta(
+            np.sort(rng.integers(3600 * 10**6, size=observations)), unit="us"
+        )
+        records = [
+            {
+                "store_id": int(store_id),
+                "status": "active" if active else "inactive",
+                "timestamp_utc": timestamp.isoformat(),
+            }
+            for store_id, active, timestamp in zip(
+                rng.integers(10_000, size=observations),
+                rng.random(observations) < 0.9,
+                timestamps,
+            )
+        ]
+        bodies = [
+            "\n".join(json.dumps(record) for record in records[i : i + batch])
+            for i in range(0, observations, batch)
+        ]
+
+        def per_row_inserts():
+            with Session(engine) as session:
+                for record in records[:per_row]:
+                    status = schema.Status(**record)
+                    session.add(
+                        models.StoreStatus(
+                            store_id=status.store_id,
+                            status=status.status,
+                            timestamp_utc=pd.Timestamp(status.timestamp_utc),
+                        )
+                    )
+                    session.commit()
+
+        _, per_row_seconds = timed(per_row_inserts)
+        with engine.begin() as connection:
+            connection.execute(models.StoreStatus.__table__.delete())
+
+        def buffered():
+            for body in bodies:
+                status_buffer.submit(
+                    engine,
+                    status_buffer.parse_observations(body, "application/x-ndjson"),
+                )
+            status_buffer.stop()
+
+        _, seconds = timed(buffered)
+        with engine.connect() as connection:
+            stored = connection.execute(
+                select(sqlalchemy.func.count()).select_from(models.StoreStatus)
+            ).scalar()
+        expected = len({(r["store_id"], r["timestamp_utc"]) for r in records})
+        assert stored == expected, f"{stored} of {expected} observations stored"
+        info = status_buffer.buffer_info()
+        print(
+            f"{engine.dialect.name}, {observations} observations in batches of {batch}"
+        )
+        print(
+            f"buffered: {seconds:.3f}s, {observations / seconds:,.0f} rows/s,"
+            f" {info['flushes']} flushes, {stored} rows stored"
+        )
+        print(
+            f"per row:  {per_row / per_row_seconds:,.0f} rows/s"
+            f" ({per_row} rows, schema.Status and a commit each)"
+        )
+        engine.dispose()
+    finally:
+        shutil.rmtree(directory)
+
+
+def brute_force_uptime(data, intervals, now, rule, zones=None):
+    """
+    Reference for uptime.time_weighted_uptime_downtime, one minute at a time.
+
+    Each minute of the last week takes the status of the previous (or the
+    nearest, later on ties) poll and counts when its start is in business
+    hours, so polls and business hours must fall on whole minutes. With
+    `zones`, each minute is checked at its store's wall-clock time.
+    Returns {store_id: {metric: minutes}}.
+    """
+    now_ns = pd.Timestamp(now).value
+    minutes = now_ns - np.arange(7 * 24 * 60, 0, -1, dtype=np.int64) * 60 * uptime.NS
+    result = {}
+    for store_id, polls in data.groupby("store_id", sort=False):
+        polls = polls.sort_values("timestamp_utc")
+        timestamps_ns = uptime.epoch_ns(polls["timestamp_utc"])
+        is_active = (polls["status"] == "active").to_numpy()
+        previous = np.searchsorted(timestamps_ns, minutes, side="right") - 1
+        if rule == "previous":
+            poll = np.maximum(previous, 0)
+        else:
+            following = np.minimum(previous + 1, len(timestamps_ns) - 1)
+            closer = np.abs(timestamps_ns[following] - minutes) <= np.abs(
+                minutes - timestamps_ns[np.maximum(previous, 0)]
+            )
+            poll = np.where((previous < 0) | closer, following, previous)
+        clock = minutes
+        if zones is not None:
+            zone_codes, zone_names = zones([store_id])
+            clock = localtime.to_local(
+                minutes, np.full(len(minutes), zone_codes[0]), zone_names
+            )
+        open_ = uptime.in_business_hours(
+            intervals, np.full(len(minutes), store_id), clock
+        )
+        result[store_id] = {}
+        for window, (length, _) in uptime.WINDOWS.items():
+            counted = open_ & (minutes >= now_ns - length.value)
+            result[store_id][f"uptime_{window}"] = int(
+                (counted & is_active[poll]).sum()
+            )
+            result[store_id][f"downtime_{window}"] = int(
+                (counted & ~is_active[poll]).sum()
+            )
+    return result
+
+
+def random_case(rng, stores=5):
+    """Random business hours and polls on whole minutes, for the brute force."""
+    now = pd.Timestamp("2023-01-25 18:00", tz="UTC") + pd.Timedelta(
+        minutes=int(rng.integers(7 * 24 * 60))
+    )
+    hours, polls = [], []
+    for store_id in range(stores):
+        for _ in range(rng.integers(4)):
+            start, end = rng.integers(24 * 60, size=2)
+            hours.append(
+                {
+                    "store_id": store_id,
+                    "day": int(rng.integers(7)),
+                    "start_time_local": f"{start // 60:02d}:{start % 60:02d}:00",
+                    "end_time_local": f"{end // 60:02d}:{end % 60:02d}:00",
+                    "utc_offset_seconds": int(rng.integers(-48, 57)) * 900,
+                }
+            )
+        # polls on even minutes, so the nearest rule's midpoints are whole minutes
+        count = rng.integers(1, 40)
+        ago = rng.choice(9 * 24 * 30, size=count, replace=False) * 2
+        for minutes_ago in ago:
+            polls.append(
+                {
+                    "store_id": store_id,
+                    "status": "active" if rng.random() < 0.7 else "inactive",
+                    "timestamp_utc": now - pd.Timedelta(minutes=int(minutes_ago)),
+                }
+            )
+    business_hours_df = pd.DataFrame(
+        hours,
+        columns=[
+            "store_id",
+            "day",
+            "start_time_local",
+            "end_time_local",
+            "utc_offset_seconds",
+        ],
+    )
+    return pd.DataFrame(polls), business_hours_df, now
+
+
+# zones with DST changes in either direction and hemisphere, and one without
+DST_ZONES = [
+    "America/New_York",
+    "America/Chicago",
+    "Europe/Berlin",
+    "Australia/Sydney",
+    "Asia/Kolkata",
+]
+# weeks ending just after a DST change in some of DST_ZONES
+DST_WEEKS = ["2023-03-14", "2023-03-28", "2023-04-04", "2023-10-03", "2023-11-07"]
+
+
+def random_dst_case(rng, stores=5):
+    """
+    A random case moved to a week with DST changes, its stores spread over
+    DST_ZONES and their business hours in local time.
+
+    Returns the polls, the local business hours, now and a zones function
+    as ReferenceData.zones.
+    """
+    data, business_hours_df, now = random_case(rng, stores)
+    week_end = pd.Timestamp(
+        DST_WEEKS[rng.integers(len(DST_WEEKS))], tz="UTC"
+    ) + pd.Timedelta(minutes=2 * int(rng.integers(2 * 24 * 30)))
+    data["timestamp_utc"] += week_end - now
+    business_hours_df["utc_offset_seconds"] = 0
+    zone_codes = rng.integers(len(DST_ZONES), size=stores)
+
+    def zones(store_ids):
+        return zone_codes[np.asarray(store_ids, dtype=np.int64)], DST_ZONES
+
+    return data, business_hours_df, week_end, zones
+
+
+def bench_interpolation(stores=10_000):
+    """
+    Times the time-weighted kernel on a synthetic fleet. test_uptime.py
+    checks it against brute_force_uptime.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+            directory, stores
+        )
+        data, reference_data, now = crud.load_report_inputs(
+            status_path, menu_hours_path, timezones_path
+        )
+        report, seconds = timed(
+            uptime.time_weighted_uptime_downtime,
+            data,
+            reference_data.intervals,
+            now,
+            "previous",
+            reference_data.zones,
+        )
+        print(
+            f"{stores} stores, {len(data)} polls: {seconds:.3f}s,"
+            f" {len(report)} currently active stores"
+        )
+    finally:
+        for name in os.listdir(directory):
+            snapshot.discard(os.path.join(directory, name))
+        shutil.rmtree(directory)
+
+
+def bench_timezones(rows=1_000_000, loop_rows=20_000, seed=0):
+    """
+    Checks localtime's offset tables against pandas, then times them
+    against converting one value at a time with pytz.
+    """
+    rng = np.random.default_rng(seed)
+    zone_names = pytz.common_timezones
+    zone_codes = rng.integers(len(zone_names), size=rows)
+    start = pd.Timestamp("2019-01-01").value
+    end = pd.Timestamp("2027-01-01").value
+    # whole minutes, so every wall time is one pandas can localize
+    timestamps_ns = (
+        rng.integers(start, end, size=rows) // 60 // uptime.NS * 60 * uptime.NS
+    )
+
+    local_ns, seconds = timed(localtime.to_local, timestamps_ns, zone_codes, zone_names)
+    utc_ns, utc_seconds = timed(localtime.to_utc, local_ns, zone_codes, zone_names)
+    mismatches = ambiguous = 0
+    for code, timezone_str in enumerate(zone_names):
+        selected = zone_codes == code
+        # pytz's zones, as pandas would otherwise use the system's tz database
+        zone = pytz.timezone(timezone_str)
+        instants = pd.DatetimeIndex(timestamps_ns[selected], tz="UTC")
+        expected = instants.tz_convert(zone).tz_localize(None)
+        mismatches += int((expected.asi8 != local_ns[selected]).sum())
+        # wall times repeated when clocks go back map to the later instant
+        localized = expected.tz_localize(
+            zone,
+            ambiguous=np.zeros(len(expected), dtype=bool),
+            nonexistent="shift_forward",
+        ).tz_convert("UTC")
+        mismatches += int((localized.asi8 != utc_ns[selected]).sum())
+        ambiguous += int((instants.asi8 != utc_ns[selected]).sum())
+    assert mismatches == 0, f"{mismatches} conversions differ from pandas"
+    print(
+        f"{rows} instants in {len(zone_names)} zones match pandas"
+        f" ({ambiguous} in repeated wall-clock hours)"
+    )
+
+    def per_row():
+        zones = [pytz.timezone(name) for name in zone_names]
+        return [
+            datetime.fromtimestamp(value / uptime.NS, timezone.utc).astimezone(
+                zones[code]
+            )
+            for value, code in zip(
+                timestamps_ns[:loop_rows].tolist(), zone_codes[:loop_rows].tolist()
+            )
+        ]
+
+    _, loop_seconds = timed(per_row)
+    loop_seconds *= rows / loop_rows
+    print(f"to_local: {seconds:.3f}s, to_utc: {utc_seconds:.3f}s")
+    print(
+        f"per-row pytz: {loop_seconds:.3f}s (extrapolated from {loop_rows} rows),"
+        f" {loop_seconds / seconds:.0f}x slower"
+    )
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _suite_run(url, stores, days, directory):
+    """Times startup, business hours conversion and reports for one fleet."""
+    timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+        directory, stores, days
+    )
+    sources = {
+        "test__stores": timezones_path,
+        "test__business_hours": menu_hours_path,
+        "test__store_status": status_path,
+    }
+    engine = database.make_engine(url or f"sqlite:///{directory}/bench.db")
+    results = {"stores": stores, "days": days, "dialect": engine.dialect.name}
+    try:
+        # start from an empty database, as a fresh deployment would
+        models.Base.metadata.drop_all(engine)
+
+        # the steps of `python ingest.py load`
+        _, results["migrate_seconds"] = timed(migrations.upgrade, engine)
+        business_hours_df, results["business_hours_cold_seconds"] = timed(
+            utils.load_business_hours_utc, menu_hours_path, timezones_path
+        )
+        ingest_stats, results["ingest_seconds"] = timed(
+            ingest.load_all, engine, business_hours_df, sources
+        )
+        # seconds per table; store_status is the incremental delta
+        results["ingest"] = {
+            stats.get("table", "test__store_status"): stats["seconds"]
+            for stats in ingest_stats
+        }
+        results["startup_seconds"] = (
+            results["migrate_seconds"]
+            + results["business_hours_cold_seconds"]
+            + results["ingest_seconds"]
+        )
+
+        # business hours conversion on its own, and through the on-disk cache
+        timezone_df = snapshot.load_timezones(timezones_path)
+        timezone_dict = dict(zip(timezone_df.store_id, timezone_df.timezone_str))
+        menu_hours_df = snapshot.load_business_hours(menu_hours_path)
+        report_date = snapshot.load_status(status_path)["timestamp_utc"].max().date()
+        _, results["business_hours_convert_seconds"] = timed(
+            utils.convert_business_hours_to_utc,
+            menu_hours_df,
+            timezone_dict,
+            report_date,
+        )
+        _, results["business_hours_cached_seconds"] = timed(
+            utils.load_business_hours_utc, menu_hours_path, timezones_path
+        )
+        results["business_hours_rows"] = len(menu_hours_df)
+
+        # full reports: recomputed from the csv (first run parses it into a
+        # snapshot), and summed from the rollups ingest maintained
+        def csv_report():
+            with profiling.profile() as stages:
+                data, report_date = crud.load_report_data(
+                    status_path, None, menu_hours_path, timezones_path
+                )
+                with profiling.stage("uptime", rows_in=len(data)) as stage:
+                    report = uptime.compute_uptime_downtime(data, report_date)
+                    stage["rows_out"] = len(report)
+            return report, stages
+
+        snapshot.discard(status_path)
+        (_, stages), results["report_csv_cold_seconds"] = timed(csv_report)
+        (report, stages), results["report_csv_warm_seconds"] = timed(csv_report)
+        results["report_csv_stages"] = {
+            record["name"]: record["seconds"] for record in stages
+        }
+        results["report_rows"] = len(report)
+        results["status_rows"] = stages[0]["rows_out"]
+        results["report_csv_peak_rss_bytes"] = max(
+            record["peak_rss_bytes"] for record in stages
+        )
+        with engine.connect() as connection:
+            _, results["report_rollups_seconds"] = timed(
+                rollups.compute_uptime_downtime, connection
+            )
+    finally:
+        engine.dispose()
+        # the business hours cache entries of this fleet
+        key = (
+            snapshot.checksum(menu_hours_path)[:8]
+            + snapshot.checksum(timezones_path)[:8]
+        )
+        for path in glob.glob(os.path.join(utils.CACHE_DIR, f"*-{key}-*")):
+            os.remove(path)
+        for path in glob.glob(os.path.join(reference.REFERENCE_DIR, f"{key}-*")):
+            shutil.rmtree(path)
+        for path in sources.values():
+            snapshot.discard(path)
+    return {
+        key: round(value, 4) if isinstance(value, float) else value
+        for key, value in results.items()
+    }
+
+
+def bench_suite(stores=(1000, 10_000, 100_000), days=7, url=None, output=None):
+    """
+    Times startup, business hours conversion and reports on synthetic fleets.
+
+    Each fleet size gets a fresh database: a temporary SQLite file, or the
+    database at `url` (which is emptied). Results and the environment are
+    written as JSON, by default to bench_results/<commit>.json, for comparing
+    commits.
+    """
+    commit = _git_commit()
+    results = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "sqlalchemy": sqlalchemy.__version__,
+        },
+        "runs": [],
+    }
+    for count in stores:
+        directory = tempfile.mkdtemp()
+        try:
+            run = _suite_run(url, count, days, directory)
+        finally:
+            shutil.rmtree(directory)
+        results["runs"].append(run)
+        print(
+            f"{count:7} stores, {run['status_rows']:9} rows:"
+            f" startup {run['startup_seconds']:.2f}s"
+            f" (ingest {run['ingest_seconds']:.2f}s)"
+            f"   business hours {run['business_hours_convert_seconds']:.3f}s"
+            f"   report csv {run['report_csv_cold_seconds']:.2f}s cold"
+            f" / {run['report_csv_warm_seconds']:.2f}s warm"
+            f"   rollups {run['report_rollups_seconds']:.3f}s"
+        )
+
+    if output is None:
+        output = os.path.join("bench_results", f"{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store monitoring benchmarks")
+    benches = parser.add_subparsers(dest="bench", required=True)
+    benches.add_parser("engine", help="per-store loop vs vectorized uptime engine")
+    queries_parser = benches.add_parser(
+        "queries", help="per-store crud helpers vs batched variants"
+    )
+    queries_parser.add_argument("--url", default="sqlite:///bench.db")
+    queries_parser.add_argument("--stores", type=int, default=1000)
+    plans_parser = benches.add_parser(
+        "plans", help="query plans of the crud lookups on indexed tables"
+    )
+    plans_parser.add_argument("--url", default="sqlite:///bench.db")
+    plans_parser.add_argument("--weeks", type=int, default=52)
+    pipeline_parser = benches.add_parser(
+        "pipeline", help="wall time and peak memory of the report load/filter stage"
+    )
+    pipeline_parser.add_argument("--weeks", type=int, default=52)
+    snapshot_parser = benches.add_parser(
+        "snapshot", help="csv parsing vs memory-mapped snapshot loads"
+    )
+    snapshot_parser.add_argument("--weeks", type=int, default=52)
+    observations_parser = benches.add_parser(
+        "observations", help="memory and lookups of the in-memory observation index"
+    )
+    observations_parser.add_argument("--weeks", type=int, default=52)
+    shards_parser = benches.add_parser(
+        "shards", help="report speedup with stores sharded across processes"
+    )
+    shards_parser.add_argument("--stores", type=int, default=20_000)
+    shards_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    rollups_parser = benches.add_parser(
+        "rollups", help="report from rollups vs recomputed, as history grows"
+    )
+    rollups_parser.add_argument("--weeks", type=int, nargs="+", default=[1, 4, 12])
+    pushdown_parser = benches.add_parser(
+        "pushdown", help="report computed in the database vs fetching status rows"
+    )
+    pushdown_parser.add_argument("--url", help="a temporary SQLite file by default")
+    pushdown_parser.add_argument("--stores", type=int, default=10_000)
+    lookup_parser = benches.add_parser(
+        "lookup", help="per-store uptime lookups from the rollups, cold and cached"
+    )
+    lookup_parser.add_argument("--url", help="a temporary SQLite file by default")
+    lookup_parser.add_argument("--stores", type=int, default=10_000)
+    lookup_parser.add_argument("--lookups", type=int, default=2_000)
+    chunked_parser = benches.add_parser(
+        "chunked", help="chunked report's time and peak memory vs in-memory"
+    )
+    chunked_parser.add_argument("--url", help="a temporary SQLite file by default")
+    chunked_parser.add_argument("--stores", type=int, default=10_000)
+    chunked_parser.add_argument("--days", type=int, default=28)
+    chunked_parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[16, 64, 256], help="in MiB"
+    )
+    interpolation_parser = benches.add_parser(
+        "interpolation", help="time-weighted kernel on a synthetic fleet"
+    )
+    interpolation_parser.add_argument("--stores", type=int, default=10_000)
+    timezones_parser = benches.add_parser(
+        "timezones", help="offset-table time conversions vs pandas and per-row pytz"
+    )
+    timezones_parser.add_argument("--rows", type=int, default=1_000_000)
+    status_parser = benches.add_parser(
+        "status", help="POST /status write buffer vs per-row inserts"
+    )
+    status_parser.add_argument("--url", help="a temporary SQLite file by default")
+    status_parser.add_argument("--observations", type=int, default=200_000)
+    status_parser.add_argument("--batch", type=int, default=1000)
+    suite_parser = benches.add_parser(
+        "suite", help="startup, business hours and report timings as JSON"
+    )
+    suite_parser.add_argument(
+        "--stores", type=int, nargs="+", default=[1000, 10_000, 100_000]
+    )
+    suite_parser.add_argument("--days", type=int, default=7)
+    suite_parser.add_argument(
+        "--url",
+        help="database to run against (emptied); a temporary SQLite file by default",
+    )
+    suite_parser.add_argument(
+        "--output", help="defaults to bench_results/<commit>.json"
+    )
+    args = parser.parse_args()
+
+    if args.bench == "engine":
+        bench_uptime_engine()
+    elif args.bench == "queries":
+        bench_batched_queries(args.url, args.stores)
+    elif args.bench == "plans":
+        bench_query_plans(args.url, args.weeks)
+    elif args.bench == "pipeline":
+        bench_report_pipeline(args.weeks)
+    elif args.bench == "snapshot":
+        bench_snapshot(args.weeks)
+    elif args.bench == "observations":
+        bench_observations(args.weeks)
+    elif args.bench == "shards":
+        bench_shards(args.stores, args.workers)
+    elif args.bench == "rollups":
+        bench_rollups(args.weeks)
+    elif args.bench == "pushdown":
+        bench_pushdown(args.url, args.stores)
+    elif args.bench == "lookup":
+        bench_store_lookup(args.url, args.stores, args.lookups)
+    elif args.bench == "chunked":
+        bench_chunked(
+            args.url, args.stores, args.days, [mib << 20 for mib in args.budgets]
+        )
+    elif args.bench == "interpolation":
+        bench_interpolation(args.stores)
+    elif args.bench == "timezones":
+        bench_timezones(args.rows)
+    elif args.bench == "status":
+        bench_status_ingest(args.url, args.observations, args.batch)
+    elif args.bench == "suite":
+        bench_suite(args.stores, args.days, args.url, args.output)
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import String, func, select, type_coerce
+
+import models
+import reference
+import uptime
+
+status_table = models.StoreStatus.__table__
+
+COLUMNS = ["store_id", "status", "timestamp_utc"]
+# peak bytes per status row in a chunk: the fetched row objects, their frame
+# and the uptime kernel's temporaries; about 650 measured with `python bench.py
+# chunked`, rounded up for headroom
+ROW_BYTES = 1024
+# chunks smaller than this cost more in per-chunk overhead than they save
+MIN_CHUNK_ROWS = 10_000
+# the smallest memory budget a chunked report can keep to
+MIN_MEMORY_BUDGET = MIN_CHUNK_ROWS * ROW_BYTES
+
+
+def chunk_rows_for(memory_budget):
+    """
+    Status rows per chunk that keep a chunked report within memory_budget bytes.
+
+    Raises ValueError for budgets below MIN_MEMORY_BUDGET, which even the
+    smallest worthwhile chunk would exceed.
+    """
+    if int(memory_budget) < MIN_MEMORY_BUDGET:
+        raise ValueError(
+            f"memory budget of {int(memory_budget)} bytes is below the"
+            f" {MIN_MEMORY_BUDGET} bytes of {MIN_CHUNK_ROWS}-row chunks"
+        )
+    return int(memory_budget) // ROW_BYTES
+
+
+def _trim_history(rows, reference_data, now):
+    """
+    Drops the polls of one store that can no longer change its report.
+
+    Polls before the longest window only matter as the last one before it,
+    whose status runs into the window, and as the newest one in business
+    hours, which gives the current status when the window has none. Keeping
+    just those bounds a store's carried rows by a week of polls, however
+    long its history.
+    """
+    timestamps_ns = uptime.epoch_ns(rows["timestamp_utc"])
+    window_start = pd.Timestamp(now).value - max(
+        length.value for length, _ in uptime.WINDOWS.values()
+    )
+    old = np.flatnonzero(timestamps_ns < window_start)
+    if len(old) <= 1:
+        return rows
+    keep = timestamps_ns >= window_start
+    keep[old[-1]] = True
+    in_hours = old[
+        reference_data.in_business_hours(
+            rows["store_id"].to_numpy()[old], timestamps_ns[old]
+        )
+    ]
+    if len(in_hours):
+        keep[in_hours[-1]] = True
+    return rows[keep].reset_index(drop=True)
+
+
+def iter_report(chunks, reference_data, now):
+    """
+    Yields the report of status rows given in chunks, one part per chunk.
+
+    `chunks` yields frames of (store_id, status, timestamp_utc) ordered by
+    store_id, then timestamp_utc, as the status table's primary key orders
+    them. Every store but the last of a chunk is complete and reported right
+    away with uptime.time_weighted_uptime_downtime; the last store's rows are
+    carried into the next chunk, trimmed by _trim_history. Parts hold the
+    currently active stores in store_id order.
+    """
+    carried = None
+    for chunk in chunks:
+        if carried is not None:
+            chunk = pd.concat([carried, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+        store_ids = chunk["store_id"].to_numpy()
+        boundary = int(np.searchsorted(store_ids, store_ids[-1]))
+        carried = _trim_history(
+            chunk.iloc[boundary:].reset_index(drop=True), reference_data, now
+        )
+        if boundary:
+            yield uptime.time_weighted_uptime_downtime(
+                chunk.iloc[:boundary],
+                reference_data.intervals,
+                now,
+                zones=reference_data.zones,
+            )
+    if carried is not None:
+        yield uptime.time_weighted_uptime_downtime(
+            carried, reference_data.intervals, now, zones=reference_data.zones
+        )
+
+
+def newest_observation(connection):
+    """The newest stored observation's timestamp, which the report is computed at."""
+    newest = connection.execute(select(func.max(status_table.c.timestamp_utc))).scalar()
+    if newest is None:
+        return None
+    newest = pd.Timestamp(newest)
+    # SQLite hands back naive datetimes for timezone-aware columns
+    return (
+        newest.tz_localize("UTC") if newest.tzinfo is None else newest.tz_convert("UTC")
+    )
+
+
+def _status_chunks(connection, chunk_rows):
+    """
+    Frames of chunk_rows status rows in primary key order.
+
+    Rows are streamed through a server-side cursor on PostgreSQL; SQLite's
+    cursor already fetches lazily.
+    """
+    result = connection.execute(
+        select(
+            status_table.c.store_id,
+            status_table.c.status,
+            # parsed a chunk at a time rather than per row; SQLite keeps
+            # timestamps as text in UTC
+            type_coerce(status_table.c.timestamp_utc, String),
+        ).order_by(status_table.c.store_id, status_table.c.timestamp_utc),
+        execution_options={"stream_results": True},
+    )
+    for rows in result.partitions(chunk_rows):
+        chunk = pd.DataFrame(rows, columns=COLUMNS)
+        chunk["timestamp_utc"] = pd.to_datetime(
+            chunk["timestamp_utc"], utc=True, format="ISO8601"
+        )
+        yield chunk
+
+
+def stream_report(
+    connection,
+    memory_budget,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Yields the time-weighted report of test__store_status in parts.
+
+    The status table is read in chunks sized by chunk_rows_for, so memory
+    stays within memory_budget however much history is stored; smaller
+    budgets than MIN_MEMORY_BUDGET raise ValueError. The parts
+    together equal the report of crud.get_uptime_downtime_local on the same
+    observations, in store_id order.
+    """
+    now = newest_observation(connection)
+    if now is None:
+        return
+    reference_data = reference.load(menu_hours_path, timezones_path)
+    chunks = _status_chunks(connection, chunk_rows_for(memory_budget))
+    yield from iter_report(chunks, reference_data, now)
@@ -1,14 +1,25 @@
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-from pytz import timezone
-from schema import Store, BusinessHour, StoreTimezone, Status
-import pytz
+from datetime import datetime, timedelta, timezone as dt_timezone
+from models import Store, BusinessHour, StoreStatus as Status
 import pandas as pd
 from datetime import datetime, timedelta, time
 import csv
+import os
 from collections import defaultdict
 import numpy as np
+import chunked
+import localtime
+import observations
+import profiling
+import pushdown
+import reference
+import rollups
+import shards
+import snapshot
+import uptime
+import utils
 
 
 def get_stores(session: Session) -> List[Store]:
@@ -21,11 +32,9 @@ def get_business_hours(session: Session, store_id: int) -> List[BusinessHour]:
     return session.query(BusinessHour).filter(BusinessHour.store_id == store_id).all()
 
 
-def get_store_timezone(session: Session, store_id: int) -> StoreTimezone:
+def get_store_timezone(session: Session, store_id: int) -> Store:
     """Get the timezone for a store"""
-    return (
-        session.query(StoreTimezone).filter(StoreTimezone.store_id == store_id).first()
-    )
+    return session.query(Store).filter(Store.store_id == store_id).first()
 
 
 def get_latest_status(
@@ -99,207 +108,402 @@ def get_statuses_between_local(
     Returns a list of tuples, where the first element is the status and the second element is the timestamp of that status.
     """
     store_timezone = get_store_timezone(session, store_id)
-    timezone_obj = timezone(store_timezone.timezone_str)
+    timezone_str = store_timezone.timezone_str
 
     # Convert local times to UTC times
-    start_time_utc = timezone_obj.localize(start_time_local).astimezone(timezone("UTC"))
-    end_time_utc = timezone_obj.localize(end_time_local).astimezone(timezone("UTC"))
+    start_time_utc, end_time_utc = _to_utc(
+        [start_time_local, end_time_local], [timezone_str] * 2
+    )
 
     # Get all the statuses between the UTC times
     statuses = get_statuses_between(session, store_id, start_time_utc, end_time_utc)
 
     # Convert the timestamps back to local times and return as a list of tuples
-    return [(s, s.timestamp_utc.astimezone(timezone_obj)) for s in statuses]
+    local_times = _to_local(
+        [s.timestamp_utc for s in statuses], [timezone_str] * len(statuses)
+    )
+    return list(zip(statuses, local_times))
 
 
-def get_uptime_downtime_local():
-    # Load timezone information from the third table
-    timezone_df = pd.read_csv("timezones.csv")
-    timezone_dict = dict(zip(timezone_df.store_id, timezone_df.timezone_str))
+# Batched variants of the helpers above. Each takes a collection of store_ids
+# (or None for every store) and answers for all of them in one query per
+# IN_BATCH_SIZE ids, returning rows grouped by store_id.
 
-    # Load data from the first and second tables
-    business_hours_df = pd.read_csv("menu_hours.csv")
+IN_BATCH_SIZE = 10_000
 
-    # Convert time ranges in business_hours.csv to UTC
-    for i, row in business_hours_df.iterrows():
-        store_id = row["store_id"]
-        local_tz = pytz.timezone(timezone_dict.get(store_id, "America/Chicago"))
 
-        start_time = datetime.strptime(row["start_time_local"], "%H:%M:%S").replace(
-            tzinfo=local_tz
-        )
-        end_time = datetime.strptime(row["end_time_local"], "%H:%M:%S").replace(
-            tzinfo=local_tz
+def _store_id_batches(store_ids):
+    if store_ids is None:
+        yield None
+        return
+    store_ids = sorted(set(store_ids))
+    for i in range(0, len(store_ids), IN_BATCH_SIZE):
+        yield store_ids[i : i + IN_BATCH_SIZE]
+
+
+def _filter_store_ids(query, column, batch):
+    return query if batch is None else query.where(column.in_(batch))
+
+
+def _group_by_store(rows) -> Dict[int, list]:
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.store_id].append(row)
+    return dict(grouped)
+
+
+def get_business_hours_batch(
+    session: Session, store_ids: Optional[Iterable[int]]
+) -> Dict[int, list]:
+    """Get the business hours rows for many stores, keyed by store_id"""
+    table = BusinessHour.__table__
+    rows = []
+    for batch in _store_id_batches(store_ids):
+        query = _filter_store_ids(select(table), table.c.store_id, batch)
+        rows.extend(session.execute(query).all())
+    return _group_by_store(rows)
+
+
+def get_store_timezones(
+    session: Session, store_ids: Optional[Iterable[int]]
+) -> Dict[int, str]:
+    """Get the timezone_str of many stores, keyed by store_id"""
+    table = Store.__table__
+    timezones = {}
+    for batch in _store_id_batches(store_ids):
+        query = _filter_store_ids(
+            select(table.c.store_id, table.c.timezone_str), table.c.store_id, batch
         )
-        start_utc = start_time.astimezone(pytz.utc).strftime("%H:%M:%S")
-        end_utc = end_time.astimezone(pytz.utc).strftime("%H:%M:%S")
-        business_hours_df.at[i, "start_time_utc"] = start_utc
-        business_hours_df.at[i, "end_time_utc"] = end_utc
+        timezones.update(session.execute(query).all())
+    return timezones
+
+
+def _last_status_per_store(session, store_ids, condition) -> Dict[int, tuple]:
+    """Latest status row per store among rows matching condition"""
+    table = Status.__table__
+    latest = {}
+    for batch in _store_id_batches(store_ids):
+        if session.get_bind().dialect.name == "postgresql":
+            query = (
+                select(table)
+                .distinct(table.c.store_id)
+                .where(condition)
+                .order_by(table.c.store_id, table.c.timestamp_utc.desc())
+            )
+            query = _filter_store_ids(query, table.c.store_id, batch)
+        else:
+            ranked = _filter_store_ids(
+                select(
+                    table,
+                    func.row_number()
+                    .over(
+                        partition_by=table.c.store_id,
+                        order_by=table.c.timestamp_utc.desc(),
+                    )
+                    .label("position"),
+                ).where(condition),
+                table.c.store_id,
+                batch,
+            ).subquery()
+            query = select(
+                ranked.c.store_id, ranked.c.status, ranked.c.timestamp_utc
+            ).where(ranked.c.position == 1)
+        for row in session.execute(query):
+            latest[row.store_id] = (row, row.timestamp_utc)
+    return latest
+
+
+def get_latest_statuses(
+    session: Session, store_ids: Optional[Iterable[int]], timestamp: datetime
+) -> Dict[int, tuple]:
+    """
+    Get the latest status at or before the given timestamp for many stores.
 
-    business_hours_df["start_time_utc"] = pd.to_datetime(
-        business_hours_df["start_time_utc"]
-    )
-    business_hours_df["end_time_utc"] = pd.to_datetime(
-        business_hours_df["end_time_utc"]
+    Returns a dict of store_id to (status, timestamp); stores without a status
+    before the timestamp are left out.
+    """
+    return _last_status_per_store(
+        session, store_ids, Status.__table__.c.timestamp_utc <= timestamp
     )
 
-    # read the csv data
-    df = pd.read_csv("store_status.csv")
-    # convert timestamp_utc column to pandas datetime format
-    df["timestamp_utc"] = pd.to_datetime(df["timestamp_utc"])
-    df["time"] = pd.to_datetime(df["timestamp_utc"]).dt.date
 
-    # get the current timestamp
-    current_time = df["timestamp_utc"].max()
-    current_time_only = df["time"].max()
+def get_previous_statuses(
+    session: Session, store_ids: Optional[Iterable[int]], timestamp: datetime
+) -> Dict[int, tuple]:
+    """Like get_latest_statuses, but strictly before the given timestamp"""
+    return _last_status_per_store(
+        session, store_ids, Status.__table__.c.timestamp_utc < timestamp
+    )
 
-    df["day"] = df["timestamp_utc"].dt.dayofweek
 
-    df = pd.merge(
-        df,
-        business_hours_df,
-        how="left",
-        left_on=["store_id"],
-        right_on=["store_id"],
+def get_statuses_between_batch(
+    session: Session,
+    store_ids: Optional[Iterable[int]],
+    start_time: datetime,
+    end_time: datetime,
+) -> Dict[int, list]:
+    """Get all the statuses of many stores between the given times, keyed by store_id"""
+    table = Status.__table__
+    rows = []
+    for batch in _store_id_batches(store_ids):
+        query = _filter_store_ids(
+            select(table).where(
+                table.c.timestamp_utc >= start_time, table.c.timestamp_utc < end_time
+            ),
+            table.c.store_id,
+            batch,
+        ).order_by(table.c.store_id, table.c.timestamp_utc)
+        rows.extend(session.execute(query).all())
+    return _group_by_store(rows)
+
+
+def get_statuses_between_local_batch(
+    session: Session,
+    store_ids: Iterable[int],
+    start_time_local: datetime,
+    end_time_local: datetime,
+) -> Dict[int, List[Tuple[tuple, datetime]]]:
+    """
+    Get all the statuses of many stores between the given local times.
+
+    Stores in different timezones have different UTC bounds, so the statuses of
+    the widest UTC window are fetched in one query and trimmed per store.
+    Returns a dict of store_id to a list of (status, local timestamp) tuples.
+    """
+    store_ids = list(set(store_ids))
+    if not store_ids:
+        return {}
+    timezones = get_store_timezones(session, store_ids)
+    timezone_strs = [
+        timezones.get(store_id, utils.DEFAULT_TIMEZONE) for store_id in store_ids
+    ]
+    utc_times = _to_utc(
+        [start_time_local] * len(store_ids) + [end_time_local] * len(store_ids),
+        timezone_strs * 2,
     )
-    df["time"] = df["timestamp_utc"].dt.time
-    df["start_time_only"] = df["start_time_utc"].dt.time
-    df["end_time_only"] = df["end_time_utc"].dt.time
-
-    df["day_y"] = df["day_y"].astype("Int64")
-    df = df.query("day_x == day_y")
-    df = df[(df["time"] >= df["start_time_only"]) & (df["time"] < df["end_time_only"])]
-
-    df.to_csv("filtered_data.csv")
-
-    # read in data
-    data = pd.read_csv("filtered_data.csv")
-
-    # convert timestamp_utc and start_time_utc/end_time_utc to datetime objects
-    data["timestamp_utc"] = pd.to_datetime(data["timestamp_utc"], utc=True)
-    data["start_time_utc"] = pd.to_datetime(data["start_time_utc"], utc=True)
-    data["end_time_utc"] = pd.to_datetime(data["end_time_utc"], utc=True)
-
-    # create new columns for hour, day, and week
-    data["hour"] = data["timestamp_utc"].dt.hour
-    data["day"] = data["timestamp_utc"].dt.day
-    data["week"] = data["timestamp_utc"].dt.isocalendar().week
-
-    # create new column for current status of each store
-    data["current_status"] = data.groupby("store_id")["status"].transform("last")
-
-    # filter to only include rows where store is currently active
-    active_data = data[data["current_status"] == "active"]
-
-    # get list of active stores
-    active_stores = pd.DataFrame(active_data["store_id"].unique(), columns=["store_id"])
-
-    # initialize parameters for each active store
-    active_stores["uptime_last_hour"] = 0
-    active_stores["uptime_last_day"] = 0
-    active_stores["uptime_last_week"] = 0
-    active_stores["downtime_last_hour"] = 0
-    active_stores["downtime_last_day"] = 0
-    active_stores["downtime_last_week"] = 0
-
-    # create business hours time range
-    business_hours = pd.date_range("00:00", "23:59", freq="15min").time
-
-    # loop through each active store
-    for store in active_stores["store_id"]:
-        # filter to only include data for current store
-        store_data = active_data[active_data["store_id"] == store]
-        # create new DataFrame to hold uptime and downtime for each 15-minute interval
-        store_uptime = pd.DataFrame(index=business_hours)
-        store_downtime = pd.DataFrame(index=business_hours)
-
-        # calculate uptime and downtime for last hour, day, and week
-        store_uptime_last_hour = (
-            store_data[
-                store_data["timestamp_utc"] >= current_time - pd.Timedelta("1H")
-            ]["status"]
-            .value_counts(normalize=True)
-            .get("active", 0)
-            * 60
+    bounds = {
+        store_id: (timezone_str, start_time_utc, end_time_utc)
+        for store_id, timezone_str, start_time_utc, end_time_utc in zip(
+            store_ids,
+            timezone_strs,
+            utc_times[: len(store_ids)],
+            utc_times[len(store_ids) :],
         )
-        store_uptime_last_day = (
-            store_data[
-                store_data["day"] == pd.Timestamp.utcnow().tz_localize(None).day
-            ]["status"]
-            .value_counts(normalize=True)
-            .get("active", 0)
-            * 24
-        )
-        store_uptime_last_week = (
-            store_data[
-                store_data["week"] == pd.Timestamp.utcnow().tz_localize(None).week
-            ]["status"]
-            .value_counts(normalize=True)
-            .get("active", 0)
-            * 24
-            * 7
+    }
+
+    statuses = get_statuses_between_batch(
+        session,
+        bounds,
+        min(start for _, start, _ in bounds.values()),
+        max(end for _, _, end in bounds.values()),
+    )
+
+    result = {}
+    for store_id, rows in statuses.items():
+        timezone_str, start_time_utc, end_time_utc = bounds[store_id]
+        rows = [
+            s for s in rows if start_time_utc <= _as_utc(s.timestamp_utc) < end_time_utc
+        ]
+        local_times = _to_local(
+            [s.timestamp_utc for s in rows], [timezone_str] * len(rows)
         )
-        store_downtime_last_hour = 60 - store_uptime_last_hour
-        store_downtime_last_day = 24 - store_uptime_last_day
-        store_downtime_last_week = (24 * 7) - store_uptime_last_week
-
-        # loop through each 15-minute interval in business hours
-        for interval in business_hours:
-            # get start and end times for current interval
-            start_time = pd.Timestamp.combine(current_time_only, interval).tz_localize(
-                "UTC"
+        result[store_id] = list(zip(rows, local_times))
+    return result
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    # SQLite hands back naive datetimes for timezone-aware columns
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=dt_timezone.utc)
+
+
+def _to_utc(local_times: List[datetime], timezone_strs: List[str]) -> List[datetime]:
+    """
+    UTC times of naive local times, each in its timezone.
+
+    Converted by localtime.to_utc, so times repeated or skipped around DST
+    changes resolve as the business hours do.
+    """
+    zone_codes, zone_names = pd.factorize(pd.Index(timezone_strs))
+    local_ns = np.array([pd.Timestamp(t).value for t in local_times], dtype=np.int64)
+    utc_ns = localtime.to_utc(local_ns, zone_codes, zone_names)
+    return [pd.Timestamp(value, tz="UTC").to_pydatetime() for value in utc_ns]
+
+
+def _to_local(timestamps: List[datetime], timezone_strs: List[str]) -> List[datetime]:
+    """Local times of UTC times, each with the UTC offset of its timezone then."""
+    zone_codes, zone_names = pd.factorize(pd.Index(timezone_strs))
+    timestamps = [_as_utc(t) for t in timestamps]
+    offsets = localtime.utc_offsets(
+        np.array([pd.Timestamp(t).value for t in timestamps], dtype=np.int64),
+        zone_codes,
+        zone_names,
+    )
+    return [
+        t.astimezone(dt_timezone(timedelta(microseconds=int(offset) // 1000)))
+        for t, offset in zip(timestamps, offsets)
+    ]
+
+
+def spill_frame(df, path):
+    """
+    Write an intermediate frame to Parquet for debugging.
+
+    Falls back to a pickle next to the requested path when pyarrow is missing.
+    """
+    try:
+        df.to_parquet(path, index=False)
+    except ImportError:
+        path = f"{os.path.splitext(path)[0]}.pkl"
+        df.to_pickle(path)
+    return path
+
+
+def load_report_inputs(
+    status_path="store_status.csv",
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Load every status observation and the stores' business hours and timezones.
+
+    Returns the observations, the reference.ReferenceData of the business hours
+    and timezones files and the time of the newest observation, which the
+    report is computed at.
+    """
+    # memory-mapped columns of the csv, parsed only when the file changes
+    with profiling.stage("load_status") as stage:
+        df = snapshot.load_status(status_path)
+        stage["rows_out"] = len(df)
+
+    # get the current time
+    now = df["timestamp_utc"].max()
+
+    # local business hours and store timezones, mapped from the reference data
+    # the workers share
+    with profiling.stage("business_hours") as stage:
+        reference_data = reference.load(menu_hours_path, timezones_path)
+        stage["rows_out"] = len(reference_data.intervals[1])
+
+    return df, reference_data, now
+
+
+def business_hours_observations(df, reference_data) -> pd.DataFrame:
+    """
+    The (store_id, status, timestamp_utc) observations within their store's
+    business hours.
+
+    Each observation is tagged, at its own local time, against its store's
+    sorted weekly intervals, instead of being joined with every business
+    hours row.
+    """
+    in_hours = reference_data.in_business_hours(
+        df["store_id"].to_numpy(), uptime.epoch_ns(df["timestamp_utc"])
+    )
+    return df.loc[in_hours, ["store_id", "status", "timestamp_utc"]].reset_index(
+        drop=True
+    )
+
+
+def load_report_data(
+    status_path="store_status.csv",
+    spill_path=None,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Load the status observations that fall within business hours.
+
+    The filtered observations stay in memory; pass spill_path to also write them
+    out for inspection.
+    Returns the filtered observations and the UTC date the report is computed for.
+    """
+    df, reference_data, now = load_report_inputs(
+        status_path, menu_hours_path, timezones_path
+    )
+
+    with profiling.stage("business_hours_filter", rows_in=len(df)) as stage:
+        data = business_hours_observations(df, reference_data)
+        stage["rows_out"] = len(data)
+
+    if spill_path is not None:
+        with profiling.stage("spill", rows_in=len(data)):
+            spill_frame(data, spill_path)
+
+    return data, now.date()
+
+
+def load_observations(status_path="store_status.csv") -> observations.ObservationIndex:
+    """
+    Load every status observation into an in-memory ObservationIndex.
+
+    Its latest_status, previous_status and statuses_between answer the same
+    point lookups as the helpers above without a database round trip.
+    """
+    return observations.ObservationIndex.from_frame(snapshot.load_status(status_path))
+
+
+def get_uptime_downtime_local(output_path="results.csv", spill_path=None, workers=1):
+    if workers > 1 and spill_path is None:
+        # shard the stores across processes; spilling needs the whole frame in
+        # one place, so it keeps the single-process path
+        with profiling.stage("sharded_report") as stage:
+            active_stores, _ = shards.compute_report(workers)
+            stage["rows_out"] = len(active_stores)
+    else:
+        data, reference_data, now = load_report_inputs()
+        if spill_path is not None:
+            with profiling.stage("spill", rows_in=len(data)):
+                spill_frame(
+                    business_hours_observations(data, reference_data), spill_path
+                )
+
+        # business-hours time between polls, attributed to the previous poll's
+        # status, for every currently active store in one pass
+        with profiling.stage("uptime", rows_in=len(data)) as stage:
+            active_stores = uptime.time_weighted_uptime_downtime(
+                data, reference_data.intervals, now, zones=reference_data.zones
             )
-            end_time = start_time + pd.Timedelta("15min")
-
-            # convert start and end times to datetime64[ns, UTC] objects
-            start_time = pd.to_datetime(start_time)
-            end_time = pd.to_datetime(end_time)
-
-            # filter to only include data for current interval
-            interval_data = store_data[
-                (store_data["timestamp_utc"] >= start_time)
-                & (store_data["timestamp_utc"] < end_time)
-            ]
-
-            # calculate uptime and downtime for current interval
-            interval_uptime = interval_data[interval_data["status"] == "active"][
-                "status"
-            ].count()
-            interval_downtime = interval_data[interval_data["status"] == "inactive"][
-                "status"
-            ].count()
-
-            # add interval uptime and downtime to store uptime and downtime DataFrames
-            store_uptime[interval] = interval_uptime
-            store_downtime[interval] = interval_downtime
-
-        # interpolate missing values in store uptime and downtime DataFrames
-        store_uptime_interpolated = store_uptime.interpolate(method="linear")
-        store_downtime_interpolated = store_downtime.interpolate(method="linear")
-
-        # calculate total uptime and downtime for each active store
-        active_stores["total_uptime"] = store_uptime_interpolated.sum(axis=1)
-        active_stores["total_downtime"] = store_downtime_interpolated.sum(axis=1)
-
-        # calculate uptime and downtime for last hour, day, and week by summing appropriate intervals
-        active_stores["uptime_last_hour"] = (
-            store_uptime_interpolated.iloc[-4:].sum().sum()
-        )
-        active_stores["uptime_last_day"] = (
-            store_uptime_interpolated.iloc[-96:].sum().sum()
-        )
-        active_stores["uptime_last_week"] = (
-            store_uptime_interpolated.iloc[-672:].sum().sum()
-        )
-        active_stores["downtime_last_hour"] = (
-            store_downtime_interpolated.iloc[-4:].sum().sum()
-        )
-        active_stores["downtime_last_day"] = (
-            store_downtime_interpolated.iloc[-96:].sum().sum()
-        )
-        active_stores["downtime_last_week"] = (
-            store_downtime_interpolated.iloc[-672:].sum().sum()
-        )
+            stage["rows_out"] = len(active_stores)
 
     # store the results into results.csv
-    active_stores.to_csv("results.csv")
+    with profiling.stage("write_csv", rows_in=len(active_stores)):
+        active_stores.to_csv(output_path)
+
+
+def get_uptime_downtime_chunked(
+    session: Session, output_path="results.csv", memory_budget=256 << 20
+):
+    """
+    Writes the time-weighted report streamed from the status table in chunks.
+
+    Each part is appended to the file as soon as it is computed, so neither
+    the observations nor the report are ever held whole; memory stays within
+    memory_budget bytes. Stores are written in store_id order.
+    """
+    with profiling.stage("chunked_report") as stage, open(output_path, "w") as f:
+        rows = 0
+        for part in chunked.stream_report(session.connection(), memory_budget):
+            part.index += rows
+            part.to_csv(f, header=rows == 0)
+            rows += len(part)
+        if rows == 0:
+            pd.DataFrame(columns=["store_id"] + uptime.METRIC_COLUMNS).to_csv(f)
+        stage["rows_out"] = rows
+
+
+def get_uptime_downtime_rollups(session: Session, output_path="results.csv"):
+    """Writes the report summed from the hourly rollups that ingest keeps current."""
+    with profiling.stage("rollup_sum") as stage:
+        active_stores = rollups.compute_uptime_downtime(session.connection())
+        stage["rows_out"] = len(active_stores)
+    with profiling.stage("write_csv", rows_in=len(active_stores)):
+        active_stores.to_csv(output_path)
+
+
+def get_uptime_downtime_sql(session: Session, output_path="results.csv"):
+    """Writes the report computed in the database from the loaded tables."""
+    with profiling.stage("sql_report") as stage:
+        active_stores = pushdown.compute_uptime_downtime(session.connection())
+        stage["rows_out"] = len(active_stores)
+    with profiling.stage("write_csv", rows_in=len(active_stores)):
+        active_stores.to_csv(output_path)
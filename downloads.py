@@ -0,0 +1,142 @@
+import os
+import re
+import zlib
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import zstandard
+except ImportError:  # zstd is offered only when the package is installed
+    zstandard = None
+
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def _read_chunks(path, start=0, length=None):
+    """Yields a byte range of a file in CHUNK_SIZE pieces."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _zstd_chunks(chunks):
+    compressor = zstandard.ZstdCompressor().compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepted_encodings(header):
+    """Returns the content codings in an Accept-Encoding header with q > 0."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def negotiate_encoding(request: Request):
+    """Picks zstd, gzip or None (identity) from the request's Accept-Encoding."""
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _parse_range(header, size):
+    """Returns (start, end) inclusive for a single bytes range, or None if unsatisfiable."""
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "":
+        if last == "" or int(last) == 0:
+            return None
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+def file_response(request: Request, path, media_type):
+    """
+    Streams a finished file without holding it in memory.
+
+    Supports ETag/If-None-Match (304), a single HTTP Range (206, uncompressed
+    responses only) and gzip/zstd content encoding negotiated via
+    Accept-Encoding.
+    """
+    stat = os.stat(path)
+    encoding = negotiate_encoding(request)
+    version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    etag = f'"{version}-{encoding}"' if encoding else f'"{version}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip() for tag in if_none_match.split(","))
+    ):
+        return Response(status_code=304, headers=headers)
+
+    if encoding is not None:
+        chunks = _read_chunks(path)
+        compress = _zstd_chunks if encoding == "zstd" else _gzip_chunks
+        headers["Content-Encoding"] = encoding
+        return StreamingResponse(
+            compress(chunks), media_type=media_type, headers=headers
+        )
+
+    headers["Accept-Ranges"] = "bytes"
+    range_header = request.headers.get("range")
+    if range_header is not None:
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _read_chunks(path, start, end - start + 1),
+            status_code=206,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    headers["Content-Length"] = str(stat.st_size)
+    return StreamingResponse(_read_chunks(path), media_type=media_type, headers=headers)
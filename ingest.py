@@ -0,0 +1,711 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from itertools import islice
+
+import pandas as pd
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    and_,
+    case,
+    exists,
+    func,
+    select,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
+
+import migrations
+import models
+import reference
+import rollups
+import snapshot
+import utils
+
+# rows per executemany batch on SQLite
+BATCH_SIZE = 50_000
+# bytes hashed at each end of an ingested file to recognize it again
+FINGERPRINT_BYTES = 1 << 16
+
+# typed layout, keys and indexes of every table loaded from the CSV feeds
+TABLES = {
+    model.__tablename__: model.__table__
+    for model in (
+        models.Store,
+        models.BusinessHour,
+        models.BusinessHourUTC,
+        models.StoreStatus,
+    )
+}
+watermarks = models.IngestWatermark.__table__
+loaded_sources = models.LoadedSource.__table__
+
+# CSV feed behind each table; test__business_hours_utc is built at startup
+SOURCES = {
+    "test__stores": "timezones.csv",
+    "test__business_hours": "menu_hours.csv",
+    "test__store_status": "store_status.csv",
+}
+
+_delta_lock = threading.Lock()
+# engine -> names of the delta tables already created in its database
+_delta_tables = weakref.WeakKeyDictionary()
+
+
+def staging_name(name, suffix="staging"):
+    return f"{name}__{suffix}"
+
+
+def staging_table(table, suffix="staging", primary_key=False):
+    """
+    Returns a copy of a table's columns under its staging name.
+
+    Indexes are never copied; the primary key only when primary_key is set.
+    """
+    return Table(
+        staging_name(table.name, suffix),
+        MetaData(),
+        *(
+            Column(
+                column.name, column.type, primary_key=primary_key and column.primary_key
+            )
+            for column in table.columns
+        ),
+    )
+
+
+def _create_indexes(cursor, dialect, table, target_name, suffix=None):
+    """Creates the table's indexes on target_name, optionally under staging names."""
+    # a detached copy, so the new Index objects do not attach to the model table
+    target = Table(
+        target_name,
+        MetaData(),
+        *(Column(column.name, column.type) for column in table.columns),
+    )
+    for index in table.indexes:
+        name = staging_name(index.name, suffix) if suffix else index.name
+        copy = Index(
+            name,
+            *(target.c[column.name] for column in index.columns),
+            unique=index.unique,
+            **index.dialect_kwargs,
+        )
+        cursor.execute(str(CreateIndex(copy).compile(dialect=dialect)))
+
+
+def _sqlite_value(column, value):
+    """Converts one CSV field to the value stored in a SQLite column."""
+    if value == "":
+        return None
+    if isinstance(column.type, (BigInteger, Integer)):
+        return int(value)
+    if isinstance(column.type, DateTime):
+        # "2023-01-22 12:09:39.388884 UTC" -> SQLAlchemy's SQLite datetime format,
+        # whose six fraction digits the feed sometimes trims ("...:49.36582 UTC")
+        seconds, dot, fraction = value.removesuffix(" UTC").partition(".")
+        return f"{seconds}.{fraction.ljust(6, '0')}" if dot else seconds
+    return value
+
+
+def _copy_postgres(raw_connection, table, header, csv_file):
+    """Streams a CSV file into a table with COPY FROM STDIN. Returns rows copied."""
+    columns = ", ".join(header)
+    with raw_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)", csv_file
+        )
+        return cursor.rowcount
+
+
+def _insert_sqlite(raw_connection, table, header, csv_file):
+    """Loads a CSV file into a table in executemany batches. Returns rows inserted."""
+    columns = [table.columns[name] for name in header]
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(
+        table.name, ", ".join(header), ", ".join("?" * len(header))
+    )
+    reader = csv.reader(csv_file)
+    cursor = raw_connection.cursor()
+    rows = 0
+    while True:
+        batch = [
+            tuple(_sqlite_value(c, v) for c, v in zip(columns, record))
+            for record in islice(reader, BATCH_SIZE)
+        ]
+        if not batch:
+            break
+        cursor.executemany(statement, batch)
+        rows += len(batch)
+    cursor.close()
+    return rows
+
+
+def _build_keys_postgres(cursor, dialect, table, staging):
+    """Adds the primary key and indexes to a loaded staging table."""
+    key = ", ".join(column.name for column in table.primary_key.columns)
+    if key:
+        cursor.execute(
+            f"ALTER TABLE {staging.name} ADD CONSTRAINT {staging.name}_pkey "
+            f"PRIMARY KEY ({key})"
+        )
+    _create_indexes(cursor, dialect, table, staging.name, suffix="staging")
+
+
+def _swap(raw_connection, dialect, table):
+    """Replaces a table with its staging table in a single transaction."""
+    staging = staging_name(table.name)
+    cursor = raw_connection.cursor()
+    if dialect.name == "sqlite":
+        # pysqlite does not open transactions around DDL on its own
+        cursor.execute("BEGIN")
+    cursor.execute(f"DROP TABLE IF EXISTS {table.name}")
+    cursor.execute(f"ALTER TABLE {staging} RENAME TO {table.name}")
+    if dialect.name == "postgresql":
+        # keys and indexes were built before the swap; only their names change
+        if table.primary_key.columns:
+            cursor.execute(f"ALTER INDEX {staging}_pkey RENAME TO {table.name}_pkey")
+        for index in table.indexes:
+            cursor.execute(
+                f"ALTER INDEX {staging_name(index.name)} RENAME TO {index.name}"
+            )
+        raw_connection.commit()
+    else:
+        # SQLite cannot rename indexes, so they are built here under their names
+        _create_indexes(cursor, dialect, table, table.name)
+        cursor.execute("COMMIT")
+    cursor.close()
+
+
+def load_table(engine, table_name, source):
+    """
+    Bulk loads a CSV file (path or file object with a header row) into a table.
+
+    Rows go into a staging table first, which is then swapped in atomically, so
+    readers see either the previous contents or the new ones, never an empty table.
+    Returns a dict with the row count, elapsed seconds and rows per second.
+    """
+    table = TABLES[table_name]
+    dialect = engine.dialect
+    # PostgreSQL gets its keys after the COPY; SQLite can only declare them upfront
+    staging = staging_table(table, primary_key=dialect.name == "sqlite")
+    started = time.perf_counter()
+
+    staging.drop(engine, checkfirst=True)
+    staging.create(engine)
+
+    csv_file = open(source, newline="") if isinstance(source, str) else source
+    raw_connection = engine.raw_connection()
+    try:
+        header = next(csv.reader([csv_file.readline()]))
+        if dialect.name == "postgresql":
+            rows = _copy_postgres(raw_connection, staging, header, csv_file)
+            with raw_connection.cursor() as cursor:
+                _build_keys_postgres(cursor, dialect, table, staging)
+        else:
+            rows = _insert_sqlite(raw_connection, staging, header, csv_file)
+        raw_connection.commit()
+        _swap(raw_connection, dialect, table)
+    finally:
+        raw_connection.close()
+        if isinstance(source, str):
+            csv_file.close()
+
+    seconds = time.perf_counter() - started
+    stats = {
+        "table": table_name,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds else rows,
+    }
+    print(
+        f"Loaded {rows} rows into {table_name} in {seconds:.2f}s "
+        f"({stats['rows_per_sec']} rows/sec)"
+    )
+    return stats
+
+
+def load_dataframe(engine, table_name, df):
+    """Bulk loads a DataFrame through the same staging path as the CSV feeds."""
+    buffer = io.StringIO()
+    df[[column.name for column in TABLES[table_name].columns]].to_csv(
+        buffer, index=False
+    )
+    buffer.seek(0)
+    return load_table(engine, table_name, buffer)
+
+
+class _Window(io.RawIOBase):
+    """Reads a file's bytes from its current position up to `end`."""
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.end - self.f.tell())
+        if size <= 0:
+            return 0
+        return self.f.readinto(memoryview(buffer)[:size])
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def _fingerprint(f, offset):
+    """
+    Identifies the first `offset` bytes of an open binary file.
+
+    Hashes the FINGERPRINT_BYTES at the start of the file and those ending at
+    the offset, so a file replaced by another export no longer matches even
+    when it is longer, while appending to it leaves the fingerprint unchanged.
+    """
+    digest = hashlib.sha256()
+    for start in (0, max(offset - FINGERPRINT_BYTES, 0)):
+        f.seek(start)
+        digest.update(f.read(min(offset - start, FINGERPRINT_BYTES)))
+    return digest.hexdigest()[:16]
+
+
+def _resumable(path, byte_offset, fingerprint):
+    """
+    Whether the file at path still holds the bytes ingested up to byte_offset,
+    so reading can resume there.
+
+    Watermarks recorded before fingerprints were kept only have the file size
+    to go by.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < byte_offset:
+            return False
+        return fingerprint is None or _fingerprint(f, byte_offset) == fingerprint
+
+
+def _open_new_lines(path, byte_offset):
+    """
+    Returns (header, new_lines, end_offset, fingerprint) for a CSV file that is
+    appended to.
+
+    new_lines is a text file of the lines after byte_offset, read as it is
+    consumed, so a large backlog is never held in memory; the caller closes it.
+    The offset only advances past complete lines, so an unterminated last line
+    is read again (and deduplicated) next time. fingerprint identifies the
+    file up to end_offset, for _resumable. The caller checks that the file
+    can be resumed at byte_offset, and passes 0 when it has been replaced.
+    """
+    f = open(path, "rb", buffering=0)
+    header = f.readline()
+    size = os.fstat(f.fileno()).st_size
+    start = max(len(header), min(byte_offset, size))
+
+    # the end of the last complete line, searched for backwards from the end
+    end_offset = size
+    while end_offset > start:
+        block = max(start, end_offset - (1 << 16))
+        f.seek(block)
+        newline = f.read(end_offset - block).rfind(b"\n")
+        if newline >= 0:
+            end_offset = block + newline + 1
+            break
+        end_offset = block
+
+    fingerprint = _fingerprint(f, end_offset)
+    f.seek(start)
+    new_lines = io.TextIOWrapper(
+        io.BufferedReader(_Window(f, end_offset)), encoding="utf-8", newline=""
+    )
+    return header.decode(), new_lines, end_offset, fingerprint
+
+
+def _advance_watermark(
+    connection, source, delta_max, byte_offset, fingerprint, appended
+):
+    """
+    Records an ingest run in the source's watermark, in the caller's transaction.
+
+    A single upsert adds the appended rows and keeps the later high-water
+    mark, so concurrent runs on one source (status buffer flushes) neither
+    collide on the key nor lose each other's counts. Returns the high-water
+    mark now recorded.
+    """
+    insert = (
+        postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    )
+    statement = insert(watermarks).values(
+        source=source,
+        high_water_mark=delta_max,
+        byte_offset=byte_offset,
+        file_fingerprint=fingerprint,
+        rows=appended,
+    )
+    excluded = statement.excluded
+    return connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[watermarks.c.source],
+            set_={
+                "high_water_mark": case(
+                    (excluded.high_water_mark.is_(None), watermarks.c.high_water_mark),
+                    (
+                        watermarks.c.high_water_mark > excluded.high_water_mark,
+                        watermarks.c.high_water_mark,
+                    ),
+                    else_=excluded.high_water_mark,
+                ),
+                "byte_offset": excluded.byte_offset,
+                "file_fingerprint": excluded.file_fingerprint,
+                "rows": func.coalesce(watermarks.c.rows, 0) + excluded.rows,
+            },
+        ).returning(watermarks.c.high_water_mark)
+    ).scalar()
+
+
+def _check_header(header):
+    """Raises ValueError unless a status CSV header names exactly its columns."""
+    expected = [column.name for column in TABLES["test__store_status"].columns]
+    if len(header) != len(expected) or set(header) != set(expected):
+        raise ValueError(f"CSV header must be the columns {', '.join(expected)}")
+
+
+def _is_file_feed(source, mark):
+    """Whether a source name is a status file, whose watermark holds its offset."""
+    return (
+        source in SOURCES.values()
+        or os.path.isfile(source)
+        or (mark is not None and mark.byte_offset is not None)
+    )
+
+
+def _delta_table(engine):
+    """
+    The calling thread's delta table, created in the engine's database on the
+    thread's first ingest, together with the tables an ingest writes to.
+
+    Native thread ids are unique across processes, so API workers and the
+    status buffer can append concurrently. The table is kept between runs and
+    left empty by each, so a run issues no DDL.
+    """
+    status = TABLES["test__store_status"]
+    delta = staging_table(status, f"delta_{threading.get_native_id()}")
+    with _delta_lock:
+        created = _delta_tables.setdefault(engine, set())
+        if delta.name not in created:
+            models.Base.metadata.create_all(
+                engine, tables=[status, watermarks, rollups.buckets, rollups.latest]
+            )
+            # left over by an earlier process on the same thread id
+            delta.drop(engine, checkfirst=True)
+            delta.create(engine)
+            created.add(delta.name)
+    return delta
+
+
+def ingest_status_delta(
+    engine,
+    source,
+    csv_file=None,
+    menu_hours_path=SOURCES["test__business_hours"],
+    timezones_path=SOURCES["test__stores"],
+    since_high_water_mark=True,
+):
+    """
+    Appends new store_status observations without replacing the table.
+
+    `source` names the feed (a file path, or a partition name when csv_file holds
+    the rows). Only rows at or after the source's high-water mark on timestamp_utc
+    are considered, unless since_high_water_mark is false for feeds whose rows
+    arrive out of order, and rows whose (store_id, timestamp_utc) is already
+    stored are skipped. For a file path, reading resumes at the byte offset
+    reached last time, unless the file has since been replaced by another.
+    The appended rows are added to the rollups, with the business hours of the
+    given menu hours and timezones files.
+    Returns a dict with rows read, rows appended and the new high-water mark.
+    Raises ValueError when the CSV header is not the status table's columns,
+    or when csv_file is given under the name of a file feed, whose byte
+    offset the run would overwrite.
+    """
+    status = TABLES["test__store_status"]
+    dialect = engine.dialect.name
+    started = time.perf_counter()
+    delta = _delta_table(engine)
+
+    with engine.connect() as connection:
+        mark = connection.execute(
+            select(watermarks).where(watermarks.c.source == source)
+        ).first()
+    high_water_mark = mark.high_water_mark if mark else None
+
+    opened = csv_file is None
+    if not opened and _is_file_feed(source, mark):
+        raise ValueError(f"source {source} names a status file feed")
+    fingerprint = None
+    if opened:
+        byte_offset = (mark.byte_offset if mark else None) or 0
+        if byte_offset and not _resumable(source, byte_offset, mark.file_fingerprint):
+            # a different file under the same path: its rows may be older than
+            # the high-water mark too
+            print(f"{source} has been replaced; reading it from the start")
+            byte_offset, high_water_mark = 0, None
+        header, csv_file, byte_offset, fingerprint = _open_new_lines(
+            source, byte_offset
+        )
+    else:
+        header, byte_offset = csv_file.readline(), None
+
+    try:
+        header = next(csv.reader([header]), [])
+        _check_header(header)
+        with engine.begin() as connection:
+            raw_connection = connection.connection.dbapi_connection
+            if dialect == "postgresql":
+                rows_read = _copy_postgres(raw_connection, delta, header, csv_file)
+            else:
+                rows_read = _insert_sqlite(raw_connection, delta, header, csv_file)
+
+            existing = status.alias("existing")
+            new_rows = (
+                select(
+                    delta.c.store_id,
+                    func.max(delta.c.status),
+                    delta.c.timestamp_utc,
+                )
+                .where(
+                    ~exists().where(
+                        and_(
+                            existing.c.store_id == delta.c.store_id,
+                            existing.c.timestamp_utc == delta.c.timestamp_utc,
+                        )
+                    )
+                )
+                .group_by(delta.c.store_id, delta.c.timestamp_utc)
+            )
+            if since_high_water_mark and high_water_mark is not None:
+                new_rows = new_rows.where(delta.c.timestamp_utc >= high_water_mark)
+            # the rows about to be appended also go into the hourly rollups,
+            # a batch of whole stores at a time
+            result = connection.execute(
+                new_rows.order_by(delta.c.store_id, delta.c.timestamp_utc),
+                execution_options={"stream_results": True},
+            )
+            for batch in rollups.whole_stores(result.partitions(BATCH_SIZE)):
+                rollups.apply(connection, batch, menu_hours_path, timezones_path)
+            appended = connection.execute(
+                status.insert().from_select(
+                    ["store_id", "status", "timestamp_utc"], new_rows
+                )
+            ).rowcount
+
+            delta_max = connection.execute(
+                select(func.max(delta.c.timestamp_utc))
+            ).scalar()
+            high_water_mark = _advance_watermark(
+                connection, source, delta_max, byte_offset, fingerprint, appended
+            )
+            # emptied in the same transaction, so a failed run leaves no rows
+            connection.execute(delta.delete())
+    finally:
+        if opened:
+            csv_file.close()
+
+    seconds = time.perf_counter() - started
+    print(
+        f"Appended {appended} of {rows_read} rows from {source} to "
+        f"{status.name} in {seconds:.2f}s (high-water mark {high_water_mark})"
+    )
+    return {
+        "source": source,
+        "rows_read": rows_read,
+        "rows_appended": appended,
+        "high_water_mark": high_water_mark,
+        "seconds": round(seconds, 3),
+    }
+
+
+def source_versions(sources=SOURCES):
+    """
+    The version each reference table should be at: the checksums of its feeds.
+
+    test__business_hours_utc is built from both the business hours and the
+    timezones, and so are the rollups, which hold business time.
+    """
+    versions = {
+        name: snapshot.checksum(path)[:16]
+        for name, path in sources.items()
+        if name != "test__store_status"
+    }
+    versions["test__business_hours_utc"] = (
+        versions["test__business_hours"] + versions["test__stores"]
+    )
+    versions[rollups.buckets.name] = versions["test__business_hours_utc"]
+    return versions
+
+
+def _loaded_versions(connection):
+    return dict(
+        connection.execute(
+            select(loaded_sources.c.table_name, loaded_sources.c.version)
+        ).all()
+    )
+
+
+def _record_version(engine, table_name, version):
+    with engine.begin() as connection:
+        connection.execute(
+            loaded_sources.delete().where(loaded_sources.c.table_name == table_name)
+        )
+        connection.execute(
+            loaded_sources.insert().values(
+                table_name=table_name,
+                version=version,
+                loaded_at=datetime.now(timezone.utc),
+            )
+        )
+
+
+def stale_sources(engine, sources=SOURCES):
+    """
+    Returns the tables that are missing or behind their CSV feeds.
+
+    Only the versions recorded by load_all and the status high-water mark are
+    compared with the files, so it is cheap enough to run on every start.
+    """
+    versions = source_versions(sources)
+    status_path = sources["test__store_status"]
+    try:
+        with engine.connect() as connection:
+            loaded = _loaded_versions(connection)
+            mark = connection.execute(
+                select(watermarks.c.byte_offset, watermarks.c.file_fingerprint).where(
+                    watermarks.c.source == status_path
+                )
+            ).first()
+    except SQLAlchemyError:
+        # the database has not been migrated yet
+        return list(versions) + ["test__store_status"]
+    stale = [name for name, version in versions.items() if loaded.get(name) != version]
+    if mark is None or mark.byte_offset is None or not _resumable(status_path, *mark):
+        stale.append("test__store_status")
+    else:
+        # complete lines past the high-water mark; a partial last line is not new
+        _, new_lines, end_offset, _ = _open_new_lines(status_path, mark.byte_offset)
+        new_lines.close()
+        if end_offset > mark.byte_offset:
+            stale.append("test__store_status")
+    return stale
+
+
+def load_all(engine, business_hours_utc_df=None, sources=SOURCES, force=False):
+    """
+    Loads the reference CSV feeds, plus the UTC business hours when given.
+
+    `sources` maps each table to its CSV file, as SOURCES does. A reference
+    table is skipped when its feeds are unchanged since it was last loaded,
+    unless `force` is set.
+
+    The rollups are recomputed from the stored status when the business
+    hours or timezones differ from those they were built with.
+
+    store_status.csv is ingested incrementally, so only rows appended since the
+    last run are read.
+    """
+    models.Base.metadata.create_all(engine, tables=[loaded_sources])
+    versions = source_versions(sources)
+    with engine.connect() as connection:
+        loaded = {} if force else _loaded_versions(connection)
+
+    stats = []
+    for name, path in sources.items():
+        if name == "test__store_status":
+            continue
+        if loaded.get(name) == versions[name]:
+            print(f"{name} is up to date")
+            continue
+        stats.append(load_table(engine, name, path))
+        _record_version(engine, name, versions[name])
+    utc_name = "test__business_hours_utc"
+    if business_hours_utc_df is not None:
+        if loaded.get(utc_name) == versions[utc_name]:
+            print(f"{utc_name} is up to date")
+        else:
+            stats.append(load_dataframe(engine, utc_name, business_hours_utc_df))
+            _record_version(engine, utc_name, versions[utc_name])
+    # before the new status rows, which are then added under the same hours
+    rollup_name = rollups.buckets.name
+    if loaded.get(rollup_name) == versions[rollup_name]:
+        print(f"{rollup_name} is up to date")
+    else:
+        rollups.rebuild(
+            engine,
+            menu_hours_path=sources["test__business_hours"],
+            timezones_path=sources["test__stores"],
+        )
+        _record_version(engine, rollup_name, versions[rollup_name])
+    stats.append(
+        ingest_status_delta(
+            engine,
+            sources["test__store_status"],
+            menu_hours_path=sources["test__business_hours"],
+            timezones_path=sources["test__stores"],
+        )
+    )
+    return stats
+
+
+def warm_up(engine, sources=SOURCES, force=False):
+    """
+    The one-shot startup work: migrations, loading the CSV feeds and writing
+    the reference data the API workers share.
+
+    Run once per deployment, before the API workers start (python ingest.py
+    load); the workers themselves only check that the data is current.
+    Returns the load_all stats.
+    """
+    migrations.upgrade(engine)
+    menu_hours_path = sources["test__business_hours"]
+    timezones_path = sources["test__stores"]
+    # converted to UTC at today's offsets (cached on disk)
+    business_hours_df = utils.load_business_hours_utc(menu_hours_path, timezones_path)
+    stats = load_all(engine, business_hours_df, sources, force)
+    reference.build(menu_hours_path, timezones_path)
+    return stats
+
+
+if __name__ == "__main__":
+    from database import engine
+    import jobs
+
+    parser = argparse.ArgumentParser(description="Load store monitoring data")
+    commands = parser.add_subparsers(dest="command", required=True)
+    delta_parser = commands.add_parser(
+        "delta", help="append new rows from a store_status CSV file"
+    )
+    delta_parser.add_argument("path")
+    load_parser = commands.add_parser(
+        "load", help="migrate, load the CSV feeds and write the shared reference data"
+    )
+    load_parser.add_argument(
+        "--force", action="store_true", help="reload unchanged reference tables too"
+    )
+    args = parser.parse_args()
+
+    if args.command == "delta":
+        ingest_status_delta(engine, args.path)
+    elif args.command == "load":
+        warm_up(engine, force=args.force)
+        # report jobs of the previous deployment's workers will never finish
+        jobs.fail_interrupted_jobs()
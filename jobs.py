@@ -0,0 +1,438 @@
+import contextlib
+import cProfile
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from sqlalchemy import func
+
+import crud
+import ingest
+import models
+import profiling
+import snapshot
+from database import SessionLocal, engine
+
+try:
+    import pyinstrument
+except ImportError:  # the pyinstrument profiler is offered only when installed
+    pyinstrument = None
+
+
+REPORTS_DIR = "reports"
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))
+# "rollups" sums the hourly rollups in the database; "sql" computes the report in
+# the database from the status table; "csv" recomputes it from the status snapshot;
+# "chunked" recomputes it from the status table, streamed in chunks
+REPORT_SOURCE = os.environ.get("REPORT_SOURCE", "rollups")
+# bytes a chunked report may use, whatever the size of the status history
+REPORT_MEMORY_BUDGET = int(os.environ.get("REPORT_MEMORY_BUDGET", str(256 << 20)))
+# processes each csv report is sharded across by store_id
+REPORT_SHARD_WORKERS = int(os.environ.get("REPORT_SHARD_WORKERS", "1"))
+# set to keep each report's filtered observations next to it for debugging
+REPORT_SPILL = os.environ.get("REPORT_SPILL", "") not in ("", "0")
+
+# finished reports are cached per data version; the least recently used ones
+# are evicted once there are more files or bytes than these limits
+REPORT_CACHE_MAX_FILES = int(os.environ.get("REPORT_CACHE_MAX_FILES", "50"))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", str(1 << 30)))
+
+# report job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+EVICTED = "evicted"
+
+# report cache counters since the process started
+cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def report_path(report_id):
+    return os.path.join(REPORTS_DIR, f"{report_id}.csv")
+
+
+def profile_path(report_id):
+    return os.path.join(REPORTS_DIR, f"{report_id}.profile.json")
+
+
+def available_profilers():
+    """Profilers a report job can run under, besides the always-on stage timings."""
+    return ["cprofile"] + (["pyinstrument"] if pyinstrument is not None else [])
+
+
+def _report_files(report_id):
+    return glob.glob(os.path.join(REPORTS_DIR, f"{glob.escape(report_id)}.*"))
+
+
+def data_version():
+    """
+    Returns a token that changes whenever a report's output could change.
+
+    It covers the ingest high-water marks and row counts, the versions the
+    tables were loaded or the rollups built at, the business hours and
+    timezone files, the status file when reports are computed from it, and
+    the report source.
+    """
+    digest = hashlib.sha256(REPORT_SOURCE.encode())
+    with SessionLocal() as session:
+        marks = session.query(models.IngestWatermark).order_by(
+            models.IngestWatermark.source
+        )
+        for mark in marks:
+            digest.update(
+                f"{mark.source}|{mark.high_water_mark}|{mark.rows}\n".encode()
+            )
+        loaded = session.query(models.LoadedSource).order_by(
+            models.LoadedSource.table_name
+        )
+        for source in loaded:
+            digest.update(f"{source.table_name}|{source.version}\n".encode())
+    sources = ["test__business_hours", "test__stores"]
+    if REPORT_SOURCE == "csv":
+        sources.append("test__store_status")
+    for source in sources:
+        digest.update(snapshot.checksum(ingest.SOURCES[source]).encode())
+    return digest.hexdigest()[:16]
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _update_job(report_id, **values):
+    with SessionLocal() as session:
+        session.query(models.ReportJob).filter(
+            models.ReportJob.report_id == report_id
+        ).update(values)
+        session.commit()
+
+
+def _init_worker():
+    # connections inherited from the parent process must not be reused here
+    engine.dispose(close=False)
+
+
+@contextlib.contextmanager
+def _profiler(report_id, profiler):
+    """Runs the block under cProfile or pyinstrument, saving the output next to the report."""
+    if profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(os.path.join(REPORTS_DIR, f"{report_id}.pstats"))
+    elif profiler == "pyinstrument":
+        profile = pyinstrument.Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(os.path.join(REPORTS_DIR, f"{report_id}.profile.html"), "w") as f:
+                f.write(profile.output_html())
+    else:
+        yield
+
+
+def generate_report(report_id, profiler=None):
+    """Computes the uptime/downtime report and writes it to reports/<report_id>.csv"""
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = report_path(report_id)
+    tmp_path = f"{path}.tmp"
+    spill_path = (
+        os.path.join(REPORTS_DIR, f"{report_id}.filtered.parquet")
+        if REPORT_SPILL
+        else None
+    )
+    with _profiler(report_id, profiler):
+        if REPORT_SOURCE == "rollups":
+            with SessionLocal() as session:
+                crud.get_uptime_downtime_rollups(session, tmp_path)
+        elif REPORT_SOURCE == "sql":
+            with SessionLocal() as session:
+                crud.get_uptime_downtime_sql(session, tmp_path)
+        elif REPORT_SOURCE == "chunked":
+            with SessionLocal() as session:
+                crud.get_uptime_downtime_chunked(
+                    session, tmp_path, REPORT_MEMORY_BUDGET
+                )
+        else:
+            crud.get_uptime_downtime_local(tmp_path, spill_path, REPORT_SHARD_WORKERS)
+    os.replace(tmp_path, path)
+
+
+def _finish_job(report_id, started, stages, status, error=None):
+    """Records a job's final state and writes its stage profile next to the report."""
+    seconds = time.perf_counter() - started
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    path = profile_path(report_id)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(
+            {
+                "report_id": report_id,
+                "status": status,
+                "source": REPORT_SOURCE,
+                "seconds": round(seconds, 6),
+                "stages": stages,
+            },
+            f,
+            indent=2,
+        )
+    os.replace(f"{path}.tmp", path)
+    _update_job(
+        report_id,
+        status=status,
+        finished_at=_now(),
+        duration_seconds=seconds,
+        error=error,
+    )
+
+
+def run_report_job(report_id, profiler=None):
+    """Runs one report job in a pool worker, recording its state, timings and profile."""
+    started = time.perf_counter()
+    _update_job(report_id, status=RUNNING, started_at=_now())
+    with profiling.profile() as stages:
+        try:
+            generate_report(report_id, profiler)
+        except Exception:
+            _finish_job(report_id, started, stages, FAILED, traceback.format_exc())
+            raise
+    _finish_job(report_id, started, stages, COMPLETE)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=REPORT_WORKERS, initializer=_init_worker
+        )
+    return _pool
+
+
+def _submit(report_id, profiler):
+    """
+    Submits a job to the pool. A pool broken by a crashed worker refuses
+    every job, so it is replaced once and the job submitted to the new one.
+    """
+    global _pool
+    try:
+        return _get_pool().submit(run_report_job, report_id, profiler)
+    except BrokenProcessPool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        return _get_pool().submit(run_report_job, report_id, profiler)
+
+
+def _job_done(report_id, future):
+    error = future.exception()
+    try:
+        with open(profile_path(report_id)) as f:
+            profile_data = json.load(f)
+        profiling.observe_profile(profile_data)
+        profiling.observe_report(profile_data["status"], profile_data["seconds"])
+    except (OSError, ValueError):
+        pass
+    if error is None:
+        evict_reports()
+    if error is not None:
+        # the worker records its own failures; this catches crashed workers
+        with SessionLocal() as session:
+            job = session.get(models.ReportJob, report_id)
+            if job is not None and job.status != FAILED:
+                job.status = FAILED
+                job.finished_at = _now()
+                job.error = repr(error)
+                session.commit()
+
+
+def _pending_report(job_key):
+    """Returns the report_id of a job for job_key still queued or running, or None."""
+    with SessionLocal() as session:
+        return (
+            session.query(models.ReportJob.report_id)
+            .filter(
+                models.ReportJob.job_key == job_key,
+                models.ReportJob.status.in_((QUEUED, RUNNING)),
+            )
+            .order_by(models.ReportJob.queued_at.desc())
+            .limit(1)
+            .scalar()
+        )
+
+
+def _cached_report(job_key):
+    """Returns the report_id of a finished report for job_key, or None."""
+    with SessionLocal() as session:
+        finished = (
+            session.query(models.ReportJob)
+            .filter(
+                models.ReportJob.job_key == job_key,
+                models.ReportJob.status == COMPLETE,
+            )
+            .order_by(models.ReportJob.finished_at.desc())
+        )
+        for job in finished:
+            if os.path.exists(report_path(job.report_id)):
+                job.last_used_at = _now()
+                session.commit()
+                return job.report_id
+    return None
+
+
+def submit_report(job_key=None, profiler=None):
+    """
+    Returns the report_id of a report for the current data, queuing it if needed.
+
+    Jobs are keyed on data_version() unless a job_key is given. A finished
+    report with the same key is returned as is, and a job with the same key
+    that is still queued or running, in this process or another API worker,
+    is reused instead of starting another one. A job run under a profiler
+    (see available_profilers) is always new.
+    """
+    if profiler is not None:
+        job_key = f"profile:{uuid.uuid4()}"
+    elif job_key is None:
+        job_key = f"report:{data_version()}"
+    with _pool_lock:
+        report_id = _pending_report(job_key)
+        if report_id is not None:
+            cache_stats["coalesced"] += 1
+            return report_id
+
+        report_id = _cached_report(job_key)
+        if report_id is not None:
+            cache_stats["hits"] += 1
+            return report_id
+        cache_stats["misses"] += 1
+
+        report_id = str(uuid.uuid4())
+        with SessionLocal() as session:
+            session.add(
+                models.ReportJob(
+                    report_id=report_id,
+                    job_key=job_key,
+                    status=QUEUED,
+                    queued_at=_now(),
+                )
+            )
+            session.commit()
+
+        try:
+            future = _submit(report_id, profiler)
+        except Exception as e:
+            # a job that never reached the pool must not be reused as pending
+            _update_job(report_id, status=FAILED, finished_at=_now(), error=repr(e))
+            raise
+
+    future.add_done_callback(lambda future: _job_done(report_id, future))
+    return report_id
+
+
+def fail_interrupted_jobs():
+    """
+    Marks the jobs still queued or running as failed, returning how many.
+
+    Their pool workers went away with the previous run of the app, so they
+    would never finish, and new requests would keep being coalesced onto
+    them. Run once at startup, before the API workers take requests.
+    """
+    with SessionLocal() as session:
+        failed = (
+            session.query(models.ReportJob)
+            .filter(models.ReportJob.status.in_((QUEUED, RUNNING)))
+            .update(
+                {
+                    models.ReportJob.status: FAILED,
+                    models.ReportJob.finished_at: _now(),
+                    models.ReportJob.error: "interrupted by a restart",
+                },
+                synchronize_session=False,
+            )
+        )
+        session.commit()
+    return failed
+
+
+def get_job(report_id):
+    """Returns the ReportJob row for a report_id, or None."""
+    with SessionLocal() as session:
+        return session.get(models.ReportJob, report_id)
+
+
+def touch_report(report_id):
+    """Marks a report as just used, e.g. when it is downloaded."""
+    _update_job(report_id, last_used_at=_now())
+
+
+def evict_reports():
+    """
+    Deletes the files of the least recently used finished reports.
+
+    Reports are kept, most recently used first, while they fit in
+    REPORT_CACHE_MAX_FILES and REPORT_CACHE_MAX_BYTES; the newest one is always
+    kept. Evicted jobs are marked EVICTED. Returns the number evicted.
+    """
+    evicted = 0
+    kept_files = kept_bytes = 0
+    with SessionLocal() as session:
+        finished = (
+            session.query(models.ReportJob)
+            .filter(models.ReportJob.status == COMPLETE)
+            .order_by(
+                func.coalesce(
+                    models.ReportJob.last_used_at, models.ReportJob.finished_at
+                ).desc()
+            )
+        )
+        for job in finished:
+            paths = _report_files(job.report_id)
+            size = sum(os.path.getsize(path) for path in paths)
+            if kept_files == 0 or (
+                kept_files < REPORT_CACHE_MAX_FILES
+                and kept_bytes + size <= REPORT_CACHE_MAX_BYTES
+            ):
+                kept_files += 1
+                kept_bytes += size
+                continue
+            for path in paths:
+                os.remove(path)
+            job.status = EVICTED
+            evicted += 1
+        session.commit()
+    cache_stats["evictions"] += evicted
+    return evicted
+
+
+def cache_info():
+    """Report cache counters, plus the reports currently on disk and the limits."""
+    paths = glob.glob(os.path.join(REPORTS_DIR, "*"))
+    return {
+        **cache_stats,
+        "files": len(glob.glob(os.path.join(REPORTS_DIR, "*.csv"))),
+        "bytes": sum(os.path.getsize(path) for path in paths),
+        "max_files": REPORT_CACHE_MAX_FILES,
+        "max_bytes": REPORT_CACHE_MAX_BYTES,
+    }
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,123 @@
+import functools
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytz
+
+NS = 1_000_000_000
+# stands in for "since forever", with room to add an offset without overflowing
+BEGINNING = np.iinfo(np.int64).min // 2
+
+
+@functools.lru_cache(maxsize=None)
+def _zone_table(timezone_str, first_year, last_year):
+    zone = pytz.timezone(timezone_str)
+    utc_times = getattr(zone, "_utc_transition_times", None)
+    if not utc_times:
+        # fixed-offset zones such as UTC have no transitions
+        offset = zone.utcoffset(datetime(first_year, 1, 1))
+        return (
+            np.array([BEGINNING], dtype=np.int64),
+            np.array([offset // pd.Timedelta(1, "ns")], dtype=np.int64),
+        )
+
+    # pytz's own transition table, from year 1 to 2037
+    seconds = np.array(utc_times, dtype="datetime64[s]").astype(np.int64)
+    offsets = np.array(
+        [utcoffset.total_seconds() for utcoffset, _, _ in zone._transition_info],
+        dtype=np.int64,
+    )
+    start = pd.Timestamp(f"{first_year}-01-01").value // NS
+    # a year beyond the range, so the transition following any time is known
+    end = pd.Timestamp(f"{last_year + 2}-01-01").value // NS
+    # the transitions within the range, after the one in effect at its start
+    keep = np.flatnonzero((seconds > start) & (seconds < end))
+    first = np.searchsorted(seconds, start, side="right") - 1
+    instants = np.r_[BEGINNING, seconds[keep] * NS]
+    return instants, np.r_[offsets[first], offsets[keep]] * NS
+
+
+def transitions(timezone_str, start_ns, end_ns):
+    """
+    The zone's UTC offsets over [start_ns, end_ns], as sorted transition arrays.
+
+    Returns (instants, offsets): the UTC epoch-ns at which each offset takes
+    effect, the first one covering all earlier times, and the offsets (local
+    minus UTC) in ns. Built from pytz's tables, per whole years, once per zone.
+    """
+    first_year = pd.Timestamp(int(start_ns)).year
+    last_year = pd.Timestamp(int(end_ns)).year
+    return _zone_table(timezone_str, first_year, last_year)
+
+
+def _zones(timestamps_ns, zone_codes, zone_names):
+    """Yields (rows, instants, offsets) for every zone with rows."""
+    if len(timestamps_ns) == 0:
+        return
+    start_ns, end_ns = timestamps_ns.min(), timestamps_ns.max()
+    zone_codes = np.asarray(zone_codes)
+    # rows grouped by zone in one sort, rather than a scan per zone
+    order = np.argsort(zone_codes, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(zone_codes, minlength=len(zone_names)))]
+    for code, timezone_str in enumerate(zone_names):
+        rows = order[bounds[code] : bounds[code + 1]]
+        if len(rows):
+            yield (rows,) + transitions(timezone_str, start_ns, end_ns)
+
+
+def utc_offsets(timestamps_ns, zone_codes, zone_names) -> np.ndarray:
+    """
+    The offset (local minus UTC, in ns) of each UTC instant in its zone.
+
+    `zone_codes` are positions in `zone_names`, one per timestamp. There are
+    only a few dozen zones, so each one costs a single searchsorted over its
+    transitions rather than a pytz lookup per value.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    offsets = np.zeros(len(timestamps_ns), dtype=np.int64)
+    for rows, instants, zone_offsets in _zones(timestamps_ns, zone_codes, zone_names):
+        position = np.searchsorted(instants, timestamps_ns[rows], side="right") - 1
+        offsets[rows] = zone_offsets[position]
+    return offsets
+
+
+def next_transitions(timestamps_ns, zone_codes, zone_names) -> np.ndarray:
+    """The first transition after each UTC instant in its zone, or int64 max."""
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    following = np.full(len(timestamps_ns), np.iinfo(np.int64).max, dtype=np.int64)
+    for rows, instants, _ in _zones(timestamps_ns, zone_codes, zone_names):
+        position = np.searchsorted(instants, timestamps_ns[rows], side="right")
+        known = position < len(instants)
+        following[rows[known]] = instants[position[known]]
+    return following
+
+
+def to_local(timestamps_ns, zone_codes, zone_names) -> np.ndarray:
+    """Wall-clock times of UTC instants, as epoch-ns of the same wall time in UTC."""
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    return timestamps_ns + utc_offsets(timestamps_ns, zone_codes, zone_names)
+
+
+def to_utc(local_ns, zone_codes, zone_names) -> np.ndarray:
+    """
+    UTC instants of wall-clock times, the inverse of to_local.
+
+    As the business hours conversion localizes them, wall times repeated when
+    clocks go back take the later (standard time) instant, and wall times
+    skipped when clocks go forward are shifted forward to the transition.
+    """
+    local_ns = np.asarray(local_ns, dtype=np.int64)
+    utc_ns = local_ns.copy()
+    for rows, instants, offsets in _zones(local_ns, zone_codes, zone_names):
+        # the wall time at which each offset starts; increasing, since
+        # transitions are months apart
+        local_starts = instants + offsets
+        position = np.searchsorted(local_starts, local_ns[rows], side="right") - 1
+        position = np.maximum(position, 0)
+        utc = local_ns[rows] - offsets[position]
+        # a wall time in the gap before a forward transition
+        following = np.minimum(position + 1, len(instants) - 1)
+        skipped = (position + 1 < len(instants)) & (utc >= instants[following])
+        utc_ns[rows] = np.where(skipped, instants[following], utc)
+    return utc_ns
@@ -1,77 +1,40 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List
-import csv
+from typing import List, Optional
+import contextlib
 import io
-import uuid
-from datetime import datetime, timedelta
+import os
 from sqlalchemy.orm import Session
 from database import engine, SessionLocal
-import models
-import crud
+import downloads
+import ingest
+import jobs
+import profiling
+import reference
+import status_buffer
+import store_lookup
 import utils
-import pandas as pd
-import pytz
 
-models.Base.metadata.create_all(bind=engine)
 
-df = pd.read_csv("timezones.csv")
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Loading the CSV feeds is `python ingest.py load`, run once before the
+    # workers start; each worker only checks that the data is current
+    stale = ingest.stale_sources(engine)
+    if stale:
+        print(f"Data is not current ({', '.join(stale)}); run `python ingest.py load`")
+    else:
+        # Map the shared reference data before report workers are forked
+        reference.load()
+    yield
+    # write what is still buffered before the worker exits
+    status_buffer.stop()
+    jobs.shutdown()
 
-try:
-    df.to_sql("test__stores", engine, if_exists="replace", index=False)
-except:
-    print("Sorry, some error has occurred!")
 
-df = pd.read_csv("menu_hours.csv")
-
-try:
-    df.to_sql("test__business_hours", engine, if_exists="replace", index=False)
-except:
-    print("Sorry, some error has occurred!")
-
-
-df = pd.read_csv("store_status.csv")
-
-try:
-    df.to_sql("test__store_status", engine, if_exists="replace", index=False)
-except:
-    print("Sorry, some error has occurred!")
-
-
-# Load timezone information from the third table
-timezone_df = pd.read_csv("timezones.csv")
-timezone_dict = dict(zip(timezone_df.store_id, timezone_df.timezone_str))
-
-# Load data from the first and second tables
-business_hours_df = pd.read_csv("menu_hours.csv")
-
-
-# Convert time ranges in business_hours.csv to UTC
-for i, row in business_hours_df.iterrows():
-    store_id = row["store_id"]
-    local_tz = pytz.timezone(timezone_dict.get(store_id, "America/Chicago"))
-
-    start_time = datetime.strptime(row["start_time_local"], "%H:%M:%S").replace(
-        tzinfo=local_tz
-    )
-    end_time = datetime.strptime(row["end_time_local"], "%H:%M:%S").replace(
-        tzinfo=local_tz
-    )
-    start_utc = start_time.astimezone(pytz.utc).strftime("%H:%M:%S")
-    end_utc = end_time.astimezone(pytz.utc).strftime("%H:%M:%S")
-    business_hours_df.at[i, "start_time_utc"] = start_utc
-    business_hours_df.at[i, "end_time_utc"] = end_utc
-
-
-try:
-    business_hours_df.to_sql(
-        "test__business_hours_utc", engine, if_exists="replace", index=False
-    )
-except:
-    print("Sorry, some error has occurred!")
-
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 def get_db():
@@ -86,7 +49,8 @@ def get_db():
 
 
 class ReportRequest(BaseModel):
-    pass
+    # opt-in "cprofile" or "pyinstrument" capture of the report job
+    profiler: Optional[str] = None
 
 
 class ReportResponse(BaseModel):
@@ -97,12 +61,25 @@ class ReportStatusResponse(BaseModel):
     status: str
 
 
+class StoreBatchRequest(BaseModel):
+    store_ids: List[int]
+
+
+def check_store_ids(store_ids):
+    # ids outside the status table's BigInteger range cannot be stored or queried
+    for store_id in store_ids:
+        if not status_buffer.INT64_MIN <= store_id <= status_buffer.INT64_MAX:
+            raise HTTPException(
+                status_code=400, detail="store_id must be a 64-bit integer"
+            )
+
+
 # Define API endpoints
 
 
 @app.get("/")
 def home():
-    return {"business_hours_df": business_hours_df}
+    return {"business_hours_df": utils.load_business_hours_utc()}
 
 
 @app.get("/get_store")
@@ -113,32 +90,149 @@ def get_store_info(db: Session = Depends(get_db)):
 
 @app.post("/trigger_report", response_model=ReportResponse)
 def trigger_report(request: ReportRequest):
-    # Generate report ID
-    report_id = str(uuid.uuid4())
+    if (
+        request.profiler is not None
+        and request.profiler not in jobs.available_profilers()
+    ):
+        raise HTTPException(status_code=400, detail="Unknown or unavailable profiler")
 
-    # Start report generation in background
-    utils.generate_report(report_id)
+    # Queue report generation on the worker pool; a finished report for the
+    # same data version, or one still queued or running, is reused
+    report_id = jobs.submit_report(profiler=request.profiler)
 
     # Return report ID to user
     return {"report_id": report_id}
 
 
 @app.get("/get_report/{report_id}")
-def get_report(report_id: str):
+def get_report(report_id: str, request: Request):
     # Check if report exists
-    report_path = f"reports/{report_id}.csv"
-    if not utils.file_exists(report_path):
+    job = jobs.get_job(report_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Report not found")
 
     # Check if report is complete
-    status_path = f"reports/{report_id}.status"
-    if not utils.file_exists(status_path):
+    if job.status in (jobs.QUEUED, jobs.RUNNING):
         return {"status": "Running"}
+    if job.status == jobs.FAILED:
+        return {"status": "Failed"}
+
+    report_path = jobs.report_path(report_id)
+    if not utils.file_exists(report_path):
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    # Keep recently downloaded reports in the cache
+    jobs.touch_report(report_id)
+
+    # Stream the report from disk, honouring ETag, Range and Accept-Encoding
+    return downloads.file_response(request, report_path, media_type="text/csv")
+
+
+@app.get("/report_cache")
+def report_cache():
+    # Hit/miss/eviction counters of the report cache and its size on disk
+    return jobs.cache_info()
+
+
+@app.get("/stores/{store_id}/uptime")
+def store_uptime(store_id: int):
+    # One store's status and metrics, from the rollups through an in-process LRU
+    check_store_ids([store_id])
+    with engine.connect() as connection:
+        row = store_lookup.lookup(connection, [store_id])[store_id]
+    if row is None:
+        raise HTTPException(status_code=404, detail="Store not found")
+    return row
+
+
+@app.post("/stores/uptime")
+def stores_uptime(request: StoreBatchRequest):
+    # The same for many stores at once; unknown stores are listed as missing
+    if len(request.store_ids) > store_lookup.MAX_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {store_lookup.MAX_BATCH} store_ids per request",
+        )
+    check_store_ids(request.store_ids)
+    with engine.connect() as connection:
+        rows = store_lookup.lookup(connection, request.store_ids)
+    return {
+        "stores": [row for row in rows.values() if row is not None],
+        "missing": [store_id for store_id, row in rows.items() if row is None],
+    }
+
+
+@app.get("/store_cache")
+def store_cache():
+    # Hit/miss/eviction counters of the per-store lookup cache
+    return store_lookup.cache_info()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Report stage timings and cache counters in Prometheus text format
+    counters = {
+        f"report_cache_{name}": value for name, value in jobs.cache_stats.items()
+    }
+    counters.update(
+        {
+            f"store_cache_{name}": value
+            for name, value in store_lookup.cache_stats.items()
+        }
+    )
+    counters.update(
+        {
+            f"status_buffer_{name}": value
+            for name, value in status_buffer.buffer_stats.items()
+        }
+    )
+    return PlainTextResponse(
+        profiling.render_metrics(counters), media_type="text/plain; version=0.0.4"
+    )
+
 
-    # Load report from file and return as CSV response
-    with open(report_path, "r") as f:
-        csv_text = f.read()
-    return StreamingResponse(io.StringIO(csv_text), media_type="text/csv")
+@app.post("/ingest/store_status")
+async def ingest_store_status(request: Request, source: str):
+    # Append a CSV delta (store_id,status,timestamp_utc) to the status table
+    body = (await request.body()).decode()
+    if not body.strip():
+        raise HTTPException(status_code=400, detail="Empty CSV body")
+    try:
+        return await run_in_threadpool(
+            ingest.ingest_status_delta, engine, source, io.StringIO(body)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/status", status_code=202)
+async def post_status(request: Request):
+    # Buffer a JSON or NDJSON batch of (store_id, status, timestamp_utc)
+    # observations; a background thread writes them to the database in bulk
+    body = await request.body()
+    content_type = request.headers.get("content-type", "application/json")
+    try:
+        observations = await run_in_threadpool(
+            status_buffer.parse_observations, body, content_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        buffered = await run_in_threadpool(status_buffer.submit, engine, observations)
+    except TimeoutError:
+        # the database is not keeping up; the client should retry later
+        raise HTTPException(
+            status_code=503,
+            detail="Status buffer is full",
+            headers={"Retry-After": str(int(status_buffer.STATUS_FLUSH_SECONDS) + 1)},
+        )
+    return {"accepted": len(observations), "buffered": buffered}
+
+
+@app.get("/status_buffer")
+def status_buffer_info():
+    # Accepted/flushed/rejected counters of this worker's status write buffer
+    return status_buffer.buffer_info()
 
 
 # Start application
@@ -146,4 +240,16 @@ def get_report(report_id: str):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Load once here; the workers started below only check the data
+    try:
+        ingest.warm_up(engine)
+        jobs.fail_interrupted_jobs()
+    except Exception as e:
+        print(f"Sorry, some error has occurred! {e}")
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("WEB_WORKERS", "1")),
+    )
@@ -0,0 +1,120 @@
+from sqlalchemy import DateTime, MetaData, Table, cast, func, insert, inspect, select
+from sqlalchemy.sql import column as sql_column, table as sql_table
+from sqlalchemy.dialects import postgresql
+
+import ingest
+import models
+
+# tables of earlier layouts that nothing reads any more: the rollups that
+# counted polls, replaced by status_time_rollup
+RETIRED_TABLES = ["status_rollup"]
+
+
+def _converted(dialect, value, type_):
+    """Converts a column from an earlier text-typed load to its declared type."""
+    if dialect.name == "postgresql":
+        return cast(value, type_)
+    if isinstance(type_, DateTime):
+        # "... UTC" suffixes from raw CSV loads, as ingest strips them on SQLite
+        return func.replace(value, " UTC", "")
+    return value
+
+
+def _rebuild(engine, table):
+    """
+    Copies an existing table into one with the declared keys and indexes.
+
+    Rows that collide on the new primary key are dropped, keeping the first one.
+    """
+    dialect = engine.dialect
+    old = inspect(engine).get_columns(table.name)
+    staging = ingest.staging_table(table, primary_key=True)
+    staging.drop(engine, checkfirst=True)
+    staging.create(engine)
+
+    columns = [column["name"] for column in old if column["name"] in staging.c]
+    existing = select(
+        *(
+            _converted(dialect, sql_column(name), staging.c[name].type)
+            for name in columns
+        )
+    ).select_from(sql_table(table.name))
+
+    if dialect.name == "postgresql":
+        statement = (
+            postgresql.insert(staging)
+            .from_select(columns, existing)
+            .on_conflict_do_nothing()
+        )
+    else:
+        statement = (
+            insert(staging).prefix_with("OR IGNORE").from_select(columns, existing)
+        )
+
+    with engine.begin() as connection:
+        copied = connection.execute(statement).rowcount
+
+    raw_connection = engine.raw_connection()
+    try:
+        if dialect.name == "postgresql":
+            with raw_connection.cursor() as cursor:
+                ingest._create_indexes(cursor, dialect, table, staging.name, "staging")
+            raw_connection.commit()
+        ingest._swap(raw_connection, dialect, table)
+    finally:
+        raw_connection.close()
+    print(f"Rebuilt {table.name} with keys ({copied} rows)")
+
+
+def _add_column(engine, table, column):
+    """Adds a nullable column declared in models.py to an existing table."""
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "ALTER TABLE {} ADD COLUMN {} {}".format(
+                preparer.format_table(table),
+                preparer.format_column(column),
+                column.type.compile(engine.dialect),
+            )
+        )
+    print(f"Added column {table.name}.{column.name}")
+
+
+def upgrade(engine):
+    """
+    Brings the database up to the keys and indexes declared in models.py.
+
+    Missing tables are created, tables whose primary key differs are rebuilt,
+    missing nullable columns and indexes are added and retired tables are
+    dropped. ingest.load_all fills the rollups from the stored status. Safe
+    to run on every start.
+    """
+    existing = set(inspect(engine).get_table_names())
+    for name in RETIRED_TABLES:
+        if name in existing:
+            Table(name, MetaData()).drop(engine)
+            print(f"Dropped retired table {name}")
+    models.Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        primary_key = inspector.get_pk_constraint(table.name)["constrained_columns"]
+        if set(primary_key) != {column.name for column in table.primary_key}:
+            _rebuild(engine, table)
+            continue
+
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns and column.nullable:
+                _add_column(engine, table, column)
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(engine)
+                print(f"Created index {index.name}")
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    upgrade(engine)
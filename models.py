@@ -3,15 +3,17 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+from sqlalchemy import BigInteger, Float, Index, Text, Time
 
 
 from database import Base, engine
 
+
 # define the schema for the stores table
 class Store(Base):
     __tablename__ = "test__stores"
 
-    store_id = Column(String, primary_key=True)
+    store_id = Column(BigInteger, primary_key=True)
     timezone_str = Column(String)
 
 
@@ -19,30 +21,102 @@ class Store(Base):
 class BusinessHour(Base):
     __tablename__ = "test__business_hours"
 
-    store_id = Column(Integer, primary_key=True)
-    day_of_week = Column(Integer)
-    start_time_local = Column(DateTime)
-    end_time_local = Column(DateTime)
+    # a store can have several shifts per day, keyed by their start time
+    store_id = Column(BigInteger, primary_key=True)
+    day_of_week = Column("day", Integer, primary_key=True)
+    start_time_local = Column(Time, primary_key=True)
+    end_time_local = Column(Time)
 
 
 class BusinessHourUTC(Base):
     __tablename__ = "test__business_hours_utc"
 
-    store_id = Column(Integer, primary_key=True)
-    day_of_week = Column(Integer)
-    start_time_local = Column(DateTime)
-    end_time_local = Column(DateTime)
-    start_time_utc = Column(DateTime)
-    end_time_utc = Column(DateTime)
+    store_id = Column(BigInteger, primary_key=True)
+    day_of_week = Column("day", Integer, primary_key=True)
+    start_time_local = Column(Time, primary_key=True)
+    end_time_local = Column(Time)
+    start_time_utc = Column(Time)
+    end_time_utc = Column(Time)
+    # local minus UTC at the start time, for placing the shift in the UTC week
+    utc_offset_seconds = Column(Integer)
 
 
 # define the schema for the store status table
 class StoreStatus(Base):
     __tablename__ = "test__store_status"
-
-    store_id = Column(Integer, primary_key=True)
-    timestamp_utc = Column(DateTime)
-    status = Column(Boolean)
+    __table_args__ = (
+        # polls arrive in time order, so a BRIN index on PostgreSQL covers
+        # fleet-wide time-range scans at a tiny fraction of a B-tree's size
+        Index(
+            "ix_test__store_status_timestamp_utc",
+            "timestamp_utc",
+            postgresql_using="brin",
+        ),
+    )
+
+    # the (store_id, timestamp_utc) key serves per-store time lookups
+    store_id = Column(BigInteger, primary_key=True)
+    timestamp_utc = Column(DateTime(timezone=True), primary_key=True)
+    status = Column(String)
+
+
+class StatusRollup(Base):
+    __tablename__ = "status_time_rollup"
+    __table_args__ = (
+        # the report sums the last week of buckets across every store; the
+        # covering columns spare a table lookup per bucket
+        Index(
+            "ix_status_time_rollup_bucket_start_utc",
+            "bucket_start_utc",
+            "store_id",
+            "active_ns",
+            "inactive_ns",
+        ),
+    )
+
+    # business-hours time of a store per hour, in nanoseconds, by the status
+    # of the poll before it; kept up to date by ingest
+    store_id = Column(BigInteger, primary_key=True)
+    bucket_start_utc = Column(DateTime(timezone=True), primary_key=True)
+    active_ns = Column(BigInteger, nullable=False)
+    inactive_ns = Column(BigInteger, nullable=False)
+    # the status in effect at bucket_start_utc, when an earlier poll exists
+    entering_status = Column(String)
+
+
+class StoreLatestStatus(Base):
+    __tablename__ = "store_latest_status"
+
+    # the first and newest observations of a store, whose statuses run on
+    # before and after them, and its newest one in business hours
+    store_id = Column(BigInteger, primary_key=True)
+    first_seen_utc = Column(DateTime(timezone=True))
+    first_status = Column(String)
+    last_seen_utc = Column(DateTime(timezone=True))
+    last_status = Column(String)
+    status = Column(String)
+    status_utc = Column(DateTime(timezone=True))
+
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermark"
+
+    # how far each incremental status source has been ingested
+    source = Column(String, primary_key=True)
+    high_water_mark = Column(DateTime(timezone=True))
+    byte_offset = Column(BigInteger)
+    # identifies the file byte_offset was reached in, see ingest._fingerprint
+    file_fingerprint = Column(String)
+    rows = Column(BigInteger)
+
+
+class LoadedSource(Base):
+    __tablename__ = "loaded_source"
+
+    # checksum of the CSV feeds each reference table was last loaded from
+    table_name = Column(String, primary_key=True)
+    version = Column(String, nullable=False)
+    loaded_at = Column(DateTime(timezone=True))
 
 
 class Report(Base):
@@ -58,5 +132,24 @@ class Report(Base):
     update_last_week = Column(Integer)
 
 
+class ReportJob(Base):
+    __tablename__ = "report_job"
+    __table_args__ = (
+        # finished reports are looked up by the data version in their job_key
+        Index("ix_report_job_job_key", "job_key"),
+    )
+
+    report_id = Column(String, primary_key=True)
+    job_key = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    queued_at = Column(DateTime(timezone=True), nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    duration_seconds = Column(Float)
+    error = Column(Text)
+    # last time the report was returned from the cache or downloaded
+    last_used_at = Column(DateTime(timezone=True))
+
+
 # create the tables in the database
-# Base.metadata.create_all(engine)
\ No newline at end of file
+# Base.metadata.create_all(engine)
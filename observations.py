@@ -0,0 +1,154 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import uptime
+
+STATUSES = ("inactive", "active")
+
+
+def _ns(timestamp) -> int:
+    """Epoch nanoseconds of a datetime; naive datetimes are taken as UTC."""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.value
+
+
+def _timestamp(ns) -> pd.Timestamp:
+    return pd.Timestamp(int(ns), tz="UTC")
+
+
+class ObservationIndex:
+    """
+    Status observations held as flat arrays, grouped by store.
+
+    Stores are sorted by store_id and each one owns the slice
+    timestamps[offsets[i]:offsets[i + 1]], sorted by time (CSR layout).
+    Statuses are bit-packed, one bit per observation (1 = active), so an
+    observation costs 8 bytes plus a bit. Lookups binary-search the store and
+    then its slice.
+    """
+
+    def __init__(self, store_ids, offsets, timestamps_ns, status_bits):
+        self.store_ids = store_ids
+        self.offsets = offsets
+        self.timestamps_ns = timestamps_ns
+        self.status_bits = status_bits
+
+    @classmethod
+    def from_arrays(cls, store_ids, timestamps_ns, is_active):
+        """Builds the index from parallel, unsorted per-observation arrays."""
+        store_ids = np.asarray(store_ids, dtype=np.int64)
+        timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+        order = np.lexsort((timestamps_ns, store_ids))
+        sorted_ids = store_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        if len(sorted_ids) == 0:
+            starts = starts[:0]
+        return cls(
+            sorted_ids[starts],
+            np.append(starts, len(sorted_ids)).astype(np.int64),
+            timestamps_ns[order],
+            np.packbits(np.asarray(is_active, dtype=bool)[order]),
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """Builds the index from a (store_id, status, timestamp_utc) frame."""
+        return cls.from_arrays(
+            df["store_id"].to_numpy(),
+            uptime.epoch_ns(df["timestamp_utc"]),
+            (df["status"] == "active").to_numpy(),
+        )
+
+    def __len__(self):
+        return len(self.timestamps_ns)
+
+    @property
+    def nbytes(self):
+        return (
+            self.store_ids.nbytes
+            + self.offsets.nbytes
+            + self.timestamps_ns.nbytes
+            + self.status_bits.nbytes
+        )
+
+    def _slice(self, store_id) -> Tuple[int, int]:
+        position = np.searchsorted(self.store_ids, store_id)
+        if position == len(self.store_ids) or self.store_ids[position] != store_id:
+            return 0, 0
+        return int(self.offsets[position]), int(self.offsets[position + 1])
+
+    def is_active(self, positions) -> np.ndarray:
+        """Unpacks the status bits of the given observation positions."""
+        positions = np.asarray(positions, dtype=np.int64)
+        return (self.status_bits[positions >> 3] >> (7 - (positions & 7))) & 1 == 1
+
+    def _observation(self, position) -> Tuple[str, pd.Timestamp]:
+        return (
+            STATUSES[int(self.is_active(position))],
+            _timestamp(self.timestamps_ns[position]),
+        )
+
+    def _last_before(self, store_id, timestamp, side):
+        start, end = self._slice(store_id)
+        position = start + np.searchsorted(
+            self.timestamps_ns[start:end], _ns(timestamp), side=side
+        )
+        if position == start:
+            # Store has no status data before given timestamp
+            return None, None
+        return self._observation(position - 1)
+
+    def latest_status(
+        self, store_id: int, timestamp: datetime
+    ) -> Tuple[Optional[str], Optional[pd.Timestamp]]:
+        """The latest (status, timestamp) of a store at or before the given timestamp."""
+        return self._last_before(store_id, timestamp, "right")
+
+    def previous_status(
+        self, store_id: int, timestamp: datetime
+    ) -> Tuple[Optional[str], Optional[pd.Timestamp]]:
+        """Like latest_status, but strictly before the given timestamp"""
+        return self._last_before(store_id, timestamp, "left")
+
+    def window(self, store_id: int, start_time: datetime, end_time: datetime):
+        """
+        Positions [start, end) of a store's observations in [start_time, end_time).
+
+        Use them to slice timestamps_ns or to call is_active without
+        materializing tuples.
+        """
+        start, end = self._slice(store_id)
+        timestamps = self.timestamps_ns[start:end]
+        return (
+            start + int(np.searchsorted(timestamps, _ns(start_time), side="left")),
+            start + int(np.searchsorted(timestamps, _ns(end_time), side="left")),
+        )
+
+    def statuses_between(
+        self, store_id: int, start_time: datetime, end_time: datetime
+    ) -> List[Tuple[str, pd.Timestamp]]:
+        """All (status, timestamp) of a store in [start_time, end_time), by time"""
+        start, end = self.window(store_id, start_time, end_time)
+        return [self._observation(position) for position in range(start, end)]
+
+    def latest_statuses(
+        self, store_ids: Optional[Iterable[int]], timestamp: datetime
+    ) -> Dict[int, tuple]:
+        """
+        latest_status for many stores (or every store for None).
+
+        Stores without a status before the timestamp are left out.
+        """
+        if store_ids is None:
+            store_ids = self.store_ids.tolist()
+        result = {}
+        for store_id in store_ids:
+            status, at = self.latest_status(store_id, timestamp)
+            if status is not None:
+                result[store_id] = (status, at)
+        return result
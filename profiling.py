@@ -0,0 +1,168 @@
+import contextlib
+import contextvars
+import resource
+import threading
+import time
+
+# stages of the profile being collected in this context, if any
+_current = contextvars.ContextVar("profile_stages", default=None)
+
+
+def _proc_status_bytes(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    """Current resident set size of this process, or None where unknown."""
+    return _proc_status_bytes("VmRSS")
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process since the last reset_peak_rss()."""
+    peak = _proc_status_bytes("VmHWM")
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux and cannot be reset
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def reset_peak_rss():
+    """Resets the peak RSS on Linux, so pool workers report per-report peaks."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def profile():
+    """Collects the stages run inside the block into the yielded list."""
+    stages = []
+    reset_peak_rss()
+    token = _current.set(stages)
+    try:
+        yield stages
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """
+    Records one pipeline stage of the profile being collected, if any.
+
+    Yields the stage's record; set record["rows_out"] inside the block. Wall
+    time, RSS and peak RSS are filled in when the block exits.
+    """
+    record = {"name": name, "rows_in": rows_in, "rows_out": None}
+    stages = _current.get()
+    if stages is None:
+        yield record
+        return
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 6)
+        record["rss_bytes"] = rss_bytes()
+        record["peak_rss_bytes"] = peak_rss_bytes()
+        stages.append(record)
+
+
+# Prometheus metrics, aggregated in the API process from the reports' profiles
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """A Prometheus histogram with one label."""
+
+    def __init__(self, name, help, label, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., sum, count]
+        self.series = {}
+
+    def observe(self, label_value, value):
+        series = self.series.setdefault(label_value, [0] * len(self.buckets) + [0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self.series.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+_lock = threading.Lock()
+stage_seconds = Histogram(
+    "report_stage_seconds", "Wall time of each report pipeline stage.", "stage"
+)
+report_seconds = Histogram(
+    "report_seconds", "Wall time of report jobs by final status.", "status"
+)
+_stage_rows = {}
+_stage_peak_rss = {}
+
+
+def observe_profile(profile_data):
+    """Adds a report's profile (as written by jobs) to the metrics."""
+    with _lock:
+        for record in profile_data["stages"]:
+            stage_seconds.observe(record["name"], record["seconds"])
+            if record["rows_out"] is not None:
+                _stage_rows[record["name"]] = (
+                    _stage_rows.get(record["name"], 0) + record["rows_out"]
+                )
+            if record["peak_rss_bytes"] is not None:
+                _stage_peak_rss[record["name"]] = record["peak_rss_bytes"]
+
+
+def observe_report(status, seconds):
+    with _lock:
+        report_seconds.observe(status, seconds)
+
+
+def render_metrics(counters):
+    """
+    The metrics in Prometheus text format.
+
+    `counters` maps extra counter names (without the _total suffix) to values.
+    """
+    with _lock:
+        lines = stage_seconds.render() + report_seconds.render()
+        lines += [
+            "# HELP report_stage_rows_out_total Rows produced by each report stage.",
+            "# TYPE report_stage_rows_out_total counter",
+        ]
+        for name, rows in sorted(_stage_rows.items()):
+            lines.append(f'report_stage_rows_out_total{{stage="{name}"}} {rows}')
+        lines += [
+            "# HELP report_stage_peak_rss_bytes Peak RSS of the last run of each stage.",
+            "# TYPE report_stage_peak_rss_bytes gauge",
+        ]
+        for name, peak in sorted(_stage_peak_rss.items()):
+            lines.append(f'report_stage_peak_rss_bytes{{stage="{name}"}} {peak}')
+    for name, value in counters.items():
+        lines.append(f"# TYPE {name}_total counter")
+        lines.append(f"{name}_total {value}")
+    return "\n".join(lines) + "\n"
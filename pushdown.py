@@ -0,0 +1,573 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    BigInteger,
+    Integer,
+    String,
+    and_,
+    case,
+    cast,
+    column,
+    exists,
+    func,
+    literal,
+    or_,
+    select,
+    type_coerce,
+    values,
+)
+
+import chunked
+import localtime
+import models
+import uptime
+import utils
+
+status_table = models.StoreStatus.__table__
+hours_table = models.BusinessHour.__table__
+stores_table = models.Store.__table__
+
+# the report's arithmetic is in microseconds, the precision of stored timestamps
+US = 1_000_000
+WEEK_US = uptime.WEEK_SECONDS * US
+# stores per IN (...) list
+IN_BATCH_SIZE = 10_000
+# polls searched for the current status in the report query; stores without
+# one in business hours are looked up further back by current_statuses
+RECENT = pd.Timedelta(days=1)
+
+
+def _epoch_us(dialect, column):
+    """Microseconds since the epoch of a UTC timestamp column."""
+    if dialect == "postgresql":
+        # date_part returns a double, much cheaper than extract()'s numeric;
+        # it still resolves microseconds at present-day epochs
+        return cast(func.round(func.date_part("epoch", column) * US), BigInteger)
+    # SQLite keeps timestamps as "YYYY-MM-DD HH:MM:SS.ffffff" text in UTC;
+    # strftime would round fractions of .9995 and up to the next second
+    text = type_coerce(column, String)
+    seconds = func.strftime("%s", func.substr(text, 1, 19))
+    fraction = func.substr(text + "000000", 21, 6)
+    return cast(seconds, BigInteger) * US + cast(fraction, BigInteger)
+
+
+def _seconds_of_day(dialect, column):
+    """Seconds since midnight of a time column."""
+    if dialect == "postgresql":
+        return cast(func.date_part("epoch", column), Integer)
+    # SQLite keeps times as "HH:MM:SS" text
+    return (
+        cast(func.substr(column, 1, 2), Integer) * 3600
+        + cast(func.substr(column, 4, 2), Integer) * 60
+        + cast(func.substr(column, 7, 2), Integer)
+    )
+
+
+def _business_hours(dialect):
+    """
+    Business hours as merged intervals of the local week, as a CTE.
+
+    Each test__business_hours row becomes a [start, end) range in µs of the
+    week from Monday 00:00 local time, as reference.build has
+    uptime.business_hours_intervals build them. Ranges past the end of the
+    week wrap to its start, and a store's overlapping ranges are merged,
+    so their time is counted once: (store_id, start_us, end_us).
+    """
+    day, week = uptime.DAY_SECONDS, uptime.WEEK_SECONDS
+    start_local = _seconds_of_day(dialect, hours_table.c.start_time_local)
+    end_local = _seconds_of_day(dialect, hours_table.c.end_time_local)
+    length = (end_local - start_local + day) % day
+    start = (hours_table.c.day * day + start_local) % week
+    # a shift ending at or before its start runs past midnight
+    shifts = select(
+        hours_table.c.store_id,
+        start.label("start"),
+        (start + case((length == 0, day), else_=length)).label("end"),
+    ).subquery("shifts")
+    ranges = (
+        select(
+            shifts.c.store_id,
+            shifts.c.start,
+            case((shifts.c.end > week, week), else_=shifts.c.end).label("end"),
+        )
+        .union_all(
+            select(
+                shifts.c.store_id,
+                literal(0, Integer).label("start"),
+                (shifts.c.end - week).label("end"),
+            ).where(shifts.c.end > week)
+        )
+        .subquery("ranges")
+    )
+
+    # gaps and islands: a range opens an interval unless an earlier range of
+    # the store reaches it
+    order = dict(
+        partition_by=ranges.c.store_id, order_by=(ranges.c.start, ranges.c.end)
+    )
+    reach = func.max(ranges.c.end).over(rows=(None, -1), **order)
+    opened = select(
+        ranges.c.store_id,
+        ranges.c.start,
+        ranges.c.end,
+        case((or_(reach.is_(None), ranges.c.start > reach), 1), else_=0).label("opens"),
+    ).subquery("opened")
+    numbered = select(
+        opened.c.store_id,
+        opened.c.start,
+        opened.c.end,
+        func.sum(opened.c.opens)
+        .over(
+            partition_by=opened.c.store_id,
+            order_by=(opened.c.start, opened.c.end),
+            rows=(None, 0),
+        )
+        .label("interval"),
+    ).subquery("numbered")
+    # materialized, so the intervals are computed once rather than per poll
+    return (
+        select(
+            numbered.c.store_id,
+            (cast(func.min(numbered.c.start), BigInteger) * US).label("start_us"),
+            (cast(func.max(numbered.c.end), BigInteger) * US).label("end_us"),
+        )
+        .group_by(numbered.c.store_id, numbered.c.interval)
+        .cte("business_hours")
+        .prefix_with("MATERIALIZED")
+    )
+
+
+def _transitions(zone_names, start_ns, end_ns):
+    """
+    The zones' UTC offsets over [start_ns, end_ns], as a VALUES CTE.
+
+    Rows are (timezone_str, start_us, end_us, offset_us, next_offset_us): the
+    offset in effect from start_us until end_us, when next_offset_us takes
+    over, from localtime's transition tables.
+    """
+    forever = -localtime.BEGINNING // 1000
+    rows = []
+    for timezone_str in zone_names:
+        instants, offsets = localtime.transitions(timezone_str, start_ns, end_ns)
+        starts = instants // 1000
+        ends = np.r_[starts[1:], forever]
+        following = np.r_[offsets[1:], offsets[-1:]] // 1000
+        keep = (ends > start_ns // 1000) & (starts <= end_ns // 1000)
+        rows.extend(
+            (timezone_str, int(start), int(end), int(offset), int(next_offset))
+            for start, end, offset, next_offset in zip(
+                starts[keep], ends[keep], offsets[keep] // 1000, following[keep]
+            )
+        )
+    return (
+        values(
+            column("timezone_str", String),
+            column("start_us", BigInteger),
+            column("end_us", BigInteger),
+            column("offset_us", BigInteger),
+            column("next_offset_us", BigInteger),
+            name="transitions",
+            literal_binds=True,
+        )
+        .data(rows)
+        .cte("transitions")
+    )
+
+
+def _in_hours(hours, store_id, local_us):
+    """Whether a wall-clock instant falls in one of the store's intervals."""
+    position = (local_us + uptime.EPOCH_WEEKDAY_SECONDS * US) % WEEK_US
+    return exists().where(
+        hours.c.store_id == store_id,
+        hours.c.start_us <= position,
+        position < hours.c.end_us,
+    )
+
+
+def _covered_before(hours, local_us):
+    """
+    One interval's business µs from a Monday 00:00 up to a wall-clock instant.
+
+    Summed over a store's intervals, the difference at two instants is the
+    business time between them, as uptime.business_hours_before counts it.
+    """
+    weeks, position = (
+        (local_us + uptime.EPOCH_WEEKDAY_SECONDS * US) // WEEK_US,
+        (local_us + uptime.EPOCH_WEEKDAY_SECONDS * US) % WEEK_US,
+    )
+    length = hours.c.end_us - hours.c.start_us
+    return weeks * length + case(
+        (position <= hours.c.start_us, 0),
+        (position >= hours.c.end_us, length),
+        else_=position - hours.c.start_us,
+    )
+
+
+def _timezone_str():
+    """A store's timezone, the default for stores without one in test__stores."""
+    return func.coalesce(stores_table.c.timezone_str, utils.DEFAULT_TIMEZONE).label(
+        "timezone_str"
+    )
+
+
+def _with_zones(polls, dialect):
+    """Polls as (store_id, status, timestamp_us, timezone_str)."""
+    return select(
+        polls.c.store_id,
+        polls.c.status,
+        _epoch_us(dialect, polls.c.timestamp_utc).label("timestamp_us"),
+        _timezone_str(),
+    ).outerjoin(stores_table, stores_table.c.store_id == polls.c.store_id)
+
+
+def uptime_downtime_query(dialect, now, zone_names):
+    """
+    The report of uptime.time_weighted_uptime_downtime as one SQL statement.
+
+    Reads each store's polls of the last week, plus its newest one before,
+    whose status runs into the week. Consecutive polls of the same status
+    are joined into runs, and LEAD() ends each run at the next one, the last
+    run at `now`. Runs are clipped to each window and converted to the
+    store's wall clock at their own UTC offset from the transitions CTE,
+    split at the DST transition a run contains, and their overlap with the
+    local-week business hours is summed. The current status is the one of
+    the store's newest poll of the last RECENT in business hours.
+
+    Returns (store_id, status, uptime/downtime of each window in µs) for
+    every store with business hours; status is None for stores without a
+    poll of the last RECENT in business hours, which current_statuses answers.
+    """
+    now_us = pd.Timestamp(now).value // 1000
+    week_us = max(length.value for length, _ in uptime.WINDOWS.values()) // 1000
+    week_start_us = now_us - week_us
+    week_start = pd.Timestamp(week_start_us * 1000, tz="UTC").to_pydatetime()
+    recent_start = (pd.Timestamp(now) - RECENT).to_pydatetime()
+    hours = _business_hours(dialect)
+    transitions = _transitions(
+        zone_names, (week_start_us - week_us) * 1000, now_us * 1000
+    )
+    windows = (
+        values(
+            column("window", String),
+            column("start_us", BigInteger),
+            name="windows",
+            literal_binds=True,
+        )
+        .data(
+            [
+                (window, now_us - length.value // 1000)
+                for window, (length, _) in uptime.WINDOWS.items()
+            ]
+        )
+        .cte("windows")
+    )
+
+    # a store's newest poll before the week, found through the primary key
+    stores = select(hours.c.store_id).distinct().subquery("stores")
+    before = status_table.alias("before")
+    entering = (
+        select(stores.c.store_id, status_table.c.status, status_table.c.timestamp_utc)
+        .join(status_table, status_table.c.store_id == stores.c.store_id)
+        .where(
+            status_table.c.timestamp_utc
+            == select(func.max(before.c.timestamp_utc))
+            .where(before.c.store_id == stores.c.store_id)
+            .where(before.c.timestamp_utc < week_start)
+            .scalar_subquery()
+        )
+    )
+    recent = select(
+        status_table.c.store_id, status_table.c.status, status_table.c.timestamp_utc
+    ).where(status_table.c.timestamp_utc >= week_start)
+    raw = entering.union_all(recent).subquery("raw")
+
+    # runs are found on the stored timestamps, which sort as the instants do;
+    # only their bounds are converted to µs and matched with a timezone
+    by_time = dict(partition_by=raw.c.store_id, order_by=raw.c.timestamp_utc)
+    changes = select(
+        raw.c.store_id,
+        raw.c.status,
+        raw.c.timestamp_utc,
+        func.lag(raw.c.status).over(**by_time).label("previous"),
+    ).subquery("changes")
+    bounds = (
+        select(
+            changes.c.store_id,
+            changes.c.status,
+            changes.c.timestamp_utc,
+            changes.c.previous,
+            func.lead(changes.c.timestamp_utc)
+            .over(partition_by=changes.c.store_id, order_by=changes.c.timestamp_utc)
+            .label("ended_utc"),
+        )
+        .where(
+            or_(changes.c.previous.is_(None), changes.c.previous != changes.c.status)
+        )
+        .subquery("bounds")
+    )
+    runs = (
+        select(
+            bounds.c.store_id,
+            bounds.c.status,
+            _timezone_str(),
+            # a store's first status also covers the time before its first poll
+            case(
+                (bounds.c.previous.is_(None), week_start_us),
+                else_=_epoch_us(dialect, bounds.c.timestamp_utc),
+            ).label("start_us"),
+            func.coalesce(_epoch_us(dialect, bounds.c.ended_utc), now_us).label(
+                "end_us"
+            ),
+        )
+        .outerjoin(stores_table, stores_table.c.store_id == bounds.c.store_id)
+        .cte("runs")
+        .prefix_with("MATERIALIZED")
+    )
+
+    start_us = case(
+        (runs.c.start_us > windows.c.start_us, runs.c.start_us),
+        else_=windows.c.start_us,
+    )
+    clipped = (
+        select(
+            runs.c.store_id,
+            windows.c.window,
+            runs.c.status,
+            runs.c.timezone_str,
+            start_us.label("start_us"),
+            runs.c.end_us,
+        )
+        .join(windows, runs.c.end_us > windows.c.start_us)
+        .subquery("clipped")
+    )
+    # a run is measured at its start's offset up to the transition it
+    # contains, if any, and at the following offset after it
+    transition = case(
+        (clipped.c.end_us > transitions.c.end_us, transitions.c.end_us),
+        else_=clipped.c.end_us,
+    )
+    after = case(
+        (clipped.c.end_us > transitions.c.end_us, clipped.c.end_us),
+        else_=transitions.c.end_us,
+    )
+    points = (
+        select(
+            clipped.c.store_id,
+            clipped.c.window,
+            clipped.c.status,
+            (clipped.c.start_us + transitions.c.offset_us).label("start_local"),
+            (transition + transitions.c.offset_us).label("transition_local"),
+            (transitions.c.end_us + transitions.c.next_offset_us).label(
+                "resumed_local"
+            ),
+            (after + transitions.c.next_offset_us).label("end_local"),
+        )
+        .join(
+            transitions,
+            and_(
+                transitions.c.timezone_str == clipped.c.timezone_str,
+                transitions.c.start_us <= clipped.c.start_us,
+                clipped.c.start_us < transitions.c.end_us,
+            ),
+        )
+        .subquery("points")
+    )
+    covered = (
+        _covered_before(hours, points.c.transition_local)
+        - _covered_before(hours, points.c.start_local)
+        + _covered_before(hours, points.c.end_local)
+        - _covered_before(hours, points.c.resumed_local)
+    )
+    sums = []
+    for window in uptime.WINDOWS:
+        for name, is_active in (("uptime", True), ("downtime", False)):
+            matches = and_(
+                points.c.window == window,
+                (
+                    (points.c.status == "active")
+                    if is_active
+                    else (points.c.status != "active")
+                ),
+            )
+            sums.append(
+                func.sum(case((matches, covered), else_=0)).label(f"{name}_{window}")
+            )
+    totals = (
+        select(points.c.store_id, *sums)
+        .join(hours, hours.c.store_id == points.c.store_id)
+        .group_by(points.c.store_id)
+        .subquery("totals")
+    )
+
+    # the status of each store's newest poll of the last day in business
+    # hours; current_statuses looks further back for the others
+    polls = _with_zones(
+        select(
+            status_table.c.store_id,
+            status_table.c.status,
+            status_table.c.timestamp_utc,
+        )
+        .where(status_table.c.timestamp_utc >= recent_start)
+        .subquery("recent"),
+        dialect,
+    ).cte("polls")
+    # materialized, so each poll is converted once rather than per use
+    polls = polls.prefix_with("MATERIALIZED")
+    newest = (
+        select(
+            polls.c.store_id,
+            polls.c.status,
+            func.row_number()
+            .over(partition_by=polls.c.store_id, order_by=polls.c.timestamp_us.desc())
+            .label("position"),
+        )
+        .join(
+            transitions,
+            and_(
+                transitions.c.timezone_str == polls.c.timezone_str,
+                transitions.c.start_us <= polls.c.timestamp_us,
+                polls.c.timestamp_us < transitions.c.end_us,
+            ),
+        )
+        .where(
+            _in_hours(
+                hours, polls.c.store_id, polls.c.timestamp_us + transitions.c.offset_us
+            )
+        )
+        .subquery("newest")
+    )
+    current = (
+        select(newest.c.store_id, newest.c.status)
+        .where(newest.c.position == 1)
+        .subquery("current")
+    )
+    return (
+        select(
+            totals.c.store_id,
+            current.c.status,
+            *(totals.c[column] for column in uptime.METRIC_COLUMNS),
+        )
+        .outerjoin(current, current.c.store_id == totals.c.store_id)
+        .where(or_(current.c.status.is_(None), current.c.status == "active"))
+        .order_by(totals.c.store_id)
+    )
+
+
+def current_statuses(connection, store_ids, before, now, zone_names):
+    """
+    {store_id: status} of the given stores' newest polls in business hours
+    before `before`, for the stores whose recent polls are all outside
+    business hours. Reads their older polls through the primary key.
+    """
+    dialect = connection.dialect.name
+    hours = _business_hours(dialect)
+    before = pd.Timestamp(before).to_pydatetime()
+    statuses = {}
+    for first in range(0, len(store_ids), IN_BATCH_SIZE):
+        batch = store_ids[first : first + IN_BATCH_SIZE]
+        oldest = connection.execute(
+            select(func.min(status_table.c.timestamp_utc)).where(
+                status_table.c.store_id.in_(batch)
+            )
+        ).scalar()
+        if oldest is None:
+            continue
+        transitions = _transitions(
+            zone_names, pd.Timestamp(oldest).value, pd.Timestamp(now).value
+        )
+        older = (
+            select(
+                status_table.c.store_id,
+                status_table.c.status,
+                status_table.c.timestamp_utc,
+            )
+            .where(status_table.c.store_id.in_(batch))
+            .where(status_table.c.timestamp_utc < before)
+            .subquery("older")
+        )
+        polls = _with_zones(older, dialect).subquery("polls")
+        newest = (
+            select(
+                polls.c.store_id,
+                polls.c.status,
+                func.row_number()
+                .over(
+                    partition_by=polls.c.store_id,
+                    order_by=polls.c.timestamp_us.desc(),
+                )
+                .label("position"),
+            )
+            .join(
+                transitions,
+                and_(
+                    transitions.c.timezone_str == polls.c.timezone_str,
+                    transitions.c.start_us <= polls.c.timestamp_us,
+                    polls.c.timestamp_us < transitions.c.end_us,
+                ),
+            )
+            .where(
+                _in_hours(
+                    hours,
+                    polls.c.store_id,
+                    polls.c.timestamp_us + transitions.c.offset_us,
+                )
+            )
+            .subquery("newest")
+        )
+        statuses.update(
+            connection.execute(
+                select(newest.c.store_id, newest.c.status).where(newest.c.position == 1)
+            ).all()
+        )
+    return statuses
+
+
+def compute_uptime_downtime(connection, now=None) -> pd.DataFrame:
+    """
+    The report of uptime.time_weighted_uptime_downtime, computed in the database.
+
+    Reads test__store_status, test__business_hours and test__stores where
+    they are stored and ships back one row per store, in store_id order. The
+    report is computed at `now`, the newest stored observation by default.
+    """
+    columns = ["store_id"] + uptime.METRIC_COLUMNS
+    if now is None:
+        now = chunked.newest_observation(connection)
+    if now is None:
+        return pd.DataFrame(columns=columns)
+    zone_names = sorted(
+        set(
+            connection.execute(select(stores_table.c.timezone_str).distinct())
+            .scalars()
+            .all()
+        )
+        - {None}
+        | {utils.DEFAULT_TIMEZONE}
+    )
+    rows = connection.execute(
+        uptime_downtime_query(connection.dialect.name, now, zone_names)
+    ).all()
+    report = pd.DataFrame(rows, columns=["store_id", "status"] + uptime.METRIC_COLUMNS)
+
+    unknown = report["status"].isna()
+    if unknown.any():
+        statuses = current_statuses(
+            connection,
+            report.loc[unknown, "store_id"].astype(int).tolist(),
+            pd.Timestamp(now) - RECENT,
+            now,
+            zone_names,
+        )
+        report.loc[unknown, "status"] = report.loc[unknown, "store_id"].map(statuses)
+    report = report[report["status"] == "active"].reset_index(drop=True)
+
+    report["store_id"] = report["store_id"].astype(np.int64)
+    for column, (_, unit) in (
+        (f"{name}_{window}", uptime.WINDOWS[window])
+        for window in uptime.WINDOWS
+        for name in ("uptime", "downtime")
+    ):
+        # PostgreSQL sums BIGINTs as NUMERIC
+        totals_ns = report[column].map(int).to_numpy(dtype=np.int64) * 1000
+        report[column] = (totals_ns / unit.value).round(2)
+    return report[columns]
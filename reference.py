@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import localtime
+import snapshot
+import uptime
+import utils
+
+REFERENCE_DIR = os.path.join(utils.CACHE_DIR, "reference")
+
+# reference data mapped by this process, by directory
+_loaded = {}
+
+
+class ReferenceData:
+    """
+    Read-only lookups every report and request needs: the stores' business
+    hours and their timezones.
+
+    Business hours are kept as intervals of the local week, as
+    uptime.business_hours_intervals builds them with no UTC offset, and
+    observations are checked against them at their own local time, so the
+    hours stay right across DST changes. The arrays are memory-mapped from
+    files written once by build(), so every worker process maps the same
+    pages instead of parsing and converting the CSV files again.
+    """
+
+    def __init__(self, arrays, timezone_names):
+        self.intervals = (
+            pd.Index(arrays["hours_store_ids"]),
+            arrays["starts"],
+            arrays["ends"],
+        )
+        self.timezone_store_ids = arrays["timezone_store_ids"]
+        self.timezone_codes = arrays["timezone_codes"]
+        # the last name is the zone of stores without a timezone
+        self.timezone_names = list(timezone_names) + [utils.DEFAULT_TIMEZONE]
+
+    def zone_codes(self, store_ids) -> np.ndarray:
+        """Positions of the stores' timezones in timezone_names."""
+        store_ids = np.asarray(store_ids, dtype=np.int64)
+        codes = np.full(len(store_ids), len(self.timezone_names) - 1, dtype=np.int32)
+        if len(self.timezone_store_ids) == 0:
+            return codes
+        position = np.searchsorted(self.timezone_store_ids, store_ids)
+        position = np.minimum(position, len(self.timezone_store_ids) - 1)
+        known = self.timezone_store_ids[position] == store_ids
+        codes[known] = self.timezone_codes[position[known]]
+        return codes
+
+    def zones(self, store_ids):
+        """The stores' zone codes and the zone names, as localtime takes them."""
+        return self.zone_codes(store_ids), self.timezone_names
+
+    def timezone_of(self, store_ids) -> np.ndarray:
+        """Timezone names of stores, DEFAULT_TIMEZONE for stores without one."""
+        names = np.asarray(self.timezone_names, dtype=object)
+        return names[self.zone_codes(store_ids)]
+
+    def to_local(self, store_ids, timestamps_ns) -> np.ndarray:
+        """Wall-clock times of UTC instants in their stores' timezones."""
+        codes, stores = pd.factorize(np.asarray(store_ids, dtype=np.int64))
+        zone_codes = self.zone_codes(stores)[codes]
+        return localtime.to_local(timestamps_ns, zone_codes, self.timezone_names)
+
+    def in_business_hours(self, store_ids, timestamps_ns) -> np.ndarray:
+        """Tags UTC instants as inside their stores' business hours, DST-aware."""
+        return uptime.in_business_hours(
+            self.intervals, store_ids, self.to_local(store_ids, timestamps_ns)
+        )
+
+
+def _directory(menu_hours_path, timezones_path, reference_dir):
+    key = snapshot.checksum(menu_hours_path)[:8] + snapshot.checksum(timezones_path)[:8]
+    return os.path.join(reference_dir, f"{key}-v2")
+
+
+def build(
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+    reference_dir=REFERENCE_DIR,
+):
+    """
+    Writes the reference data of the given files as .npy files.
+
+    Like the snapshots, each version lives in its own directory, named after
+    the files' checksums, and is moved into place in one rename.
+    Returns the directory.
+    """
+    directory = _directory(menu_hours_path, timezones_path, reference_dir)
+    if os.path.isdir(directory):
+        return directory
+
+    business_hours_df = snapshot.load_business_hours(menu_hours_path)
+    stores, starts, ends = uptime.business_hours_intervals(
+        business_hours_df.assign(utc_offset_seconds=0)
+    )
+    timezone_df = snapshot.load_timezones(timezones_path)
+    timezone_df = timezone_df.drop_duplicates("store_id").sort_values("store_id")
+    codes, names = pd.factorize(timezone_df["timezone_str"].astype(str))
+    arrays = {
+        "hours_store_ids": stores.to_numpy(dtype=np.int64),
+        "starts": starts,
+        "ends": ends,
+        "timezone_store_ids": timezone_df["store_id"].to_numpy(dtype=np.int64),
+        "timezone_codes": codes.astype(np.int32),
+    }
+
+    tmp_directory = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(tmp_directory, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_directory, f"{name}.npy"), values)
+    with open(os.path.join(tmp_directory, "manifest.json"), "w") as f:
+        json.dump({"arrays": list(arrays), "timezone_names": list(names)}, f)
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # another process built the same version first
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    return directory
+
+
+def load(
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+    reference_dir=REFERENCE_DIR,
+) -> ReferenceData:
+    """
+    Returns the reference data of the given files, building it if needed.
+
+    Each version is mapped once per process; pool workers forked afterwards
+    inherit the mapping.
+    """
+    directory = _directory(menu_hours_path, timezones_path, reference_dir)
+    if directory not in _loaded:
+        if not os.path.isdir(directory):
+            build(menu_hours_path, timezones_path, reference_dir)
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in manifest["arrays"]
+        }
+        _loaded[directory] = ReferenceData(arrays, manifest["timezone_names"])
+    return _loaded[directory]
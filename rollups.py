@@ -0,0 +1,711 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+import reference
+import uptime
+
+# rollup bucket width
+BUCKET = pd.Timedelta(hours=1)
+# stores per IN (...) list
+IN_BATCH_SIZE = 10_000
+
+COLUMNS = ["store_id", "status", "timestamp_utc"]
+
+buckets = models.StatusRollup.__table__
+latest = models.StoreLatestStatus.__table__
+status_table = models.StoreStatus.__table__
+
+
+def _epoch_ns(values) -> np.ndarray:
+    """Datetimes from the database (naive ones are UTC) as epoch-ns."""
+    return uptime.epoch_ns(pd.to_datetime(pd.Series(values, dtype=object), utc=True))
+
+
+def _as_datetimes(timestamps_ns):
+    return pd.to_datetime(np.asarray(timestamps_ns, dtype=np.int64), utc=True)
+
+
+def _business_time(reference_data, store_ids, starts_ns, ends_ns) -> np.ndarray:
+    """Business-hours ns of each store within [start, end), on its wall clock."""
+    codes = reference_data.intervals[0].get_indexer(store_ids)
+    return uptime.business_hours_between(
+        reference_data.intervals,
+        codes,
+        starts_ns,
+        ends_ns,
+        reference_data.zones(store_ids),
+    )
+
+
+def whole_stores(partitions):
+    """
+    Regroups row batches ordered by (store_id, timestamp_utc) into frames
+    that each hold all the rows of their stores, as apply needs them.
+    """
+    carried = None
+    for rows in partitions:
+        frame = pd.DataFrame(rows, columns=COLUMNS)
+        if carried is not None:
+            frame = pd.concat([carried, frame], ignore_index=True)
+        if frame.empty:
+            continue
+        store_ids = frame["store_id"].to_numpy()
+        boundary = int(np.searchsorted(store_ids, store_ids[-1]))
+        carried = frame.iloc[boundary:].reset_index(drop=True)
+        if boundary:
+            yield frame.iloc[:boundary]
+    if carried is not None:
+        yield carried
+
+
+def summarize(store_ids, starts_ns, ends_ns, is_active, reference_data, sign=1):
+    """
+    Folds closed status segments into rollup bucket rows.
+
+    Each segment [start, end) holds a poll's status until the store's next
+    poll. It is split at bucket boundaries and each piece's overlap with the
+    store's business hours, on its wall clock at that instant, is added to
+    the bucket's active_ns or inactive_ns (subtracted with sign=-1). A bucket
+    gets a row for every piece, even one outside business hours, and added
+    pieces covering a bucket's start record the status in effect then.
+    """
+    first = starts_ns // BUCKET.value
+    counts = (ends_ns - 1) // BUCKET.value - first + 1
+    segment = np.repeat(np.arange(len(starts_ns)), counts)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+    bucket_start = (first[segment] + step) * BUCKET.value
+    piece_start = np.maximum(starts_ns[segment], bucket_start)
+    piece_end = np.minimum(ends_ns[segment], bucket_start + BUCKET.value)
+    piece_stores = store_ids[segment]
+    active = is_active[segment]
+    covered = sign * _business_time(
+        reference_data, piece_stores, piece_start, piece_end
+    )
+    # 0 when the piece does not cover the bucket start, else 1 + is_active
+    entering = np.where(
+        (sign > 0) & (starts_ns[segment] <= bucket_start), 1 + active, 0
+    )
+    return (
+        pd.DataFrame(
+            {
+                "store_id": piece_stores,
+                "bucket_start_utc": bucket_start,
+                "active_ns": np.where(active, covered, 0),
+                "inactive_ns": np.where(active, 0, covered),
+                "entering": entering,
+            }
+        )
+        .groupby(["store_id", "bucket_start_utc"], as_index=False)
+        .agg(
+            active_ns=("active_ns", "sum"),
+            inactive_ns=("inactive_ns", "sum"),
+            entering=("entering", "max"),
+        )
+    )
+
+
+def _records(df):
+    """Rows of a frame as dicts of Python values, with None for missing ones."""
+    columns = {
+        column: df[column].astype(object).where(df[column].notna(), None).tolist()
+        for column in df.columns
+    }
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def _upsert(connection):
+    return (
+        postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    )
+
+
+def _upsert_rows(connection, statement, records):
+    """
+    Runs an upsert for many rows. SQLAlchemy only batches an ON CONFLICT
+    statement into multi-row VALUES when it returns rows, so on PostgreSQL
+    it returns the keys; psycopg2 would otherwise send it once per row.
+    """
+    if connection.dialect.name == "postgresql":
+        statement = statement.returning(*statement.table.primary_key)
+    connection.execute(statement, records)
+
+
+def _stored_polls(connection, store_ids, earliest_ns):
+    """
+    The stored polls a batch of new ones can change the segments of.
+
+    For stores whose new polls all follow the stored ones, that is the newest
+    stored poll, read from the latest-status table. For the others, every
+    stored poll from the last one before their earliest new poll onwards.
+    """
+    frames = []
+    for first in range(0, len(store_ids), IN_BATCH_SIZE):
+        batch = store_ids[first : first + IN_BATCH_SIZE]
+        rows = connection.execute(
+            select(latest.c.store_id, latest.c.last_status, latest.c.last_seen_utc)
+            .where(latest.c.store_id.in_([int(store_id) for store_id in batch]))
+            .where(latest.c.last_seen_utc.is_not(None))
+        ).all()
+        frames.append(pd.DataFrame(rows, columns=COLUMNS))
+    stored = pd.concat(frames, ignore_index=True)
+    if stored.empty:
+        return stored
+    stored["timestamp_utc"] = _epoch_ns(stored["timestamp_utc"])
+    earliest = pd.Series(earliest_ns, index=store_ids)
+    is_late = (
+        stored["timestamp_utc"].to_numpy() > earliest[stored["store_id"]].to_numpy()
+    )
+    late = stored["store_id"][is_late].to_numpy()
+
+    frames = [stored[~is_late]]
+    for first in range(0, len(late), IN_BATCH_SIZE):
+        batch = late[first : first + IN_BATCH_SIZE]
+        since = _as_datetimes([earliest[batch].min()])[0].to_pydatetime()
+        # from each store's last poll before the batch's earliest new one,
+        # found through the primary key
+        previous = (
+            select(func.max(status_table.c.timestamp_utc))
+            .where(status_table.c.store_id == latest.c.store_id)
+            .where(status_table.c.timestamp_utc < since)
+            .scalar_subquery()
+        )
+        bounds = (
+            select(
+                latest.c.store_id,
+                func.coalesce(previous, since).label("since_utc"),
+            )
+            .where(latest.c.store_id.in_([int(store_id) for store_id in batch]))
+            .subquery("bounds")
+        )
+        rows = connection.execute(
+            select(
+                status_table.c.store_id,
+                status_table.c.status,
+                status_table.c.timestamp_utc,
+            )
+            .join(
+                bounds,
+                and_(
+                    status_table.c.store_id == bounds.c.store_id,
+                    status_table.c.timestamp_utc >= bounds.c.since_utc,
+                ),
+            )
+            .order_by(status_table.c.store_id, status_table.c.timestamp_utc)
+        ).all()
+        polls = pd.DataFrame(rows, columns=COLUMNS)
+        polls["timestamp_utc"] = _epoch_ns(polls["timestamp_utc"])
+        # of a store's polls before its own earliest new one, only the last
+        # is kept: the one whose segment the new polls split
+        store_ids = polls["store_id"].to_numpy()
+        before = polls["timestamp_utc"].to_numpy() < earliest[store_ids].to_numpy()
+        superseded = before[:-1] & before[1:] & (store_ids[:-1] == store_ids[1:])
+        frames.append(polls[~np.r_[superseded, False]])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _segments(polls):
+    """
+    The closed segments of polls sorted by (store_id, timestamp_utc): each
+    poll's status up to the store's next poll.
+    Returns (store_ids, starts_ns, ends_ns, is_active).
+    """
+    store_ids = polls["store_id"].to_numpy(dtype=np.int64)
+    timestamps_ns = polls["timestamp_utc"].to_numpy(dtype=np.int64)
+    is_active = (polls["status"] == "active").to_numpy()
+    closed = np.flatnonzero(store_ids[1:] == store_ids[:-1])
+    return (
+        store_ids[closed],
+        timestamps_ns[closed],
+        timestamps_ns[closed + 1],
+        is_active[closed],
+    )
+
+
+def _latest_rows(df, reference_data):
+    """One latest-status row per store of sorted new polls."""
+    timestamps_ns = df["timestamp_utc"].to_numpy(dtype=np.int64)
+    polls = pd.DataFrame(
+        {
+            "store_id": df["store_id"].to_numpy(dtype=np.int64),
+            "timestamp_utc": _as_datetimes(timestamps_ns),
+            "status": df["status"].to_numpy(),
+        }
+    )
+    by_store = polls.groupby("store_id")
+    latest_df = pd.DataFrame(
+        {
+            "first_seen_utc": by_store["timestamp_utc"].first(),
+            "first_status": by_store["status"].first(),
+            "last_seen_utc": by_store["timestamp_utc"].last(),
+            "last_status": by_store["status"].last(),
+        }
+    )
+    inside = reference_data.in_business_hours(polls["store_id"], timestamps_ns)
+    in_hours = polls[inside].groupby("store_id").last()
+    latest_df["status"] = in_hours["status"]
+    latest_df["status_utc"] = in_hours["timestamp_utc"]
+    return latest_df.reset_index()
+
+
+def _later(column, excluded):
+    return or_(column.is_(None), excluded > column)
+
+
+def _earlier(column, excluded):
+    return or_(column.is_(None), excluded < column)
+
+
+def apply(
+    connection,
+    df: pd.DataFrame,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Adds newly ingested observations to the rollups, in the caller's transaction.
+
+    `df` must hold all the new observations of its stores (whole_stores
+    groups them so), applied before they are stored. The segments between
+    the new polls and the stored ones around them replace those the stored
+    polls had: a store's polls that arrive late, between stored ones, first
+    subtract the segment they split. Segments still open, a store's first
+    status before its first poll and its last one up to now, are kept as
+    the store's first and last poll in the latest-status table.
+    """
+    if len(df) == 0:
+        return
+    reference_data = reference.load(menu_hours_path, timezones_path)
+    df = pd.DataFrame(
+        {
+            "store_id": df["store_id"].to_numpy(dtype=np.int64),
+            "status": df["status"].to_numpy(),
+            "timestamp_utc": uptime.epoch_ns(
+                pd.to_datetime(df["timestamp_utc"], utc=True)
+            ),
+        }
+    ).sort_values(["store_id", "timestamp_utc"], ignore_index=True)
+    store_ids, first_rows = np.unique(df["store_id"].to_numpy(), return_index=True)
+    stored = _stored_polls(
+        connection, store_ids, df["timestamp_utc"].to_numpy()[first_rows]
+    )
+    merged = pd.concat([stored, df], ignore_index=True).sort_values(
+        ["store_id", "timestamp_utc"], ignore_index=True
+    )
+    bucket_df = pd.concat(
+        [
+            summarize(*_segments(merged), reference_data),
+            summarize(*_segments(stored), reference_data, sign=-1),
+        ]
+    )
+    bucket_df = bucket_df.groupby(["store_id", "bucket_start_utc"], as_index=False).agg(
+        active_ns=("active_ns", "sum"),
+        inactive_ns=("inactive_ns", "sum"),
+        entering=("entering", "max"),
+    )
+    bucket_df["entering_status"] = np.array([None, "inactive", "active"], dtype=object)[
+        bucket_df.pop("entering").to_numpy()
+    ]
+    bucket_df["bucket_start_utc"] = _as_datetimes(bucket_df["bucket_start_utc"])
+    insert = _upsert(connection)
+
+    if len(bucket_df):
+        statement = insert(buckets)
+        excluded = statement.excluded
+        _upsert_rows(
+            connection,
+            statement.on_conflict_do_update(
+                index_elements=[buckets.c.store_id, buckets.c.bucket_start_utc],
+                set_={
+                    "active_ns": buckets.c.active_ns + excluded.active_ns,
+                    "inactive_ns": buckets.c.inactive_ns + excluded.inactive_ns,
+                    "entering_status": func.coalesce(
+                        excluded.entering_status, buckets.c.entering_status
+                    ),
+                },
+            ),
+            _records(bucket_df),
+        )
+
+    statement = insert(latest)
+    excluded = statement.excluded
+    earlier = _earlier(latest.c.first_seen_utc, excluded.first_seen_utc)
+    later = _later(latest.c.last_seen_utc, excluded.last_seen_utc)
+    newer_status = _later(latest.c.status_utc, excluded.status_utc)
+    _upsert_rows(
+        connection,
+        statement.on_conflict_do_update(
+            index_elements=[latest.c.store_id],
+            set_={
+                name: case((condition, excluded[name]), else_=latest.c[name])
+                for names, condition in (
+                    (("first_seen_utc", "first_status"), earlier),
+                    (("last_seen_utc", "last_status"), later),
+                    (("status", "status_utc"), newer_status),
+                )
+                for name in names
+            },
+        ),
+        _records(_latest_rows(df, reference_data)),
+    )
+
+
+def rebuild(
+    engine,
+    chunk_rows=500_000,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Recomputes the rollups from every stored observation.
+
+    Needed once for observations ingested before the rollups existed.
+    The status table is streamed in key order (through a server-side cursor
+    on PostgreSQL) and applied a store's whole history at a time, so memory
+    depends on the chunk size and the longest history rather than the
+    table's size.
+    """
+    models.Base.metadata.create_all(engine, tables=[buckets, latest])
+    rows = 0
+    with engine.begin() as connection:
+        connection.execute(buckets.delete())
+        connection.execute(latest.delete())
+        result = connection.execute(
+            select(
+                status_table.c.store_id,
+                status_table.c.status,
+                status_table.c.timestamp_utc,
+            ).order_by(status_table.c.store_id, status_table.c.timestamp_utc),
+            execution_options={"stream_results": True},
+        )
+        for frame in whole_stores(result.partitions(chunk_rows)):
+            apply(connection, frame, menu_hours_path, timezones_path)
+            rows += len(frame)
+        stores = connection.execute(select(func.count()).select_from(latest)).scalar()
+    print(f"Rebuilt rollups for {stores} stores from {rows} observations")
+
+
+def newest_observation(connection):
+    """The newest observation's timestamp, which the report is computed at."""
+    last_seen = connection.execute(select(func.max(latest.c.last_seen_utc))).scalar()
+    if last_seen is None:
+        return None
+    return pd.Timestamp(_epoch_ns([last_seen])[0], tz="UTC")
+
+
+def _in_stores(query, column, store_ids):
+    return query if store_ids is None else query.where(column.in_(store_ids))
+
+
+def _store_rows(connection, store_ids):
+    """Latest-status rows of the given stores, or of every currently active one."""
+    query = select(
+        latest.c.store_id,
+        latest.c.status,
+        latest.c.first_seen_utc,
+        latest.c.first_status,
+        latest.c.last_seen_utc,
+        latest.c.last_status,
+    ).order_by(latest.c.store_id)
+    if store_ids is None:
+        query = query.where(latest.c.status == "active")
+    rows = connection.execute(_in_stores(query, latest.c.store_id, store_ids)).all()
+    stores = pd.DataFrame(
+        rows,
+        columns=[
+            "store_id",
+            "status",
+            "first_seen",
+            "first_status",
+            "last_seen",
+            "last_status",
+        ],
+    )
+    stores["store_id"] = stores["store_id"].astype(np.int64)
+    for column in ("first_seen", "last_seen"):
+        stores[column] = _epoch_ns(stores[column])
+    return stores
+
+
+def _bucket_sums(connection, bucket_starts, now_ns, store_ids):
+    """Summed active_ns and inactive_ns per store, from each window's first bucket."""
+    sums = []
+    for window, bucket_start in bucket_starts.items():
+        in_window = buckets.c.bucket_start_utc >= bucket_start
+        for name in ("active_ns", "inactive_ns"):
+            sums.append(
+                func.sum(case((in_window, buckets.c[name]), else_=0)).label(
+                    f"{name}_{window}"
+                )
+            )
+    query = (
+        select(buckets.c.store_id, *sums)
+        .where(buckets.c.bucket_start_utc >= min(bucket_starts.values()))
+        .where(buckets.c.bucket_start_utc <= _as_datetimes([now_ns])[0])
+        .group_by(buckets.c.store_id)
+    )
+    rows = connection.execute(_in_stores(query, buckets.c.store_id, store_ids)).all()
+    # PostgreSQL sums BIGINTs as NUMERIC
+    return pd.DataFrame(
+        [[int(value) for value in row] for row in rows],
+        columns=["store_id"] + [sum_.name for sum_ in sums],
+    ).set_index("store_id")
+
+
+def _closed_before(
+    connection, reference_data, stores, store_ids, bucket_starts, window_starts
+):
+    """
+    Per window and store, the business time of closed segments in
+    [bucket_start, window_start), which the bucket sums include ahead of a
+    window starting mid-bucket.
+
+    Built from the status in effect at each bucket start, kept with the
+    bucket, and the polls in [bucket_start, window_start), read for all
+    windows at once. A store's newest poll there opens a closed segment
+    only when a later poll exists.
+    Returns (active_ns, inactive_ns) arrays of shape (windows, stores).
+    """
+    windows = list(bucket_starts)
+    bounds = [
+        (_as_datetimes([bucket_starts[window]])[0], _as_datetimes([start])[0])
+        for window, start in window_starts.items()
+    ]
+    entering = connection.execute(
+        _in_stores(
+            select(
+                buckets.c.store_id,
+                buckets.c.entering_status,
+                buckets.c.bucket_start_utc,
+            )
+            .where(buckets.c.bucket_start_utc.in_([start for start, _ in bounds]))
+            .where(buckets.c.entering_status.is_not(None)),
+            buckets.c.store_id,
+            store_ids,
+        )
+    ).all()
+    polls = connection.execute(
+        _in_stores(
+            select(
+                status_table.c.store_id,
+                status_table.c.status,
+                status_table.c.timestamp_utc,
+            ).where(
+                or_(
+                    *(
+                        (status_table.c.timestamp_utc >= start)
+                        & (status_table.c.timestamp_utc < end)
+                        for start, end in bounds
+                    )
+                )
+            ),
+            status_table.c.store_id,
+            store_ids,
+        )
+    ).all()
+    polls = pd.concat(
+        [pd.DataFrame(entering, columns=COLUMNS), pd.DataFrame(polls, columns=COLUMNS)],
+        ignore_index=True,
+    )
+    polls = pd.DataFrame(
+        {
+            "store_id": polls["store_id"].to_numpy(dtype=np.int64),
+            "status": polls["status"].to_numpy(),
+            "timestamp_utc": _epoch_ns(polls["timestamp_utc"]),
+        }
+    )
+    polls = polls[polls["store_id"].isin(stores["store_id"])].sort_values(
+        ["store_id", "timestamp_utc"], ignore_index=True
+    )
+    all_stores = polls["store_id"].to_numpy(dtype=np.int64)
+    all_starts = polls["timestamp_utc"].to_numpy(dtype=np.int64)
+    all_active = (polls["status"] == "active").to_numpy()
+    last_seen = stores.set_index("store_id")["last_seen"].reindex(all_stores).to_numpy()
+
+    # each window's closed segments, measured together
+    parts = []
+    for position, window in enumerate(windows):
+        start_ns = window_starts[window]
+        rows = np.flatnonzero(
+            (all_starts >= bucket_starts[window]) & (all_starts < start_ns)
+        )
+        poll_stores, starts = all_stores[rows], all_starts[rows]
+        same_next = np.r_[poll_stores[1:] == poll_stores[:-1], False]
+        ends = np.where(same_next, np.r_[starts[1:], 0], start_ns)
+        closed = same_next | (last_seen[rows] >= start_ns)
+        parts.append((np.full(closed.sum(), position), rows[closed], ends[closed]))
+    window_of, rows, ends = (np.concatenate(values) for values in zip(*parts))
+    covered = _business_time(reference_data, all_stores[rows], all_starts[rows], ends)
+    flat = window_of * len(stores) + pd.Index(stores["store_id"]).get_indexer(
+        all_stores[rows]
+    )
+    size = len(windows) * len(stores)
+    active = np.bincount(
+        flat, weights=np.where(all_active[rows], covered, 0), minlength=size
+    )
+    inactive = np.bincount(
+        flat, weights=np.where(all_active[rows], 0, covered), minlength=size
+    )
+    shape = (len(windows), len(stores))
+    return (
+        active.astype(np.int64).reshape(shape),
+        inactive.astype(np.int64).reshape(shape),
+    )
+
+
+def _window_totals(connection, store_ids=None, now=None, reference_data=None):
+    """
+    The time-weighted report metrics of the given stores, or of every
+    currently active one, with each store's current status.
+
+    The bucket sums of each window are trimmed to the window's start, and
+    the open segments, kept as each store's first and last poll, are added:
+    the result equals uptime.time_weighted_uptime_downtime over the stored
+    observations. Only the buckets of the last week, the latest-status rows
+    and the polls of the hour before each window's start are read.
+    """
+    if now is None:
+        now = newest_observation(connection)
+    stores = _store_rows(connection, store_ids)
+    if now is None or stores.empty:
+        return stores[["store_id", "status"]].assign(
+            **{column: [] for column in uptime.METRIC_COLUMNS}
+        )
+    if reference_data is None:
+        reference_data = reference.load()
+    now_ns = pd.Timestamp(now).value
+    windows = list(uptime.WINDOWS)
+    window_starts = {
+        window: now_ns - length.value for window, (length, _) in uptime.WINDOWS.items()
+    }
+    bucket_starts = {
+        window: start - start % BUCKET.value for window, start in window_starts.items()
+    }
+    sums = _bucket_sums(
+        connection,
+        {window: _as_datetimes([start])[0] for window, start in bucket_starts.items()},
+        now_ns,
+        store_ids,
+    ).reindex(stores["store_id"], fill_value=0)
+    closed_active, closed_inactive = _closed_before(
+        connection, reference_data, stores, store_ids, bucket_starts, window_starts
+    )
+
+    # the open segments of every window, measured together: a store's first
+    # status also covers the time before its first poll, and its last status
+    # holds up to now
+    count = len(windows)
+    store_codes = np.tile(stores["store_id"].to_numpy(dtype=np.int64), count)
+    starts = np.repeat([window_starts[window] for window in windows], len(stores))
+    head_end = np.minimum(np.tile(stores["first_seen"].to_numpy(), count), now_ns)
+    head = np.where(
+        head_end > starts,
+        _business_time(
+            reference_data, store_codes, starts, np.maximum(head_end, starts)
+        ),
+        0,
+    ).reshape(count, -1)
+    tail_start = np.maximum(np.tile(stores["last_seen"].to_numpy(), count), starts)
+    tail = np.where(
+        tail_start < now_ns,
+        _business_time(
+            reference_data,
+            store_codes,
+            np.minimum(tail_start, now_ns),
+            np.full(len(store_codes), now_ns),
+        ),
+        0,
+    ).reshape(count, -1)
+
+    first_active = (stores["first_status"] == "active").to_numpy()
+    last_active = (stores["last_status"] == "active").to_numpy()
+    report = stores[["store_id", "status"]].reset_index(drop=True)
+    for position, (window, (_, unit)) in enumerate(uptime.WINDOWS.items()):
+        up = sums[f"active_ns_{window}"].to_numpy(dtype=np.int64)
+        down = sums[f"inactive_ns_{window}"].to_numpy(dtype=np.int64)
+        up = up - closed_active[position]
+        down = down - closed_inactive[position]
+        up = (
+            up
+            + np.where(first_active, head[position], 0)
+            + np.where(last_active, tail[position], 0)
+        )
+        down = (
+            down
+            + np.where(first_active, 0, head[position])
+            + np.where(last_active, 0, tail[position])
+        )
+        report[f"uptime_{window}"] = (up / unit.value).round(2)
+        report[f"downtime_{window}"] = (down / unit.value).round(2)
+    return report
+
+
+def compute_uptime_downtime(
+    connection,
+    now=None,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+) -> pd.DataFrame:
+    """
+    The time-weighted report of uptime.time_weighted_uptime_downtime, summed
+    from the rollups.
+
+    Reads one latest-status row per store, a week of buckets and the polls
+    of the hour before each window, so its cost does not grow with the
+    length of the status history. Stores are returned in store_id order.
+    """
+    report = _window_totals(
+        connection,
+        now=now,
+        reference_data=reference.load(menu_hours_path, timezones_path),
+    )
+    return report[["store_id"] + uptime.METRIC_COLUMNS].reset_index(drop=True)
+
+
+def compute_store_uptime(
+    connection,
+    store_ids,
+    now=None,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    The report rows of the given stores, plus their current status.
+
+    Only the stores' own rows of the rollup and status tables are read,
+    through their primary keys. Unlike the report, stores that are not
+    currently active are included. Stores without rollups are left out; the
+    rest are returned as dicts, in store_id order.
+    """
+    if len(store_ids) == 0:
+        return []
+    report = _window_totals(
+        connection,
+        [int(store_id) for store_id in store_ids],
+        now,
+        reference.load(menu_hours_path, timezones_path),
+    )
+    return [
+        {
+            "store_id": int(row["store_id"]),
+            "status": row["status"],
+            **{column: float(row[column]) for column in uptime.METRIC_COLUMNS},
+        }
+        for row in report.to_dict("records")
+    ]
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Maintain the status rollups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="recompute the rollups from test__store_status")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild(engine)
@@ -0,0 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import reference
+import snapshot
+import uptime
+
+
+def shard_of(store_ids, n_shards) -> np.ndarray:
+    """Hash-partitions store_ids into n_shards (Fibonacci hashing of the id)."""
+    hashed = np.asarray(store_ids, dtype=np.int64).view(np.uint64) * np.uint64(
+        0x9E3779B97F4A7C15
+    )
+    return ((hashed >> np.uint64(32)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def _report_shard(shard, n_shards, now, status_path, menu_hours_path, timezones_path):
+    """
+    Computes the report rows of the stores in one shard.
+
+    The observations are memory-mapped from the status snapshot, so workers
+    share its pages instead of receiving a pickled copy. Every shard is
+    computed at the same `now`, the newest observation of the whole fleet.
+    Returns the shard's report with a first_row column for restoring the
+    serial row order.
+    """
+    df = snapshot.load_status(status_path)
+    store_ids = df["store_id"].to_numpy()
+    rows = np.flatnonzero(shard_of(store_ids, n_shards) == shard)
+
+    reference_data = reference.load(menu_hours_path, timezones_path)
+    data = df.iloc[rows].reset_index(drop=True)
+    result = uptime.time_weighted_uptime_downtime(
+        data, reference_data.intervals, now, zones=reference_data.zones
+    )
+    first_ids, first = np.unique(store_ids[rows], return_index=True)
+    result["first_row"] = rows[first][np.searchsorted(first_ids, result["store_id"])]
+    return result
+
+
+def compute_report(
+    workers,
+    status_path="store_status.csv",
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Computes the uptime/downtime report on `workers` processes.
+
+    Stores are hash-partitioned into one shard per worker; every store's
+    metrics depend only on its own observations, so the shard results are
+    simply concatenated, in the same row order as the single-process report.
+    Returns the report and the UTC date it is computed for.
+    """
+    # build the snapshot and the reference data once, before the workers
+    # race to do it
+    now = snapshot.load_status(status_path)["timestamp_utc"].max()
+    reference.build(menu_hours_path, timezones_path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(
+            pool.map(
+                _report_shard,
+                range(workers),
+                [workers] * workers,
+                [now] * workers,
+                [status_path] * workers,
+                [menu_hours_path] * workers,
+                [timezones_path] * workers,
+            )
+        )
+
+    report = pd.concat(parts, ignore_index=True).sort_values("first_row")
+    return report.drop(columns="first_row").reset_index(drop=True), now.date()
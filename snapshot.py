@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import uptime
+
+SNAPSHOT_DIR = "snapshot"
+STATUSES = ["inactive", "active"]
+# the status csv is parsed this many rows at a time, so its text is never
+# all in memory at once
+CHUNK_ROWS = 1_000_000
+
+
+def _stem(source):
+    # files with the same name in different directories get separate snapshots
+    name = os.path.splitext(os.path.basename(source))[0]
+    location = hashlib.sha256(os.path.abspath(source).encode()).hexdigest()[:8]
+    return f"{name}-{location}"
+
+
+def _pointer_path(source, snapshot_dir):
+    return os.path.join(snapshot_dir, f"{_stem(source)}.json")
+
+
+def _read_pointer(source, snapshot_dir):
+    """Returns the pointer of the current snapshot of `source`, or None."""
+    try:
+        with open(_pointer_path(source, snapshot_dir)) as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if pointer.get("source") != os.path.abspath(source):
+        return None
+    return pointer
+
+
+def _stat(source):
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def checksum(source, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Returns the sha256 hex digest of a source file.
+
+    The digest recorded with the file's snapshot is reused while the file's
+    size and mtime are unchanged, so an unchanged file is not read again.
+    """
+    pointer = _read_pointer(source, snapshot_dir)
+    if pointer is not None and pointer["stat"] == _stat(source):
+        return pointer["sha256"]
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode_status(df):
+    timestamps = pd.to_datetime(
+        df["timestamp_utc"].str.removesuffix(" UTC"), format="ISO8601", utc=True
+    )
+    columns = {
+        "store_id": df["store_id"].to_numpy(dtype=np.int64),
+        "active": (df["status"] == "active").to_numpy(dtype=np.uint8),
+        "timestamp_ns": uptime.epoch_ns(timestamps),
+    }
+    return columns, {}
+
+
+def _decode_status(columns, meta):
+    timestamps = pd.DatetimeIndex(columns["timestamp_ns"].view("datetime64[ns]"))
+    return pd.DataFrame(
+        {
+            "store_id": columns["store_id"],
+            "status": pd.Categorical.from_codes(columns["active"], STATUSES),
+            "timestamp_utc": timestamps.tz_localize("UTC"),
+        },
+        copy=False,
+    )
+
+
+def _encode_timezones(df):
+    codes, timezones = pd.factorize(df["timezone_str"])
+    columns = {
+        "store_id": df["store_id"].to_numpy(dtype=np.int64),
+        "timezone": codes.astype(np.int32),
+    }
+    return columns, {"timezones": list(timezones)}
+
+
+def _decode_timezones(columns, meta):
+    return pd.DataFrame(
+        {
+            "store_id": columns["store_id"],
+            "timezone_str": pd.Categorical.from_codes(
+                columns["timezone"], meta["timezones"]
+            ),
+        },
+        copy=False,
+    )
+
+
+def _encode_business_hours(df):
+    columns = {
+        "store_id": df["store_id"].to_numpy(dtype=np.int64),
+        "day": df["day"].to_numpy(dtype=np.int8),
+    }
+    for column in ("start_time_local", "end_time_local"):
+        codes, times = pd.factorize(df[column])
+        seconds = pd.to_timedelta(times).total_seconds().to_numpy(dtype=np.int32)
+        columns[column] = seconds[codes]
+    return columns, {}
+
+
+def _format_seconds(seconds):
+    # the local times keep the "%H:%M:%S" strings of the source csv
+    codes, uniques = pd.factorize(seconds)
+    strings = np.array(
+        [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in uniques],
+        dtype=object,
+    )
+    return strings[codes]
+
+
+def _decode_business_hours(columns, meta):
+    return pd.DataFrame(
+        {
+            "store_id": columns["store_id"],
+            "day": columns["day"],
+            "start_time_local": _format_seconds(columns["start_time_local"]),
+            "end_time_local": _format_seconds(columns["end_time_local"]),
+        },
+        copy=False,
+    )
+
+
+DATASETS = {
+    "status": (_encode_status, _decode_status),
+    "timezones": (_encode_timezones, _decode_timezones),
+    "business_hours": (_encode_business_hours, _decode_business_hours),
+}
+# kinds whose rows are encoded independently of each other
+CHUNKED = {"status"}
+
+
+def _encode(source, kind):
+    encode, _ = DATASETS[kind]
+    if kind not in CHUNKED:
+        return encode(pd.read_csv(source))
+    parts = [encode(chunk)[0] for chunk in pd.read_csv(source, chunksize=CHUNK_ROWS)]
+    if not parts:
+        return encode(pd.read_csv(source))
+    return {
+        column: np.concatenate([part[column] for part in parts]) for column in parts[0]
+    }, {}
+
+
+def _write_pointer(source, snapshot_dir, pointer):
+    path = _pointer_path(source, snapshot_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(pointer, f)
+    os.replace(tmp_path, path)
+
+
+def build(source, kind, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Parses a source csv once and writes its columns as .npy files.
+
+    Each snapshot lives in its own directory named after the source's checksum,
+    so readers of an older snapshot are never disturbed by a rebuild.
+    Returns the snapshot's pointer.
+    """
+    stat = _stat(source)
+    sha256 = checksum(source, snapshot_dir)
+    directory = os.path.join(snapshot_dir, f"{_stem(source)}-{sha256[:16]}")
+
+    if not os.path.isdir(directory):
+        columns, meta = _encode(source, kind)
+        tmp_directory = f"{directory}.{os.getpid()}.tmp"
+        os.makedirs(tmp_directory, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(tmp_directory, f"{column}.npy"), values)
+        with open(os.path.join(tmp_directory, "manifest.json"), "w") as f:
+            json.dump({"kind": kind, "columns": list(columns), "meta": meta}, f)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # another process built the same snapshot first
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    previous = _read_pointer(source, snapshot_dir)
+    pointer = {
+        "source": os.path.abspath(source),
+        "stat": stat,
+        "sha256": sha256,
+        "directory": os.path.basename(directory),
+    }
+    _write_pointer(source, snapshot_dir, pointer)
+    if previous is not None and previous["directory"] != pointer["directory"]:
+        shutil.rmtree(
+            os.path.join(snapshot_dir, previous["directory"]), ignore_errors=True
+        )
+    return pointer
+
+
+def load(source, kind, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Returns a source csv as a DataFrame backed by memory-mapped snapshot columns.
+
+    The snapshot is (re)built when it is missing or the source's checksum no
+    longer matches it.
+    """
+    pointer = _read_pointer(source, snapshot_dir)
+    if pointer is None or pointer["stat"] != _stat(source):
+        if pointer is None or pointer["sha256"] != checksum(source, snapshot_dir):
+            pointer = build(source, kind, snapshot_dir)
+        else:
+            # touched but unchanged; remember the new stat to skip rehashing
+            pointer["stat"] = _stat(source)
+            _write_pointer(source, snapshot_dir, pointer)
+
+    directory = os.path.join(snapshot_dir, pointer["directory"])
+    if not os.path.isdir(directory):
+        pointer = build(source, kind, snapshot_dir)
+        directory = os.path.join(snapshot_dir, pointer["directory"])
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    columns = {
+        column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+        for column in manifest["columns"]
+    }
+    _, decode = DATASETS[manifest["kind"]]
+    return decode(columns, manifest["meta"])
+
+
+def discard(source, snapshot_dir=SNAPSHOT_DIR):
+    """Removes the snapshot of a source file, e.g. before deleting the file."""
+    pointer = _read_pointer(source, snapshot_dir)
+    if pointer is not None:
+        os.remove(_pointer_path(source, snapshot_dir))
+        shutil.rmtree(
+            os.path.join(snapshot_dir, pointer["directory"]), ignore_errors=True
+        )
+
+
+def load_status(path="store_status.csv", snapshot_dir=SNAPSHOT_DIR):
+    """store_id (int64), status (categorical) and timestamp_utc (UTC datetimes)."""
+    return load(path, "status", snapshot_dir)
+
+
+def load_timezones(path="timezones.csv", snapshot_dir=SNAPSHOT_DIR):
+    """store_id (int64) and timezone_str (categorical)."""
+    return load(path, "timezones", snapshot_dir)
+
+
+def load_business_hours(path="menu_hours.csv", snapshot_dir=SNAPSHOT_DIR):
+    """store_id, day and the "%H:%M:%S" start_time_local/end_time_local strings."""
+    return load(path, "business_hours", snapshot_dir)
+
+
+if __name__ == "__main__":
+    for source, kind in (
+        ("store_status.csv", "status"),
+        ("timezones.csv", "timezones"),
+        ("menu_hours.csv", "business_hours"),
+    ):
+        pointer = build(source, kind)
+        print(f"{source}: {pointer['directory']}")
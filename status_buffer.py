@@ -0,0 +1,259 @@
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import snapshot
+
+# buffered observations that trigger a flush, and the longest they wait for one
+STATUS_FLUSH_ROWS = int(os.environ.get("STATUS_FLUSH_ROWS", "50000"))
+STATUS_FLUSH_SECONDS = float(os.environ.get("STATUS_FLUSH_SECONDS", "1.0"))
+# observations a process may hold before new batches wait for a flush
+STATUS_BUFFER_MAX_ROWS = int(os.environ.get("STATUS_BUFFER_MAX_ROWS", "500000"))
+# most observations one request may carry, and how long it waits for room
+MAX_BATCH_ROWS = 100_000
+SUBMIT_TIMEOUT_SECONDS = 5.0
+# ingest feed name of the flushed observations, for their high-water mark
+SOURCE = "api"
+
+COLUMNS = ["store_id", "status", "timestamp_utc"]
+# the range of the status table's BigInteger store_id
+INT64_MIN, INT64_MAX = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+
+_lock = threading.Lock()
+# signalled when observations are added, flushed, or the flusher should stop
+_changed = threading.Condition(_lock)
+# buffered frames, oldest first; _state["rows"] also counts the frames being
+# flushed, so a slow database holds writers back
+_pending = []
+_state = {"rows": 0, "oldest": None, "thread": None, "stop": False}
+buffer_stats = {
+    "accepted": 0,
+    "rejected": 0,
+    "flushed": 0,
+    "flushes": 0,
+    "flush_errors": 0,
+}
+
+
+def _invalid(position, message):
+    return ValueError(f"observation {position}: {message}")
+
+
+def _records_to_columns(records):
+    """Splits a list of observation objects into one list per column."""
+    try:
+        return [[record[column] for record in records] for column in COLUMNS]
+    except (KeyError, TypeError):
+        for position, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise _invalid(position, "expected an object")
+            for column in COLUMNS:
+                if column not in record:
+                    raise _invalid(position, f"missing {column}")
+        raise
+
+
+def parse_observations(body, content_type="application/json") -> pd.DataFrame:
+    """
+    Parses and validates a batch of (store_id, status, timestamp_utc) observations.
+
+    The body is NDJSON, one object per line, when the content type says so,
+    and JSON otherwise: an array of objects, or an object of three
+    equal-length column arrays, the compact form. Columns are checked as
+    whole arrays rather than as one model per observation: store_id must be
+    a 64-bit integer, status "active" or "inactive", and timestamp_utc an ISO 8601
+    time (naive times, and the " UTC" suffix of the status feed, are UTC).
+    Raises ValueError naming the first bad observation.
+    """
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            records = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            records = json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"malformed JSON: {e}") from None
+
+    if isinstance(records, dict):
+        missing = [column for column in COLUMNS if column not in records]
+        if missing:
+            raise ValueError(f"missing columns: {', '.join(missing)}")
+        columns = [records[column] for column in COLUMNS]
+        if not all(isinstance(values, list) for values in columns):
+            raise ValueError("columns must be arrays")
+        if len({len(values) for values in columns}) > 1:
+            raise ValueError("columns differ in length")
+    elif isinstance(records, list):
+        columns = _records_to_columns(records)
+    else:
+        raise ValueError("expected an array of observations")
+    store_ids, statuses, timestamps = columns
+    if len(store_ids) > MAX_BATCH_ROWS:
+        raise ValueError(f"at most {MAX_BATCH_ROWS} observations per request")
+
+    # JSON true/false parse as bools, which are ints to Python and NumPy
+    bad = next(
+        (
+            position
+            for position, value in enumerate(store_ids)
+            if type(value) is not int or not INT64_MIN <= value <= INT64_MAX
+        ),
+        None,
+    )
+    if bad is not None:
+        raise _invalid(bad, "store_id must be a 64-bit integer")
+    store_ids = np.asarray(store_ids, dtype=np.int64)
+    statuses = pd.Series(statuses, dtype=object)
+    known = statuses.isin(snapshot.STATUSES).to_numpy()
+    if not known.all():
+        raise _invalid(int(np.argmin(known)), "status must be active or inactive")
+    timestamps = pd.Series(timestamps, dtype=object)
+    is_text = timestamps.map(type).eq(str).to_numpy()
+    if not is_text.all():
+        raise _invalid(int(np.argmin(is_text)), "timestamp_utc must be a string")
+    parsed = pd.to_datetime(
+        timestamps.str.removesuffix(" UTC"), utc=True, format="ISO8601", errors="coerce"
+    )
+    if parsed.isna().any():
+        raise _invalid(int(np.argmax(parsed.isna())), "timestamp_utc is not a time")
+
+    return pd.DataFrame(
+        {
+            "store_id": store_ids,
+            "status": statuses,
+            "timestamp_utc": parsed,
+        }
+    )
+
+
+def _write(engine, observations):
+    """Appends observations through the status delta ingest, in one bulk load."""
+    csv_file = io.StringIO()
+    observations.to_csv(csv_file, index=False, date_format="%Y-%m-%d %H:%M:%S.%f UTC")
+    csv_file.seek(0)
+    # pollers' batches interleave in time, so rows behind the feed's
+    # high-water mark are kept; already stored observations are still skipped
+    return ingest.ingest_status_delta(
+        engine, SOURCE, csv_file, since_high_water_mark=False
+    )
+
+
+def _flush_pending(engine):
+    """
+    Writes every buffered frame. Returns the number of observations written,
+    or None when the write failed and they were put back for the next flush.
+    """
+    with _lock:
+        frames = _pending[:]
+        _pending.clear()
+        _state["oldest"] = None
+    if not frames:
+        return 0
+    observations = pd.concat(frames, ignore_index=True)
+    try:
+        _write(engine, observations)
+    except Exception as e:
+        print(f"Flushing {len(observations)} buffered observations failed: {e}")
+        with _lock:
+            _pending.insert(0, observations)
+            _state["oldest"] = time.monotonic()
+            buffer_stats["flush_errors"] += 1
+        return None
+    with _lock:
+        _state["rows"] -= len(observations)
+        buffer_stats["flushed"] += len(observations)
+        buffer_stats["flushes"] += 1
+        _changed.notify_all()
+    return len(observations)
+
+
+def _flusher(engine):
+    """
+    Flushes the buffer once it holds STATUS_FLUSH_ROWS observations or its
+    oldest have waited STATUS_FLUSH_SECONDS, until stop() is called.
+    """
+    while True:
+        with _lock:
+            while not _state["stop"]:
+                if _pending:
+                    waited = time.monotonic() - _state["oldest"]
+                    due = _state["rows"] >= STATUS_FLUSH_ROWS
+                    if due or waited >= STATUS_FLUSH_SECONDS:
+                        break
+                    _changed.wait(STATUS_FLUSH_SECONDS - waited)
+                else:
+                    _changed.wait()
+            stopping = _state["stop"]
+        if _flush_pending(engine) is None and not stopping:
+            # the database is failing; retry later rather than in a loop
+            time.sleep(STATUS_FLUSH_SECONDS)
+        if stopping:
+            return
+
+
+def submit(engine, observations, timeout=SUBMIT_TIMEOUT_SECONDS):
+    """
+    Adds validated observations to this process's write buffer.
+
+    The buffer is written to the database in bulk by a background thread,
+    started here on first use. When it already holds STATUS_BUFFER_MAX_ROWS
+    observations the call waits up to `timeout` seconds for a flush to make
+    room, then raises TimeoutError, so clients back off instead of the
+    buffer growing without bound.
+    Returns the number of observations now buffered.
+    """
+    rows = len(observations)
+    deadline = time.monotonic() + timeout
+    with _lock:
+        # a batch larger than the buffer is let in once the buffer is empty
+        while _state["rows"] and _state["rows"] + rows > STATUS_BUFFER_MAX_ROWS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                buffer_stats["rejected"] += rows
+                raise TimeoutError("status buffer is full")
+            _changed.wait(remaining)
+        if _state["thread"] is None:
+            _state["stop"] = False
+            _state["thread"] = threading.Thread(
+                target=_flusher, args=(engine,), name="status-flusher", daemon=True
+            )
+            _state["thread"].start()
+        if rows:
+            _pending.append(observations)
+            _state["rows"] += rows
+            if _state["oldest"] is None:
+                _state["oldest"] = time.monotonic()
+            buffer_stats["accepted"] += rows
+            _changed.notify_all()
+        return _state["rows"]
+
+
+def flush(engine):
+    """Writes the buffer now. Returns the number of observations written."""
+    return _flush_pending(engine)
+
+
+def stop():
+    """Stops the flusher after writing what is still buffered."""
+    with _lock:
+        thread = _state["thread"]
+        _state["stop"] = True
+        _changed.notify_all()
+    if thread is not None:
+        thread.join()
+    with _lock:
+        _state["thread"] = None
+
+
+def buffer_info():
+    with _lock:
+        return {
+            **buffer_stats,
+            "buffered": _state["rows"],
+            "max_buffered": STATUS_BUFFER_MAX_ROWS,
+        }
@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+
+import models
+import rollups
+
+# stores kept in each process's lookup cache
+STORE_CACHE_SIZE = int(os.environ.get("STORE_CACHE_SIZE", "100000"))
+# most stores a batch lookup may ask for
+MAX_BATCH = 1000
+
+watermarks = models.IngestWatermark.__table__
+loaded_sources = models.LoadedSource.__table__
+
+_lock = threading.Lock()
+# store_id -> its row (None for stores without rollups), least recently used first
+_cache = OrderedDict()
+_state = {"version": None, "now": None}
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def data_version(connection):
+    """
+    A token that changes whenever observations are ingested, or the rollups
+    are rebuilt for new business hours or timezones.
+
+    Read from the ingest high-water marks and the rollups' recorded version,
+    so ingests by other processes are seen too; it is a single-row query on
+    a table of one row per feed.
+    """
+    rollup_version = (
+        select(loaded_sources.c.version)
+        .where(loaded_sources.c.table_name == rollups.buckets.name)
+        .scalar_subquery()
+    )
+    return tuple(
+        connection.execute(
+            select(
+                func.count(),
+                func.sum(watermarks.c.rows),
+                func.max(watermarks.c.high_water_mark),
+                rollup_version,
+            )
+        ).one()
+    )
+
+
+def lookup(
+    connection,
+    store_ids,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Returns {store_id: row} for the given stores in their order, None for
+    unknown stores.
+
+    A row holds the store's current status and the report metrics from
+    rollups.compute_store_uptime. Rows are served from an LRU of
+    STORE_CACHE_SIZE stores, which is emptied when the data version changes,
+    and only the stores missing from it are read from the rollups, in one query.
+    The business hours and timezones files must be the ones ingest loaded.
+    """
+    store_ids = list(dict.fromkeys(int(store_id) for store_id in store_ids))
+    version = data_version(connection)
+    results = {}
+    missing = []
+    with _lock:
+        if version != _state["version"]:
+            _cache.clear()
+            _state["version"] = version
+            _state["now"] = None
+            cache_stats["invalidations"] += 1
+        for store_id in store_ids:
+            if store_id in _cache:
+                _cache.move_to_end(store_id)
+                results[store_id] = _cache[store_id]
+            else:
+                missing.append(store_id)
+        cache_stats["hits"] += len(store_ids) - len(missing)
+        cache_stats["misses"] += len(missing)
+        now = _state["now"]
+    if not missing:
+        return results
+
+    if now is None:
+        now = rollups.newest_observation(connection)
+    rows = rollups.compute_store_uptime(
+        connection, missing, now, menu_hours_path, timezones_path
+    )
+    found = {row["store_id"]: row for row in rows}
+    with _lock:
+        # a lookup that raced with an ingest must not cache its older rows
+        current = _state["version"] == version
+        if current:
+            _state["now"] = now
+        for store_id in missing:
+            results[store_id] = found.get(store_id)
+            if current:
+                _cache[store_id] = results[store_id]
+        while len(_cache) > STORE_CACHE_SIZE:
+            _cache.popitem(last=False)
+            cache_stats["evictions"] += 1
+    return {store_id: results[store_id] for store_id in store_ids}
+
+
+def clear():
+    """Empties this process's cache."""
+    with _lock:
+        _cache.clear()
+
+
+def cache_info():
+    with _lock:
+        return {**cache_stats, "stores": len(_cache), "max_stores": STORE_CACHE_SIZE}
@@ -0,0 +1,107 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+POLL_INTERVAL = pd.Timedelta(hours=1)
+CHUNK_STORES = 5_000
+
+
+def _format_timestamps(timestamps_ns):
+    """Formats epoch-ns as store_status.csv does, "2023-01-22 12:09:39.388884 UTC"."""
+    # much faster than strftime for millions of rows
+    strings = np.datetime_as_string(
+        timestamps_ns.view("datetime64[ns]").astype("datetime64[us]")
+    )
+    return pd.Series(strings).str.replace("T", " ", regex=False) + " UTC"
+
+
+def generate_fleet(
+    directory,
+    stores,
+    days=7,
+    end="2023-01-25 18:00:00",
+    uptime=0.9,
+    seed=0,
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+):
+    """
+    Writes timezones.csv, menu_hours.csv and store_status.csv for a made-up fleet.
+
+    The fleet is shaped like the bundled files. Each store copies the
+    timezone and the business hours of a random bundled store, and is polled
+    about once an hour for `days` days up to `end`, with jitter. Each store
+    is active with its own probability, drawn around `uptime`.
+    Returns the three paths.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    store_ids = rng.choice(2**62, size=stores, replace=False).astype(np.int64)
+
+    timezones = pd.read_csv(timezones_path)
+    timezone_df = pd.DataFrame(
+        {
+            "store_id": store_ids,
+            "timezone_str": timezones["timezone_str"].to_numpy()[
+                rng.integers(len(timezones), size=stores)
+            ],
+        }
+    )
+
+    # every store reuses the weekly schedule of one bundled store
+    menu_hours = pd.read_csv(menu_hours_path)
+    templates = menu_hours["store_id"].unique()
+    template_of = pd.Series(
+        templates[rng.integers(len(templates), size=stores)], index=store_ids
+    )
+    menu_hours_df = menu_hours.merge(
+        template_of.rename("template").rename_axis("store_id").reset_index(),
+        left_on="store_id",
+        right_on="template",
+        suffixes=("_template", ""),
+    )[["store_id", "day", "start_time_local", "end_time_local"]]
+
+    paths = (
+        os.path.join(directory, "timezones.csv"),
+        os.path.join(directory, "menu_hours.csv"),
+        os.path.join(directory, "store_status.csv"),
+    )
+    timezone_df.to_csv(paths[0], index=False)
+    menu_hours_df.to_csv(paths[1], index=False)
+
+    polls = int(pd.Timedelta(days=days) / POLL_INTERVAL)
+    start = pd.Timestamp(end, tz="UTC") - polls * POLL_INTERVAL
+    poll_times = start.value + np.arange(polls, dtype=np.int64) * POLL_INTERVAL.value
+    # written a few thousand stores at a time, so large fleets fit in memory
+    with open(paths[2], "w", newline="") as f:
+        f.write("store_id,status,timestamp_utc\n")
+        for first in range(0, stores, CHUNK_STORES):
+            chunk = store_ids[first : first + CHUNK_STORES]
+            jitter = rng.integers(POLL_INTERVAL.value, size=(len(chunk), polls))
+            store_uptime = np.clip(rng.normal(uptime, 0.05, size=len(chunk)), 0, 1)
+            active = rng.random((len(chunk), polls)) < store_uptime[:, None]
+            order = rng.permutation(len(chunk) * polls)
+            pd.DataFrame(
+                {
+                    "store_id": np.repeat(chunk, polls)[order],
+                    "status": np.where(active.ravel(), "active", "inactive")[order],
+                    "timestamp_utc": _format_timestamps(
+                        (poll_times + jitter).ravel()[order]
+                    ),
+                }
+            ).to_csv(f, index=False, header=False)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic store fleet")
+    parser.add_argument("directory")
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for path in generate_fleet(args.directory, args.stores, args.days, seed=args.seed):
+        print(path)
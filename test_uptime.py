@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bench
+import chunked
+import crud
+import database
+import ingest
+import pushdown
+import reference
+import rollups
+import snapshot
+import synthetic
+import uptime
+
+
+def _cases(seed, count):
+    """Small random cases, every other one spanning a DST change."""
+    rng = np.random.default_rng(seed)
+    for case in range(count):
+        if case % 2:
+            data, business_hours_df, now, zones = bench.random_dst_case(rng)
+        else:
+            (data, business_hours_df, now), zones = bench.random_case(rng), None
+        yield data, uptime.business_hours_intervals(business_hours_df), now, zones
+
+
+@pytest.mark.parametrize("rule", ["previous", "nearest"])
+def test_time_weighted_matches_brute_force(rule):
+    for data, intervals, now, zones in _cases(0, 20):
+        report = uptime.time_weighted_uptime_downtime(data, intervals, now, rule, zones)
+        expected = bench.brute_force_uptime(data, intervals, now, rule, zones)
+        for row in report.itertuples(index=False):
+            for window, (length, unit) in uptime.WINDOWS.items():
+                up = getattr(row, f"uptime_{window}")
+                down = getattr(row, f"downtime_{window}")
+                scale = pd.Timedelta(minutes=1) / unit
+                # values are rounded to 2 decimals of their unit
+                reference = expected[row.store_id]
+                assert up == pytest.approx(
+                    reference[f"uptime_{window}"] * scale, abs=0.005
+                )
+                assert down == pytest.approx(
+                    reference[f"downtime_{window}"] * scale, abs=0.005
+                )
+                assert (up + down) * unit <= length + pd.Timedelta(minutes=1)
+            assert row.uptime_last_day <= row.uptime_last_week
+            assert row.uptime_last_hour / 60 <= row.uptime_last_day + 0.005
+
+
+def _reference(intervals, zones, stores=5):
+    """ReferenceData of a case's intervals and zones, UTC when it has none."""
+    store_ids = np.arange(stores)
+    zone_codes, zone_names = zones(store_ids) if zones else (np.zeros(stores), ["UTC"])
+    return reference.ReferenceData(
+        {
+            "hours_store_ids": intervals[0].to_numpy(dtype=np.int64),
+            "starts": intervals[1],
+            "ends": intervals[2],
+            "timezone_store_ids": store_ids,
+            "timezone_codes": np.asarray(zone_codes, dtype=np.int32),
+        },
+        zone_names,
+    )
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 50])
+def test_chunked_report_matches_in_memory(chunk_rows):
+    for data, intervals, now, zones in _cases(1, 10):
+        reference_data = _reference(intervals, zones)
+        expected = uptime.time_weighted_uptime_downtime(
+            data, intervals, now, zones=reference_data.zones
+        )
+        rows = data.sort_values(["store_id", "timestamp_utc"], ignore_index=True)
+        chunks = (
+            rows.iloc[first : first + chunk_rows]
+            for first in range(0, len(rows), chunk_rows)
+        )
+        parts = list(chunked.iter_report(chunks, reference_data, now))
+        pd.testing.assert_frame_equal(
+            pd.concat(parts, ignore_index=True),
+            expected.sort_values("store_id", ignore_index=True),
+        )
+
+
+@pytest.fixture(scope="module")
+def fleet(tmp_path_factory):
+    """A small synthetic fleet over a DST change, loaded into SQLite."""
+    directory = tmp_path_factory.mktemp("fleet")
+    timezones_path, menu_hours_path, status_path = synthetic.generate_fleet(
+        str(directory), 40, days=9, end="2023-03-14 18:00:00"
+    )
+    engine = database.make_engine(f"sqlite:///{directory}/test.db")
+    ingest.warm_up(
+        engine,
+        {
+            "test__stores": timezones_path,
+            "test__business_hours": menu_hours_path,
+            "test__store_status": status_path,
+        },
+    )
+    data, reference_data, now = crud.load_report_inputs(
+        status_path, menu_hours_path, timezones_path
+    )
+    expected = uptime.time_weighted_uptime_downtime(
+        data, reference_data.intervals, now, zones=reference_data.zones
+    )
+    yield engine, menu_hours_path, timezones_path, expected
+    engine.dispose()
+    for path in (timezones_path, menu_hours_path, status_path):
+        snapshot.discard(path)
+
+
+def test_rollups_match_in_memory(fleet):
+    engine, menu_hours_path, timezones_path, expected = fleet
+    with engine.connect() as connection:
+        actual = rollups.compute_uptime_downtime(
+            connection, menu_hours_path=menu_hours_path, timezones_path=timezones_path
+        )
+    pd.testing.assert_frame_equal(
+        actual, expected.sort_values("store_id", ignore_index=True), check_dtype=False
+    )
+
+
+def test_pushdown_matches_in_memory(fleet):
+    engine, _, _, expected = fleet
+    with engine.connect() as connection:
+        actual = pushdown.compute_uptime_downtime(connection)
+    pd.testing.assert_frame_equal(
+        actual, expected.sort_values("store_id", ignore_index=True)
+    )
@@ -0,0 +1,347 @@
+import numpy as np
+import pandas as pd
+
+import localtime
+
+# 15-minute slots in one day, matching pd.date_range("00:00", "23:59", freq="15min")
+SLOT = pd.Timedelta("15min")
+SLOTS_PER_DAY = 96
+
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+# 1970-01-01 was a Thursday; shifts epoch seconds to seconds since a Monday 00:00
+EPOCH_WEEKDAY_SECONDS = 3 * DAY_SECONDS
+
+METRIC_COLUMNS = [
+    "uptime_last_hour",
+    "uptime_last_day",
+    "uptime_last_week",
+    "downtime_last_hour",
+    "downtime_last_day",
+    "downtime_last_week",
+]
+
+
+def epoch_ns(timestamps: pd.Series) -> np.ndarray:
+    """Returns a datetime Series as int64 nanoseconds since the epoch (UTC)."""
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert("UTC").dt.tz_localize(None)
+    return timestamps.to_numpy().astype("datetime64[ns]").view("int64")
+
+
+def _seconds_of_day(times: pd.Series) -> np.ndarray:
+    codes, uniques = pd.factorize(times)
+    return pd.to_timedelta(uniques).total_seconds().to_numpy(dtype=np.int64)[codes]
+
+
+def business_hours_intervals(business_hours_df: pd.DataFrame):
+    """
+    Build sorted, per-store business-hours intervals over a UTC week.
+
+    Every (store_id, day, start_time_local, end_time_local) row becomes a
+    [start, end) range in seconds since Monday 00:00 UTC, shifted by the row's
+    utc_offset_seconds. Shifts ending at or before their start run past midnight,
+    ranges that run past the end of the week are split in two, and overlapping
+    ranges of a store are merged.
+
+    Returns (stores, starts, ends): a pd.Index of store_ids, and sorted int64
+    arrays keyed as store position * WEEK_SECONDS + second of the week.
+    """
+    stores = pd.Index(np.unique(business_hours_df["store_id"].to_numpy()))
+    codes = stores.get_indexer(business_hours_df["store_id"])
+    start_local = _seconds_of_day(business_hours_df["start_time_local"])
+    end_local = _seconds_of_day(business_hours_df["end_time_local"])
+
+    duration = (end_local - start_local) % DAY_SECONDS
+    duration[duration == 0] = DAY_SECONDS
+    start = (
+        business_hours_df["day"].to_numpy(dtype=np.int64) * DAY_SECONDS
+        + start_local
+        - business_hours_df["utc_offset_seconds"].to_numpy(dtype=np.int64)
+    ) % WEEK_SECONDS
+    end = start + duration
+
+    wraps = end > WEEK_SECONDS
+    codes = np.concatenate([codes, codes[wraps]])
+    start = np.concatenate([start, np.zeros(wraps.sum(), dtype=np.int64)])
+    end = np.concatenate([np.minimum(end, WEEK_SECONDS), end[wraps] - WEEK_SECONDS])
+
+    # keyed by store, so one merge pass covers all; a store's range ending at
+    # the end of the week touches the next store's first key, so never merge
+    # across stores
+    starts = codes * WEEK_SECONDS + start
+    ends = codes * WEEK_SECONDS + end
+    order = np.argsort(starts, kind="stable")
+    starts, ends, codes = starts[order], ends[order], codes[order]
+    opens = np.r_[
+        True,
+        (starts[1:] > np.maximum.accumulate(ends)[:-1]) | (codes[1:] != codes[:-1]),
+    ]
+    first = np.flatnonzero(opens)
+    return stores, starts[first], np.maximum.reduceat(ends, first)
+
+
+def in_business_hours(intervals, store_ids, timestamps_ns) -> np.ndarray:
+    """
+    Tag each observation as inside (True) or outside its store's business hours.
+
+    `intervals` comes from business_hours_intervals. Stores without business
+    hours are outside.
+    """
+    stores, starts, ends = intervals
+    codes = stores.get_indexer(store_ids)
+    seconds = timestamps_ns // 1_000_000_000
+    keys = codes * WEEK_SECONDS + (seconds + EPOCH_WEEKDAY_SECONDS) % WEEK_SECONDS
+
+    position = np.searchsorted(starts, keys, side="right") - 1
+    found = position >= 0
+    inside = np.zeros(len(keys), dtype=bool)
+    inside[found] = keys[found] < ends[position[found]]
+    return inside & (codes >= 0)
+
+
+def slot_counts(codes, timestamps_ns, is_active, n_stores, report_date):
+    """
+    Count active and inactive observations per store in each 15-minute slot of report_date.
+
+    Returns two (n_stores, SLOTS_PER_DAY) integer arrays: uptime and downtime counts.
+    """
+    day_start = pd.Timestamp(report_date).value
+    slot = (timestamps_ns - day_start) // SLOT.value
+    in_day = (slot >= 0) & (slot < SLOTS_PER_DAY)
+
+    flat = codes[in_day] * SLOTS_PER_DAY + slot[in_day]
+    size = n_stores * SLOTS_PER_DAY
+    up = np.bincount(flat[is_active[in_day]], minlength=size)
+    down = np.bincount(flat[~is_active[in_day]], minlength=size)
+    return (
+        up.reshape(n_stores, SLOTS_PER_DAY),
+        down.reshape(n_stores, SLOTS_PER_DAY),
+    )
+
+
+def compute_uptime_downtime(data: pd.DataFrame, report_date) -> pd.DataFrame:
+    """
+    Compute the six uptime/downtime metrics for every currently active store.
+
+    `data` holds the in-business-hours observations (store_id, status, timestamp_utc)
+    and `report_date` is the UTC date whose 15-minute slots are counted.
+    Stores are returned in order of first appearance in `data`.
+    """
+    codes, store_ids = pd.factorize(data["store_id"], sort=False)
+    n_stores = len(store_ids)
+    timestamps_ns = epoch_ns(data["timestamp_utc"])
+    is_active = (data["status"] == "active").to_numpy()
+
+    # sort once by (store, timestamp); the last row of each group is the current status
+    order = np.lexsort((timestamps_ns, codes))
+    sorted_codes = codes[order]
+    last = np.flatnonzero(np.r_[sorted_codes[1:] != sorted_codes[:-1], True])
+    currently_active = is_active[order][last]
+
+    up, down = slot_counts(codes, timestamps_ns, is_active, n_stores, report_date)
+    up_total = up.sum(axis=1)[currently_active]
+    down_total = down.sum(axis=1)[currently_active]
+
+    # Each window is read as the trailing `n` rows of a per-store frame in which
+    # every row holds the store's daily slot counts, so it scales the daily
+    # total by min(n, SLOTS_PER_DAY).
+    hour, day, week = (min(n, SLOTS_PER_DAY) for n in (4, 96, 672))
+    return pd.DataFrame(
+        {
+            "store_id": np.asarray(store_ids)[currently_active],
+            "uptime_last_hour": up_total * hour,
+            "uptime_last_day": up_total * day,
+            "uptime_last_week": up_total * week,
+            "downtime_last_hour": down_total * hour,
+            "downtime_last_day": down_total * day,
+            "downtime_last_week": down_total * week,
+        }
+    )
+
+
+NS = 1_000_000_000
+# the time-weighted report's windows, and the unit each is reported in
+WINDOWS = {
+    "last_hour": (pd.Timedelta(hours=1), pd.Timedelta(minutes=1)),
+    "last_day": (pd.Timedelta(days=1), pd.Timedelta(hours=1)),
+    "last_week": (pd.Timedelta(days=7), pd.Timedelta(hours=1)),
+}
+
+
+def business_hours_before(intervals, codes, timestamps_ns) -> np.ndarray:
+    """
+    Business-hours nanoseconds of each store from a fixed Monday 00:00 UTC up to a time.
+
+    `codes` are positions in the intervals' stores (-1 for stores without
+    business hours, which get 0). The business hours within [a, b) are
+    business_hours_before(b) - business_hours_before(a). Computed from
+    cumulative sums of the interval lengths, so every time costs one searchsorted.
+    """
+    stores, starts, ends = intervals
+    result = np.zeros(len(timestamps_ns), dtype=np.int64)
+    if len(stores) == 0:
+        return result
+
+    # length of all the intervals before each one, and each store's weekly total
+    before = np.r_[0, np.cumsum(ends - starts)]
+    store_codes = np.arange(len(stores)) * WEEK_SECONDS
+    first = np.searchsorted(starts, store_codes)
+    weekly = before[np.searchsorted(starts, store_codes + WEEK_SECONDS)] - before[first]
+
+    known = codes >= 0
+    code = codes[known]
+    shifted = timestamps_ns[known] + EPOCH_WEEKDAY_SECONDS * NS
+    weeks, week_ns = np.divmod(shifted, WEEK_SECONDS * NS)
+    seconds, fraction = np.divmod(week_ns, NS)
+
+    keys = code * WEEK_SECONDS + seconds
+    position = np.searchsorted(starts, keys, side="right") - 1
+    # the store's last interval starting at or before the key, if any
+    started = position >= first[code]
+    position = np.maximum(position, 0)
+    covered = np.where(
+        started,
+        before[position]
+        - before[first[code]]
+        + np.minimum(keys, ends[position])
+        - starts[position],
+        0,
+    )
+    inside = started & (keys < ends[position])
+    result[known] = (
+        weeks * weekly[code] * NS + covered * NS + np.where(inside, fraction, 0)
+    )
+    return result
+
+
+def status_segments(codes, timestamps_ns, now_ns, rule="previous"):
+    """
+    The span each observation's status is attributed to, in one sweep.
+
+    `codes` and `timestamps_ns` must be sorted by (code, timestamp). With the
+    "previous" rule a status holds from its poll until the store's next poll;
+    with "nearest" every instant takes the status of the closest poll. A
+    store's first status also covers the time before its first poll and its
+    last status the time up to now_ns. Returns [start, end) arrays in ns.
+    """
+    if len(codes) == 0:
+        return timestamps_ns, timestamps_ns
+    same_previous = np.r_[False, codes[1:] == codes[:-1]]
+    same_next = np.r_[codes[1:] == codes[:-1], False]
+    if rule == "previous":
+        starts = timestamps_ns
+        ends = np.r_[timestamps_ns[1:], now_ns]
+    elif rule == "nearest":
+        middle = timestamps_ns[:-1] + (timestamps_ns[1:] - timestamps_ns[:-1]) // 2
+        starts = np.r_[np.iinfo(np.int64).min, middle]
+        ends = np.r_[middle, now_ns]
+    else:
+        raise ValueError(f"unknown interpolation rule {rule!r}")
+    starts = np.where(same_previous, starts, np.iinfo(np.int64).min)
+    ends = np.where(same_next, ends, now_ns)
+    return starts, ends
+
+
+def business_hours_between(intervals, codes, start_ns, end_ns, zones=None):
+    """
+    Business-hours nanoseconds of each store within [start_ns, end_ns).
+
+    Without `zones`, times and intervals are in UTC. With `zones`, a pair of
+    localtime zone codes (one per range) and zone names, intervals are of the
+    local week and each range is measured on its store's wall clock. A range
+    is split at the DST transition it contains, so both parts are measured at
+    their own offset; ranges up to a few months long contain at most one.
+    """
+    if zones is None:
+        before_start = business_hours_before(intervals, codes, start_ns)
+        return business_hours_before(intervals, codes, end_ns) - before_start
+    zone_codes, zone_names = zones
+    transition = np.minimum(
+        localtime.next_transitions(start_ns, zone_codes, zone_names), end_ns
+    )
+    before = localtime.utc_offsets(start_ns, zone_codes, zone_names)
+    after = localtime.utc_offsets(transition, zone_codes, zone_names)
+    return (
+        business_hours_before(intervals, codes, transition + before)
+        - business_hours_before(intervals, codes, start_ns + before)
+        + business_hours_before(intervals, codes, end_ns + after)
+        - business_hours_before(intervals, codes, transition + after)
+    )
+
+
+def time_weighted_uptime_downtime(
+    data: pd.DataFrame, intervals, now, rule="previous", zones=None
+) -> pd.DataFrame:
+    """
+    Business-hours uptime and downtime of every currently active store, by time.
+
+    `data` holds status observations (store_id, status, timestamp_utc), inside
+    and outside business hours, and `intervals` comes from
+    business_hours_intervals. The time between polls is attributed by
+    status_segments, and only its overlap with the store's business hours in
+    each window ending at `now` is counted: minutes for the last hour, hours
+    for the last day and week. A store is currently active when its newest
+    poll in business hours is. Stores are returned in order of first
+    appearance in `data`.
+
+    `zones`, a function of store_ids returning their localtime zone codes and
+    zone names (such as ReferenceData.zones), makes `intervals` intervals of
+    the local week, checked on each store's wall clock across DST changes.
+    """
+    codes, store_ids = pd.factorize(data["store_id"], sort=False)
+    timestamps_ns = epoch_ns(data["timestamp_utc"])
+    is_active = (data["status"] == "active").to_numpy()
+    now_ns = pd.Timestamp(now).value
+
+    order = np.lexsort((timestamps_ns, codes))
+    order = order[timestamps_ns[order] <= now_ns]
+    codes, timestamps_ns, is_active = (
+        codes[order],
+        timestamps_ns[order],
+        is_active[order],
+    )
+    store_ids = np.asarray(store_ids)
+    hours_codes = intervals[0].get_indexer(store_ids)[codes]
+    starts, ends = status_segments(codes, timestamps_ns, now_ns, rule)
+    clock_ns = timestamps_ns
+    if zones is not None:
+        store_zones, zone_names = zones(store_ids)
+        row_zones = store_zones[codes]
+        clock_ns = localtime.to_local(timestamps_ns, row_zones, zone_names)
+
+    # the status of each store's newest poll in business hours
+    inside = in_business_hours(intervals, store_ids[codes], clock_ns)
+    polls = np.flatnonzero(inside)
+    newest = polls[np.r_[np.diff(codes[polls]) != 0, True][: len(polls)]]
+    currently_active = np.zeros(len(store_ids), dtype=bool)
+    currently_active[codes[newest]] = is_active[newest]
+
+    report = pd.DataFrame({"store_id": store_ids[currently_active]})
+    totals = {}
+    for window, (length, unit) in WINDOWS.items():
+        window_start = np.maximum(starts, now_ns - length.value)
+        window_end = np.minimum(ends, now_ns)
+        overlaps = window_start < window_end
+        covered = business_hours_between(
+            intervals,
+            hours_codes[overlaps],
+            window_start[overlaps],
+            window_end[overlaps],
+            None if zones is None else (row_zones[overlaps], zone_names),
+        )
+        up = np.bincount(
+            codes[overlaps],
+            weights=np.where(is_active[overlaps], covered, 0),
+            minlength=len(store_ids),
+        )
+        down = np.bincount(
+            codes[overlaps],
+            weights=np.where(is_active[overlaps], 0, covered),
+            minlength=len(store_ids),
+        )
+        totals[f"uptime_{window}"] = up / unit.value
+        totals[f"downtime_{window}"] = down / unit.value
+    for column in METRIC_COLUMNS:
+        report[column] = totals[column][currently_active].round(2)
+    return report
@@ -1,42 +1,87 @@
-import pytz
-from datetime import datetime
-
-
-def convert_utc_to_local(utc_time, timezone_str):
-    """Converts UTC time to local time based on timezone string."""
-    timezone = pytz.timezone(timezone_str)
-    local_time = utc_time.astimezone(timezone)
-    return local_time
-
-
-def get_local_business_hours(business_hours, timezone_str):
-    """Returns business hours in local timezone."""
-    local_business_hours = []
-    for business_hour in business_hours:
-        day_of_week = business_hour.day_of_week
-        start_time = convert_utc_to_local(
-            business_hour.start_time_utc, timezone_str
-        ).time()
-        end_time = convert_utc_to_local(business_hour.end_time_utc, timezone_str).time()
-        local_business_hours.append((day_of_week, start_time, end_time))
-    return local_business_hours
-
-
-def is_within_business_hours(local_datetime, local_business_hours):
-    """Checks if given datetime is within business hours."""
-    day_of_week = local_datetime.weekday()
-    start_time, end_time = None, None
-    for business_hour in local_business_hours:
-        if business_hour[0] == day_of_week:
-            start_time, end_time = business_hour[1], business_hour[2]
-            break
-    if start_time and end_time:
-        return start_time <= local_datetime.time() < end_time
-    else:
-        return False
-
-
-def get_local_time(timezone_str):
-    """Returns current datetime in local timezone."""
-    timezone = pytz.timezone(timezone_str)
-    return datetime.now(timezone)
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone as dt_timezone
+
+import localtime
+import snapshot
+
+DEFAULT_TIMEZONE = "America/Chicago"
+CACHE_DIR = "cache"
+DAY_SECONDS = 24 * 60 * 60
+
+
+def file_exists(path):
+    """Checks if a file exists at the given path."""
+    return os.path.isfile(path)
+
+
+def convert_business_hours_to_utc(business_hours_df, timezone_dict, reference_date):
+    """
+    Adds start_time_utc/end_time_utc ("%H:%M:%S") columns to the business hours.
+
+    Local times are placed on reference_date and converted with
+    localtime.to_utc, so each store gets the UTC offset in effect on that date.
+    That offset (local minus UTC, at the start time) is kept in a
+    utc_offset_seconds column. Other weeks may have other offsets; the reports
+    classify each poll at its own offset with reference.py instead.
+    """
+    business_hours_df = business_hours_df.copy()
+    timezone_codes, timezone_strs = pd.factorize(
+        business_hours_df["store_id"].map(timezone_dict).fillna(DEFAULT_TIMEZONE)
+    )
+    day_start = pd.Timestamp(reference_date).normalize().value
+
+    for column in ("start_time", "end_time"):
+        # only the distinct local times are parsed, and the distinct UTC ones formatted
+        time_codes, local_times = pd.factorize(business_hours_df[f"{column}_local"])
+        local_ns = (
+            day_start + pd.to_timedelta(local_times).as_unit("ns").asi8[time_codes]
+        )
+        utc_ns = localtime.to_utc(local_ns, timezone_codes, timezone_strs)
+        utc_codes, utc_seconds = pd.factorize((utc_ns // localtime.NS) % DAY_SECONDS)
+        business_hours_df[f"{column}_utc"] = np.asarray(
+            pd.to_datetime(utc_seconds, unit="s").strftime("%H:%M:%S")
+        )[utc_codes]
+        if column == "start_time":
+            utc_offsets = (local_ns - utc_ns) // localtime.NS
+
+    business_hours_df["utc_offset_seconds"] = utc_offsets
+    return business_hours_df
+
+
+def load_business_hours_utc(
+    menu_hours_path="menu_hours.csv",
+    timezones_path="timezones.csv",
+    reference_date=None,
+    cache_dir=CACHE_DIR,
+):
+    """
+    Returns menu_hours.csv with UTC business hours, memoized on disk.
+
+    The cache entry is keyed on the checksums of both input files and the
+    reference date, so a restart with unchanged inputs skips the conversion.
+    On a miss the inputs are read from their columnar snapshots.
+    """
+    if reference_date is None:
+        reference_date = datetime.now(dt_timezone.utc).date()
+    reference_date = pd.Timestamp(reference_date).date()
+
+    key = snapshot.checksum(menu_hours_path)[:8] + snapshot.checksum(timezones_path)[:8]
+    cache_path = os.path.join(
+        cache_dir, f"business_hours_utc-v3-{key}-{reference_date.isoformat()}.pkl"
+    )
+    if os.path.exists(cache_path):
+        return pd.read_pickle(cache_path)
+
+    timezone_df = snapshot.load_timezones(timezones_path)
+    timezone_dict = dict(zip(timezone_df.store_id, timezone_df.timezone_str))
+    business_hours_df = convert_business_hours_to_utc(
+        snapshot.load_business_hours(menu_hours_path), timezone_dict, reference_date
+    )
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    business_hours_df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return business_hours_df